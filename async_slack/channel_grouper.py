@@ -1,20 +1,120 @@
-from bonobo.config import Configurable, ContextProcessor, use_raw_input
-from bonobo.util import ValueHolder
+import heapq
+import itertools
+import operator
+import pickle
+import tempfile
+from collections import Counter
+
+from bonobo.config import Configurable, ContextProcessor, Option, use_raw_input
+
+
+def channel_key(message):
+    return message.get("channel")
+
+
+def _read_run(run):
+    while True:
+        try:
+            yield pickle.load(run)
+        except EOFError:
+            return
+
+
+class _Groups:
+    """
+    Messages grouped by key, held pickled in memory up to a budget
+
+    Whenever the pickled messages exceed the budget, the groups are
+    written to a temporary file as a run of (key, message) records
+    sorted by key, and memory starts afresh.
+    """
+
+    def __init__(self, memory_budget, spill_directory=None):
+        self._memory_budget = memory_budget
+        self._spill_directory = spill_directory
+        self._groups = {}
+        self._size = 0
+        self._runs = []
+
+    def add(self, key, message):
+        blob = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+        self._groups.setdefault(key, []).append(blob)
+        self._size += len(blob)
+        if self._size > self._memory_budget:
+            self._spill()
+
+    def _sorted_records(self):
+        for key in sorted(self._groups):
+            for blob in self._groups[key]:
+                yield key, blob
+
+    def _spill(self):
+        run = tempfile.TemporaryFile(dir=self._spill_directory)
+        for record in self._sorted_records():
+            pickle.dump(record, run, pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+        self._runs.append(run)
+        self._groups = {}
+        self._size = 0
+
+    def items(self):
+        """
+        Yield each key with its messages, in order of arrival
+
+        Keys come in order of first appearance if nothing was spilled,
+        and in sorted order otherwise.
+        """
+        if not self._runs:
+            for key, blobs in self._groups.items():
+                yield key, [pickle.loads(blob) for blob in blobs]
+            return
+        try:
+            # heapq.merge favours earlier runs on equal keys, so each
+            # group keeps its messages in order of arrival.
+            runs = [_read_run(run) for run in self._runs]
+            runs.append(self._sorted_records())
+            merged = heapq.merge(*runs, key=operator.itemgetter(0))
+            for key, records in itertools.groupby(
+                    merged, key=operator.itemgetter(0)):
+                yield key, [pickle.loads(blob) for _, blob in records]
+        finally:
+            for run in self._runs:
+                run.close()
 
 
 class ChannelGrouper(Configurable):
+    """
+    Group messages by `key`, their channel by default, sending each group
+    once the input is exhausted
+
+    Groups are held in memory up to `memory_budget` bytes of pickled
+    messages, past which they are spilled to sorted runs in temporary
+    files and merged by key at the end, so that only one group is in
+    memory at a time. With `count_only`, only the number of messages in
+    each group is kept, and (key, count) is sent instead.
+    """
+    # bonobo calls callable defaults, so the default is a factory
+    key = Option(default=lambda: channel_key)
+    memory_budget = Option(int, default=1 << 28)
+    spill_directory = Option(str, required=False, default=None)
+    count_only = Option(bool, default=False)
 
     @ContextProcessor
-    def acc(self, context):
-        channels = yield ValueHolder({})
-        for channel, messages in channels.items():
-            context.send(channel, messages)
+    def groups(self, context):
+        if self.count_only:
+            counts = yield Counter()
+            for key, count in counts.items():
+                context.send(key, count)
+        else:
+            groups = yield _Groups(self.memory_budget, self.spill_directory)
+            for key, messages in groups.items():
+                context.send(key, messages)
 
     @use_raw_input
-    def __call__(self, channels, message):
-        channel_id = message.get("channel")
-        if channel_id:
-            current_channels = channels.get()
-            channel = current_channels.setdefault(channel_id, [])
-            channel.append(message)
-            channels.set(current_channels)
+    def __call__(self, groups, message):
+        key = self.key(message)
+        if key:
+            if self.count_only:
+                groups[key] += 1
+            else:
+                groups.add(key, message)
@@ -3,40 +3,32 @@ from bonobo.config import use
 
 from . import slack
 from . import db
-from .dict_utils import map_dictionary
+from .fields import CHANNEL_FIELDS
 
 
 @slack.api_retry
-def get_conversations(client, types, cursor=None):
-    return client.conversations.list(types=types, cursor=cursor)
+@slack.rate_limited("conversations.list")
+def get_conversations(slack, types, cursor=None):
+    return slack.client.conversations.list(types=types, cursor=cursor)
 
 
 @use("slack")
 def get_channels(slack):
     types = "public_channel,private_channel,mpim,im"
-    response = get_conversations(slack.client, types).body
+    response = get_conversations(slack, types).body
 
     for channel in response["channels"]:
         yield channel
 
     while response["response_metadata"].get("next_cursor"):
         cursor = response["response_metadata"]["next_cursor"]
-        response = get_conversations(slack.client, types, cursor=cursor).body
+        response = get_conversations(slack, types, cursor=cursor).body
         for channel in response["channels"]:
             yield channel
 
 
 def process_channel(channel):
-    to_keep = {
-        "name": "/name",
-        "id": "/id",
-        "is_member": "/is_member",
-        "is_im": "/is_im",
-        "is_mpim": "/is_mpim",
-        "is_private": "/is_private",
-        "user": "/user"
-    }
-    yield map_dictionary(to_keep, channel)
+    yield CHANNEL_FIELDS(channel)
 
 
 @use("users")
@@ -65,5 +57,5 @@ def get_channels_graph(**options):
 
 
 def get_channels_services(base_services, **options):
-    database = base_services["database"]
-    return {**base_services, "users": db.Users(database)}
+    directory = base_services["directory"]
+    return {**base_services, "users": directory.users}
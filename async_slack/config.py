@@ -1,6 +1,6 @@
 import datetime
 from pathlib import Path
-from typing import NamedTuple, List
+from typing import NamedTuple, List, Dict, Optional
 
 import toml
 
@@ -13,6 +13,16 @@ class Configuration(NamedTuple):
     end_date: datetime.date
     threads_lookback_working_days: int
     token_command: List[str]
+    max_concurrent_days: int = 4
+    database_backend: str = "json"
+    codecs: Optional[Dict[str, str]] = None
+    org_partitioning: str = "single"
+    custom_emoji_file: Optional[Path] = None
+    timezone: Optional[str] = None
+    working_days_region: str = "europe.UnitedKingdom"
+    slack_api_url: Optional[str] = None
+    run_report: Optional[Path] = None
+    prometheus_textfile: Optional[Path] = None
 
 
 def read_configuration() -> Configuration:
@@ -25,10 +35,36 @@ def read_configuration() -> Configuration:
         "threads_lookback_working_days"
     ]
     token_command = raw_configuration["slack-token"]["subprocess"]["command"]
+    max_concurrent_days = raw_configuration.get("max_concurrent_days", 4)
+    database_backend = raw_configuration.get("database_backend", "json")
+    codecs = raw_configuration.get("codecs", {})
+    org_partitioning = raw_configuration.get("org_partitioning", "single")
+    custom_emoji_file = raw_configuration.get("custom_emoji_file")
+    if custom_emoji_file is not None:
+        custom_emoji_file = Path(custom_emoji_file).expanduser()
+    timezone = raw_configuration.get("timezone")
+    working_days_region = raw_configuration.get(
+        "working_days_region", "europe.UnitedKingdom")
+    slack_api_url = raw_configuration.get("slack_api_url")
+    run_report = Path(raw_configuration.get(
+        "run_report", database_directory / "run-report.json")).expanduser()
+    prometheus_textfile = raw_configuration.get("prometheus_textfile")
+    if prometheus_textfile is not None:
+        prometheus_textfile = Path(prometheus_textfile).expanduser()
     configuration = Configuration(
         database_directory,
         start_date, end_date,
         threads_lookback_working_days,
-        token_command
+        token_command,
+        max_concurrent_days,
+        database_backend,
+        codecs,
+        org_partitioning,
+        custom_emoji_file,
+        timezone,
+        working_days_region,
+        slack_api_url,
+        run_report,
+        prometheus_textfile
     )
     return configuration
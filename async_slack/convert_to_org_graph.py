@@ -1,24 +1,90 @@
+import hashlib
+import json
+import logging
 import textwrap
+import threading
+from collections import OrderedDict
 from datetime import datetime
 
 import bonobo
-from bonobo.config import Configurable, ContextProcessor, use_raw_input, use
+from bonobo.config import (
+    Configurable, ContextProcessor, Option, Service, use_raw_input, use
+)
 from bonobo.util import ValueHolder
 
-from emoji import emojize
 
 from . import db
-from .orger.inorganic import node, link, timestamp
-from .channel_grouper import ChannelGrouper
+from .orger.inorganic import link
+from .timestamp_formatter import TimestampFormatter, get_timezone
+from .emoji_table import EmojiTable, load_custom_emoji
+from .channel_grouper import ChannelGrouper, channel_key
 
 
 class BlockRenderer:
+    """
+    Render Slack blocks to org-mode text
 
-    def __init__(self, users, channels):
+    Elements are dispatched on their type through a table built once per
+    renderer. Elements of unknown type render their children or text,
+    if any. Emoji are looked up in an EmojiTable, along with the
+    workspace's `custom_emoji`, if given. With `cache_size`, the rendered
+    text of up to that many blocks is kept, keyed on the block's
+    elements, so that repeated blocks are only rendered once. Keying the
+    cache costs about as much as rendering, so it is off by default.
+    """
+
+    _HANDLER_NAMES = {
+        'text': '_text',
+        'rich_text_section': '_rich_text_section',
+        'rich_text_list': '_rich_text_list',
+        'link': '_link',
+        'broadcast': '_broadcast',
+        'user': '_user',
+        'usergroup': '_debug',
+        'channel': '_channel',
+        'emoji': '_emoji',
+        'rich_text_preformatted': '_rich_text_section',
+        'rich_text_quote': '_rich_text_section',
+        'button': '_empty',
+        'mrkdwn': '_empty'
+    }
+
+    def __init__(self, users, channels, cache_size=0, custom_emoji=None):
         self._users = users
         self._channels = channels
-    
+        self._emoji_table = EmojiTable(custom_emoji)
+        self._handlers = {
+            element_type: getattr(self, name)
+            for element_type, name in self._HANDLER_NAMES.items()
+        }
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._unknown_types = set()
+
+    def fingerprint(self):
+        """ Return a digest of the emoji that blocks are rendered with """
+        return self._emoji_table.fingerprint()
+
     def render(self, block):
+        if not self._cache_size:
+            return self._render(block)
+        # The elements alone, since Slack gives each block its own block_id
+        key = repr(block.get('elements'))
+        with self._cache_lock:
+            try:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            except KeyError:
+                pass
+        rendered = self._render(block)
+        with self._cache_lock:
+            self._cache[key] = rendered
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return rendered
+
+    def _render(self, block):
         try:
             elements = block['elements']
         except KeyError:
@@ -72,116 +138,200 @@ class BlockRenderer:
     
     
     def _emoji(self, element):
-        name = element['name']
-        return emojize(f":{name}:")
+        return self._emoji_table.render(
+            element['name'], element.get('skin_tone'), element.get('unicode'))
 
 
     def _empty(self, element):
         return ""
-            
-    
+
+    def _unknown(self, element):
+        element_type = element.get('type')
+        if element_type not in self._unknown_types:
+            self._unknown_types.add(element_type)
+            logging.warning("Unknown block element type %r", element_type)
+        if 'elements' in element:
+            return self._rich_text_section(element)
+        text = element.get('text', "")
+        return text if isinstance(text, str) else ""
+
     def _element(self, element):
-        element_type = element['type']
-        return {
-            'text': self._text,
-            'rich_text_section':self. _rich_text_section,
-            'rich_text_list': self._rich_text_list,
-            'link': self._link,
-            'broadcast': self._broadcast,
-            'user': self._user,
-            'usergroup': self._debug,
-            'channel': self._channel,
-            'emoji': self._emoji,
-            'rich_text_preformatted': self._rich_text_section,
-            'rich_text_quote': self._rich_text_section,
-            'button': self._empty,
-            'mrkdwn': self._empty
-        }[element_type](element)
-
-
-def transform_message(message, block_renderer):
+        handler = self._handlers.get(element.get('type'), self._unknown)
+        return handler(element)
+
+
+# Formats timestamps in local time, unless given another formatter
+LOCAL_TIMESTAMPS = TimestampFormatter()
+
+
+def transform_message(
+        message, block_renderer, timestamp_formatter=LOCAL_TIMESTAMPS):
     blocks = message.get('blocks')
     if blocks:
         body = "\n".join(block_renderer.render(block) for block in blocks)
-        message_time = datetime.fromtimestamp(float(message['ts']))
         user = message.get('user_name') or message.get('user') or 'UNKNOWN'
         return {
             "body": body,
             "user": user,
-            "timestamp": timestamp(message_time, inactive=True)
+            "ts": message['ts'],
+            "timestamp": timestamp_formatter.format(message['ts'])
         }
 
 
-def transform_thread(thread, block_renderer):
+def transform_thread(
+        thread, block_renderer, timestamp_formatter=LOCAL_TIMESTAMPS):
     transformed_thread = []
     if thread is not None:
         for reply in thread:
-            transformed_reply = transform_message(reply, block_renderer)
+            transformed_reply = transform_message(
+                reply, block_renderer, timestamp_formatter)
             if transformed_reply is not None:
                 transformed_thread.append(transformed_reply)
     return transformed_thread
 
 
-@use("block_renderer")
-def yield_message(message, block_renderer):
-    transformed_message = transform_message(message, block_renderer)
+def transform_message_with_thread(
+        message, block_renderer, timestamp_formatter=LOCAL_TIMESTAMPS):
+    transformed_message = transform_message(
+        message, block_renderer, timestamp_formatter)
     if transformed_message is not None:
         transformed_message["channel"] = message["channel"]
         thread = message.get("thread")
         if thread is not None:
             transformed_message["thread"] = transform_thread(
-                thread, block_renderer)
+                thread, block_renderer, timestamp_formatter)
+    return transformed_message
+
+
+@use("block_renderer", "timestamp_formatter")
+def yield_message(message, block_renderer, timestamp_formatter):
+    transformed_message = transform_message_with_thread(
+        message, block_renderer, timestamp_formatter)
+    if transformed_message is not None:
         yield transformed_message
 
 
-@use("block_renderer", "channels")
-def convert_channel_to_node(channel_id, messages, block_renderer, channels):
-    nodes_for_channel = []
-    for message in messages:
-        nodes_for_channel.extend(list(yield_message(block_renderer, message)))
-    if nodes_for_channel:
-        channel_name = channels.for_id(channel_id)["derived_name"]
-        heading = f"#{channel_name}"
-        body = "\n".join(nodes_for_channel)
-        # Yield as a single element list to avoid
-        # bonobo untuplizing the node
-        yield [node(heading=heading, body=body)]
+def channel_document(channel, messages):
+    return {
+        "channel": channel,
+        "messages": sorted(messages, key=lambda message: float(message["ts"]), reverse=True)
+    }
 
 
 @use("channels")
 def yield_channel(channel_id, messages, channels):
-    channel = channels.for_id(channel_id)
-    yield {
-        "channel": channel,
-        "messages": sorted(messages, key=lambda message: message["timestamp"], reverse=True)
-    }
+    yield channel_document(channels.for_id(channel_id), messages)
+
+
+# How org messages are split into files: a single org-messages.json, a
+# file per channel, or a file per channel and month.
+SINGLE = "single"
+CHANNEL = "channel"
+CHANNEL_MONTH = "channel_month"
+
+
+def channel_month_key(message):
+    channel_id = message.get("channel")
+    if channel_id:
+        month = datetime.fromtimestamp(float(message["ts"])).strftime("%Y-%m")
+        return f"{channel_id}-{month}"
+
 
+GROUP_KEYS = {
+    CHANNEL: channel_key,
+    CHANNEL_MONTH: channel_month_key
+}
 
-def render_node(enveloped_node):
-    [node] = enveloped_node
-    yield node.render() + "\n\n"
 
+def content_hash(messages, *fingerprints):
+    digest = hashlib.blake2b(digest_size=16)
+    for fingerprint in fingerprints:
+        digest.update(fingerprint.encode("utf-8") + b"\0")
+    for message in messages:
+        digest.update(json.dumps(message, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class OrgGroupWriter(Configurable):
+    """
+    Render each group of enriched messages into its own org messages file
+
+    Groups are hashed with their enriched messages and with the users,
+    channels, emoji and timezone they are rendered with. Groups whose
+    hash is unchanged since they were last written are skipped, leaving
+    their file alone.
+    """
+    database = Service("database")
+    directory = Service("directory")
+    channels = Service("channels")
+    block_renderer = Service("block_renderer")
+    timestamp_formatter = Service("timestamp_formatter")
+    manifest = Service("org_messages_manifest")
+
+    def __call__(  # pylint: disable=arguments-differ
+            self, group, messages, *, database, directory, channels,
+            block_renderer, timestamp_formatter, manifest):
+        fingerprint = content_hash(
+            messages,
+            directory.fingerprint(),
+            block_renderer.fingerprint(),
+            timestamp_formatter.fingerprint()
+        )
+        if manifest.get(group) == fingerprint:
+            return
+        logging.info("Rendering org messages for %s", group)
+        transformed_messages = []
+        for message in messages:
+            transformed_message = transform_message_with_thread(
+                message, block_renderer, timestamp_formatter)
+            if transformed_message is not None:
+                transformed_messages.append(transformed_message)
+        channel = channels.for_id(messages[0]["channel"])
+        with database.open_writer(
+                db.ORG_MESSAGES, group, db.FLUSH_ON_CLOSE) as sink:
+            sink.write(channel_document(channel, transformed_messages))
+        manifest.set(group, fingerprint)
 
-def get_convert_to_org_graph(**options):
+
+def get_convert_to_org_graph(start_date, end_date, partitioning=SINGLE, **options):
     graph = bonobo.Graph()
-    graph.add_chain(
-        db.JsonEnrichedMessagesReader(),
-        yield_message,
-        ChannelGrouper(),
-        yield_channel,
-        db.JsonOrgMessagesWriter()
-    )
+    if partitioning == SINGLE:
+        graph.add_chain(
+            db.JsonEnrichedMessagesReader(start_date, end_date),
+            yield_message,
+            ChannelGrouper(),
+            yield_channel,
+            db.JsonOrgMessagesWriter()
+        )
+    else:
+        try:
+            key = GROUP_KEYS[partitioning]
+        except KeyError:
+            raise ValueError(
+                f"Unknown org partitioning {partitioning!r}") from None
+        graph.add_chain(
+            db.JsonEnrichedMessagesReader(start_date, end_date),
+            ChannelGrouper(key=key),
+            OrgGroupWriter()
+        )
     return graph
 
 
-def get_convert_to_org_services(base_services, **options):
-    database = base_services["database"]
-    users = db.Users(database)
-    channels = db.Channels(database)
-    block_renderer = BlockRenderer(users, channels)
+def get_convert_to_org_services(
+        base_services, custom_emoji_file=None, timezone=None, **options):
+    directory = base_services["directory"]
+    channels = directory.channels
+    custom_emoji = None
+    if custom_emoji_file is not None:
+        custom_emoji = load_custom_emoji(custom_emoji_file)
+    block_renderer = BlockRenderer(
+        directory.users, channels, custom_emoji=custom_emoji)
     return {
         **base_services,
         "channels": channels,
-        "block_renderer": block_renderer
+        "block_renderer": block_renderer,
+        "timestamp_formatter": TimestampFormatter(get_timezone(timezone)),
+        "org_messages_manifest": db.Manifest(
+            base_services["database"], db.ORG_MESSAGES_MANIFEST)
     }
-    
+
@@ -1,7 +1,19 @@
+from array import array
+from bisect import bisect_left
 from functools import lru_cache
+from pathlib import Path
 import datetime
+import importlib
+import json
+import os
+import threading
 
-import workalendar.europe  # type: ignore
+try:
+    from importlib.metadata import PackageNotFoundError, version
+except ImportError:  # Python < 3.8
+    from importlib_metadata import PackageNotFoundError, version  # type: ignore
+
+DEFAULT_REGION = "europe.UnitedKingdom"
 
 
 def date_range(start_date, end_date):
@@ -15,11 +27,162 @@ def date_range(start_date, end_date):
         yield date
 
 
+def contiguous_ranges(dates, max_days=92):
+    """
+    Group sorted dates into ranges of consecutive days
+
+    Returns (start_date, end_date) pairs, end_date not inclusive. No
+    range spans more than max_days.
+    """
+    ranges = []
+    for date in dates:
+        if ranges:
+            range_start, range_end = ranges[-1]
+            if range_end == date and (date - range_start).days < max_days:
+                ranges[-1] = (range_start, date + datetime.timedelta(days=1))
+                continue
+        ranges.append((date, date + datetime.timedelta(days=1)))
+    return ranges
+
+
+def message_date(message) -> datetime.date:
+    """ Return the local date a Slack message was posted on """
+    return datetime.date.fromtimestamp(float(message["ts"]))
+
+
+def _make_calendar(region):
+    """ Return the workalendar calendar for a region like "europe.UnitedKingdom" """
+    module_name, _, class_name = region.rpartition(".")
+    module = importlib.import_module(f"workalendar.{module_name}")
+    return getattr(module, class_name)()
+
+
+def _workalendar_version():
+    """ Return the installed workalendar's version, without importing it """
+    try:
+        return version("workalendar")
+    except PackageNotFoundError:
+        return None
+
+
+class WorkingDays:
+    """
+    Working days of a workalendar region, as a sorted array of ordinals
+
+    The table covers whole years, and grows to cover any date that is
+    asked about. It is cached as JSON in `cache_directory`, if given,
+    along with the region and workalendar version it was built with, and
+    is rebuilt when either changes. Holidays can still be announced for
+    the current and following year, so those years are rebuilt when a
+    date in the current year is asked about, at most once a day. The day
+    of the last rebuild is cached with the table.
+    """
+
+    def __init__(self, region=DEFAULT_REGION, cache_directory=None):
+        self._region = region
+        self._cache_path = None
+        if cache_directory is not None:
+            self._cache_path = Path(cache_directory) / f"working-days-{region}.json"
+        self._lock = threading.Lock()
+        self._first_year = None
+        self._last_year = None
+        self._ordinals = array("l")
+        self._refreshed_on = None
+        self._load()
+
+    def _load(self):
+        if self._cache_path is None:
+            return
+        try:
+            with open(self._cache_path) as fp:
+                cached = json.load(fp)
+            if (cached["region"] != self._region or
+                    cached["workalendar"] != _workalendar_version()):
+                return
+            self._first_year = cached["first_year"]
+            self._last_year = cached["last_year"]
+            self._ordinals = array("l", cached["ordinals"])
+            self._refreshed_on = cached.get("refreshed_on")
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save(self):
+        if self._cache_path is None:
+            return
+        temporary_path = self._cache_path.with_suffix(".tmp")
+        with open(temporary_path, "w") as fp:
+            json.dump({
+                "region": self._region,
+                "workalendar": _workalendar_version(),
+                "first_year": self._first_year,
+                "last_year": self._last_year,
+                "ordinals": self._ordinals.tolist(),
+                "refreshed_on": self._refreshed_on
+            }, fp)
+        os.replace(temporary_path, self._cache_path)
+
+    def _ensure_years(self, first_year, last_year):
+        with self._lock:
+            refreshed_years = set()
+            today = datetime.date.today()
+            current_year = today.year
+            if (self._refreshed_on != today.toordinal()
+                    and first_year <= current_year <= last_year):
+                refreshed_years = {current_year, current_year + 1}
+                last_year = max(last_year, current_year + 1)
+            cached_years = set()
+            if self._first_year is not None:
+                cached_years = set(range(self._first_year, self._last_year + 1))
+                first_year = min(first_year, self._first_year)
+                last_year = max(last_year, self._last_year)
+            stale_years = (
+                (set(range(first_year, last_year + 1)) - cached_years)
+                | refreshed_years
+            )
+            if not stale_years:
+                return
+            calendar = _make_calendar(self._region)
+            ordinals = [
+                ordinal for ordinal in self._ordinals
+                if datetime.date.fromordinal(ordinal).year not in stale_years
+            ]
+            for year in stale_years:
+                days = date_range(
+                    datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1))
+                ordinals.extend(
+                    day.toordinal() for day in days if calendar.is_working_day(day))
+            self._ordinals = array("l", sorted(ordinals))
+            self._first_year = first_year
+            self._last_year = last_year
+            if refreshed_years:
+                self._refreshed_on = today.toordinal()
+            self._save()
+
+    def nworking_days_before(self, date: datetime.date, ndays: int) -> datetime.date:
+        """
+        Return a date n working days before date
+
+        As with workalendar's add_working_days, date itself does not
+        count, whether or not it is a working day.
+        """
+        if ndays <= 0:
+            return date
+        # Every region has more than 200 working days a year
+        first_year = date.year - 1 - ndays // 200
+        while True:
+            self._ensure_years(first_year, date.year)
+            ordinals = self._ordinals
+            index = bisect_left(ordinals, date.toordinal()) - ndays
+            if index >= 0:
+                return datetime.date.fromordinal(ordinals[index])
+            first_year -= 1
+
+
 @lru_cache(maxsize=1)
-def _get_calendar():
-    return workalendar.europe.UnitedKingdom()
+def _get_working_days():
+    return WorkingDays()
 
 
 def nworking_days_before(date: datetime.date, ndays: int) -> datetime.date:
-    """ Return a date n working days before date """
-    return _get_calendar().add_working_days(date, -ndays)
+    """ Return a date n working days before date, in the United Kingdom """
+    return _get_working_days().nworking_days_before(date, ndays)
@@ -0,0 +1,37 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+def run_days(dates, run_day, max_concurrent_days):
+    """
+    Call `run_day(date)` for each date, running several days at once
+
+    Yields each date as soon as its run finishes, so that callers can
+    record the completion of every day independently. Days are started
+    as others finish, so once a day raises, no further day starts: the
+    days already running are waited for, those that succeed are still
+    yielded, and the first exception is then raised.
+    """
+    dates = iter(dates)
+    with ThreadPoolExecutor(max_workers=max_concurrent_days) as executor:
+        running = {}
+
+        def start_days():
+            for date in itertools.islice(dates, max_concurrent_days - len(running)):
+                running[executor.submit(run_day, date)] = date
+
+        error = None
+        start_days()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                date = running.pop(future)
+                exception = future.exception()
+                if exception is None:
+                    yield date
+                elif error is None:
+                    error = exception
+            if error is None:
+                start_days()
+        if error is not None:
+            raise error
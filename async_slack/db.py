@@ -1,7 +1,11 @@
+import hashlib
 import json
-from contextlib import contextmanager
+import os
+import threading
+import time
+from contextlib import contextmanager, ExitStack
 from pathlib import Path
-from functools import lru_cache
+from typing import NamedTuple, Optional
 
 import bonobo
 from bonobo.config import (
@@ -10,81 +14,317 @@ from bonobo.constants import NOT_MODIFIED
 
 import fs.errors
 
+from . import metrics
+from .date_utils import date_range, message_date
+from .serialization import get_codec, decode_stream
+
+
+USERS = "users"
+CHANNELS = "channels"
+RAW_MESSAGES = "raw_messages"
+RAW_THREADS = "raw_threads"
+ENRICHED_MESSAGES = "enriched_messages"
+ORG_MESSAGES = "org_messages"
+
+STATUS = "status"
+MESSAGE_COUNT = "message_count"
+THREAD_CACHE = "thread_cache"
+# Named so that their snapshots never look like a partition of a store
+ENRICHED_MESSAGES_MANIFEST = "manifest_enriched_messages"
+ORG_MESSAGES_MANIFEST = "manifest_org_messages"
+
+
+class FlushPolicy(NamedTuple):
+    """
+    When a record writer hands its buffered records to the database
+
+    The buffer is flushed once it holds `records` records or `size`
+    bytes. With neither set, records are only written on close.
+    """
+    records: Optional[int] = None
+    size: Optional[int] = None
+
+
+FLUSH_PER_RECORD = FlushPolicy(records=1)
+FLUSH_ON_CLOSE = FlushPolicy()
+
+
+class _FileSink:
+
+    def __init__(self, fp, codec, flush_policy):
+        self._fp = fp
+        self._codec = codec
+        self._flush_policy = flush_policy
+        self._buffer = [codec.header]
+        self._buffer_size = len(codec.header)
+        # Records in the buffer, which may also hold the header
+        self._buffered_records = 0
+        self.bytes_written = 0
+
+    def write(self, entry):
+        record = self._codec.encode(entry)
+        self._buffer.append(record)
+        self._buffer_size += len(record)
+        self._buffered_records += 1
+        records, size = self._flush_policy
+        if ((records is not None and self._buffered_records >= records) or
+                (size is not None and self._buffer_size >= size)):
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._fp.write(b"".join(self._buffer))
+            self._fp.flush()
+            self.bytes_written += self._buffer_size
+            self._buffer = []
+            self._buffer_size = 0
+            self._buffered_records = 0
+
+
+class _StateJournal:
+    """
+    State document kept as a snapshot plus an append-only journal
+
+    Each update appends one line to the journal, instead of rewriting
+    the whole document. The journal is fsynced every `fsync_every`
+    records or `fsync_interval` seconds, whichever comes first, and is
+    folded into a new snapshot every `compact_every` records. Snapshots
+    are written to a temporary file, fsynced and renamed into place, so
+    a crash leaves either the old or the new snapshot, and replaying the
+    journal over either gives the same state.
+
+    Whoever changes `data` must hold `lock`, which appends and
+    compactions also take, so that a snapshot never sees the document
+    change under it.
+    """
+
+    def __init__(
+            self,
+            name,
+            snapshot_path,
+            journal_path,
+            fsync_every=64,
+            fsync_interval=1.0,
+            compact_every=1000
+    ):
+        self._name = name
+        self._snapshot_path = snapshot_path
+        self._journal_path = journal_path
+        self._fsync_every = fsync_every
+        self._fsync_interval = fsync_interval
+        self._compact_every = compact_every
+        self.lock = threading.RLock()
+        self._fp = None
+        self._records = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self.data = self._load()
+
+    def _load(self):
+        try:
+            with open(self._snapshot_path, encoding="utf-8") as fp:
+                data = json.load(fp)
+        except FileNotFoundError:
+            data = {}
+        try:
+            with open(self._journal_path, "rb") as fp:
+                journal = fp.read()
+        except FileNotFoundError:
+            journal = b""
+        valid_length = 0
+        for line in journal.splitlines(keepends=True):
+            try:
+                outer_key, inner_key, value = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b"\n"):
+                break
+            data.setdefault(outer_key, {})[inner_key] = value
+            valid_length += len(line)
+            self._records += 1
+        if valid_length < len(journal):
+            # Drop a torn write at the end, so that appends start cleanly
+            with open(self._journal_path, "r+b") as fp:
+                fp.truncate(valid_length)
+        return data
+
+    def append(self, updates):
+        with self.lock:
+            if self._fp is None:
+                self._fp = open(self._journal_path, "a", encoding="utf-8")
+            nbytes = 0
+            for outer_key, inner_key in updates:
+                value = self.data[outer_key][inner_key]
+                line = json.dumps([outer_key, inner_key, value]) + "\n"
+                self._fp.write(line)
+                nbytes += len(line)
+                self._records += 1
+                self._unsynced += 1
+            self._fp.flush()
+            metrics.registry.record_bytes_written(
+                self._name, self._journal_path.name, nbytes)
+            if self._records >= self._compact_every:
+                self._compact()
+            elif (self._unsynced >= self._fsync_every or
+                  time.monotonic() - self._last_sync >= self._fsync_interval):
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self._fp.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _compact(self):
+        temporary_path = self._snapshot_path.with_name(
+            self._snapshot_path.name + ".tmp")
+        with open(temporary_path, "w", encoding="utf-8") as fp:
+            json.dump(self.data, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+            nbytes = fp.tell()
+        os.replace(temporary_path, self._snapshot_path)
+        metrics.registry.record_bytes_written(
+            self._name, self._snapshot_path.name, nbytes)
+        self._fp.truncate(0)
+        self._sync()
+        self._records = 0
+
 
 class JsonFsDatabase:
+    """
+    Database of record files in a directory
+
+    Record stores (users, raw threads for a date, ...) map to one file
+    each, written with the codec configured for the store in `codecs`
+    (line-delimited JSON by default). State (status, message count, ...)
+    maps to a JSON snapshot and a journal of the updates made since.
+    """
 
-    def __init__(self, root):
+    def __init__(self, root, codecs=None):
         self._root = Path(root)
         self._fs = bonobo.open_fs(self._root, create=True)
-        self._users_file_name = "users.json"
-        self._channels_file_name = "channels.json"
-        self._enriched_messages_file_name = "enriched-messages.json"
-        self._message_count_file = "message-count.json"
-        self._status_file_name = "status.json"
-        self._org_messages_file_name = "org-messages.json"
-
-    def _get_raw_threads_file_name(self, date):
-        return f"raw-threads-{date.isoformat()}.json"
-
-    @contextmanager
-    def _open(self, file_name, mode):
-        with self._fs.open(file_name, mode, encoding="utf-8") as fp:
-            yield fp
-
-    @contextmanager
-    def open_status_file(self, mode="r"):
-        with self._open(self._status_file_name, mode) as fp:
-            yield fp
+        self._codecs = {
+            store: get_codec(codec_name)
+            for store, codec_name in (codecs or {}).items()
+        }
+        self._default_codec = get_codec("json")
+        self._journals = {}
+        self._journals_lock = threading.Lock()
+
+    def _get_store_file_name(self, store, partition=None):
+        prefix = store.replace("_", "-")
+        if partition is None:
+            return f"{prefix}.json"
+        return f"{prefix}-{partition}.json"
+
+    def _get_state_file_name(self, name):
+        return name.replace("_", "-") + ".json"
+
+    def _get_journal_file_name(self, name):
+        return name.replace("_", "-") + ".journal"
+
+    def _journal(self, name):
+        with self._journals_lock:
+            try:
+                journal = self._journals[name]
+            except KeyError:
+                journal = _StateJournal(
+                    name,
+                    self._root / self._get_state_file_name(name),
+                    self._root / self._get_journal_file_name(name)
+                )
+                self._journals[name] = journal
+            return journal
+
+    def partitions(self, store):
+        """ Return the sorted partitions of a store that exist """
+        prefix = store.replace("_", "-") + "-"
+        partitions = []
+        for file_name in self._fs.listdir("/"):
+            if file_name.startswith(prefix) and file_name.endswith(".json"):
+                partitions.append(file_name[len(prefix):-len(".json")])
+        return sorted(partitions)
 
     @contextmanager
-    def open_users_file(self, mode="r"):
-        with self._open(self._users_file_name, mode) as fp:
-            yield fp
+    def open_writer(
+            self, store, partition=None, flush_policy=FLUSH_ON_CLOSE, codec=None):
+        """
+        Replace the records in a store, yielding a sink to write them to
+
+        Records go to a temporary file, renamed over the store's file
+        only if the block completes, so readers never see a partial file.
+        """
+        if codec is None:
+            codec = self._codecs.get(store, self._default_codec)
+        file_name = self._get_store_file_name(store, partition)
+        temporary_file_name = file_name + ".tmp"
+        try:
+            with self._fs.openbin(temporary_file_name, "w") as fp:
+                sink = _FileSink(fp, codec, flush_policy)
+                yield sink
+                sink.flush()
+        except BaseException:
+            if self._fs.exists(temporary_file_name):
+                self._fs.remove(temporary_file_name)
+            raise
+        os.replace(self._root / temporary_file_name, self._root / file_name)
+        metrics.registry.record_bytes_written(store, file_name, sink.bytes_written)
+
+    def fingerprint(self, store, partition=None):
+        """ Return a digest of a store's content, or None if it does not exist """
+        digest = hashlib.blake2b(digest_size=16)
+        try:
+            with self._fs.openbin(
+                    self._get_store_file_name(store, partition), "r") as fp:
+                for chunk in iter(lambda: fp.read(1 << 16), b""):
+                    digest.update(chunk)
+        except fs.errors.ResourceNotFound:
+            return None
+        return digest.hexdigest()
 
-    @contextmanager
-    def open_channels_file(self, mode="r"):
-        with self._open(self._channels_file_name, mode) as fp:
-            yield fp
+    def read(self, store, partition=None):
+        """ Yield the records in a store, or nothing if it does not exist """
+        try:
+            with self._fs.openbin(
+                    self._get_store_file_name(store, partition), "r") as fp:
+                yield from decode_stream(fp)
+        except fs.errors.ResourceNotFound:
+            return
 
-    @contextmanager
-    def open_raw_threads_file(self, date, mode="r"):
-        file_name = self._get_raw_threads_file_name(date)
-        with self._open(file_name, mode) as fp:
-            yield fp
+    def read_state(self, name):
+        """
+        Return the state document `name`
 
-    @contextmanager
-    def open_enriched_messages_file(self, mode="r"):
-        with self._open(self._enriched_messages_file_name, mode) as fp:
-            yield fp
+        Every reader of the same state shares the returned dictionary,
+        and must hold `state_lock(name)` while changing it.
+        """
+        return self._journal(name).data
 
-    @contextmanager
-    def open_org_messages_file(self, mode="r"):
-        with self._open(self._org_messages_file_name, mode) as fp:
-            yield fp
+    def state_lock(self, name):
+        """ Return the lock guarding changes to the state document `name` """
+        return self._journal(name).lock
 
-    @contextmanager
-    def open_message_count_file(self, mode="r"):
-        with self._open(self._message_count_file, mode) as fp:
-            yield fp
+    def write_state(self, name, data, updates):
+        """
+        Persist the state `data`, of which the (outer, inner) keys in
+        `updates` have changed
+        """
+        self._journal(name).append(updates)
 
 
 class Status:
 
     def __init__(self, database):
         self._database = database
-        self._data = self._read_input()
-
-    def _read_input(self):
-        try:
-            with self._database.open_status_file() as fp:
-                entries = json.load(fp)
-        except fs.errors.ResourceNotFound:
-            entries = {}
-        return entries
+        self._data = database.read_state(STATUS)
+        self._lock = database.state_lock(STATUS)
 
-    def _write_input(self):
-        with self._database.open_status_file("w") as fp:
-            json.dump(self._data, fp)
+    def _set_complete(self, date, key):
+        with self._lock:
+            status_for_date = self._data.setdefault(date.isoformat(), {})
+            status_for_date[key] = True
+            self._database.write_state(
+                STATUS, self._data, [(date.isoformat(), key)])
 
     def is_message_count_complete(self, date):
         try:
@@ -101,149 +341,267 @@ class Status:
         return complete
 
     def set_message_count_complete(self, date):
-        status_for_date = self._data.setdefault(date.isoformat(), {})
-        status_for_date["message_count_complete"] = True
-        self._write_input()
+        self._set_complete(date, "message_count_complete")
 
     def set_raw_threads_complete(self, date):
-        status_for_date = self._data.setdefault(date.isoformat(), {})
-        status_for_date["raw_threads_complete"] = True
-        self._write_input()
+        self._set_complete(date, "raw_threads_complete")
 
 
 class Users:
 
     def __init__(self, database):
         self._database = database
-        self._data = self._read_input()
+        self._data = list(database.read(USERS))
+        self._by_id = {user["id"]: user for user in self._data}
 
-    def _read_input(self):
-        with self._database.open_users_file() as fp:
-            lines = [json.loads(line) for line in fp]
-        return lines
-
-    @lru_cache()
     def for_id(self, user_id):
-        for user in self._data:
-            if user["id"] == user_id:
-                return user
-        else:
-            raise KeyError(user_id)
+        return self._by_id[user_id]
 
 
 class Channels:
 
     def __init__(self, database):
         self._database = database
-        self._data = self._read_input()
-
-    def _read_input(self):
-        with self._database.open_channels_file() as fp:
-            lines = [json.loads(line) for line in fp]
-        return lines
+        self._data = list(database.read(CHANNELS))
+        self._by_id = {channel["id"]: channel for channel in self._data}
 
     def all(self):
         yield from self._data.copy()
 
-    @lru_cache()
     def for_id(self, channel_id):
-        for channel in self._data:
-            if channel["id"] == channel_id:
-                return channel
-        else:
-            raise KeyError(channel_id)
+        return self._by_id[channel_id]
 
 
-class MessageCount:
+class Directory:
+    """
+    Users and channels, each loaded once and shared between graphs
+
+    Call `reload` after rewriting the users or channels file.
+    """
 
     def __init__(self, database):
         self._database = database
-        self._data = self._read_input()
+        self._users = None
+        self._channels = None
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+    @property
+    def users(self):
+        with self._lock:
+            if self._users is None:
+                self._users = Users(self._database)
+            return self._users
+
+    @property
+    def channels(self):
+        with self._lock:
+            if self._channels is None:
+                self._channels = Channels(self._database)
+            return self._channels
+
+    def fingerprint(self):
+        """ Return a digest of the users and channels """
+        with self._lock:
+            if self._fingerprint is None:
+                digest = hashlib.blake2b(digest_size=16)
+                for store in (USERS, CHANNELS):
+                    store_fingerprint = self._database.fingerprint(store)
+                    digest.update(str(store_fingerprint).encode("utf-8"))
+                self._fingerprint = digest.hexdigest()
+            return self._fingerprint
+
+    def reload(self):
+        with self._lock:
+            self._users = None
+            self._channels = None
+            self._fingerprint = None
+
+
+class Manifest:
+    """
+    Fingerprint of the inputs that each partition was last built from
+    """
+
+    def __init__(self, database, name):
+        self._database = database
+        self._name = name
+        self._data = database.read_state(name)
+        self._lock = database.state_lock(name)
 
-    def _read_input(self):
-        try:
-            with self._database.open_message_count_file() as fp:
-                entries = json.load(fp)
-        except fs.errors.ResourceNotFound:
-            entries = {}
-        return entries
+    def get(self, partition):
+        with self._lock:
+            return self._data.get(partition, {}).get("fingerprint")
+
+    def set(self, partition, fingerprint):
+        with self._lock:
+            self._data.setdefault(partition, {})["fingerprint"] = fingerprint
+            self._database.write_state(
+                self._name, self._data, [(partition, "fingerprint")])
+
+
+class MessageCount:
 
-    def _write_input(self):
-        with self._database.open_message_count_file("w") as fp:
-            json.dump(self._data, fp)
+    def __init__(self, database):
+        self._database = database
+        self._data = database.read_state(MESSAGE_COUNT)
+        self._lock = database.state_lock(MESSAGE_COUNT)
 
     def set_day_channel(self, date, channel, count):
-        self._data.setdefault(date.isoformat(), {})[channel] = count
-        self._write_input()
+        self.set_many([(date, channel, count)])
+
+    def set_many(self, counts):
+        """ Set every (date, channel, count) in counts with a single write """
+        with self._lock:
+            updates = []
+            for date, channel, count in counts:
+                self._data.setdefault(date.isoformat(), {})[channel] = count
+                updates.append((date.isoformat(), channel))
+            self._database.write_state(MESSAGE_COUNT, self._data, updates)
 
     def get_channels_for_day(self, date):
-        return self._data.get(date.isoformat(), {}).keys()
+        with self._lock:
+            return list(self._data.get(date.isoformat(), {}).keys())
+
+
+class ThreadCache:
+    """
+    Replies already fetched for each thread, keyed by channel and thread_ts
+
+    Entries remember the thread's `latest_reply`, so the replies only
+    need fetching again once a newer reply has been posted.
+    """
+
+    def __init__(self, database):
+        self._database = database
+        self._data = database.read_state(THREAD_CACHE)
+        self._lock = database.state_lock(THREAD_CACHE)
+        self._updates = set()
+
+    def get(self, channel_id, thread_ts, latest_reply):
+        """ Return the cached replies, or None if they may be out of date """
+        if latest_reply is None:
+            return None
+        with self._lock:
+            entry = self._data.get(channel_id, {}).get(thread_ts)
+        if entry is None or float(entry["latest_reply"]) < float(latest_reply):
+            return None
+        return entry["replies"]
+
+    def set(self, channel_id, thread_ts, latest_reply, replies):
+        if latest_reply is None:
+            return
+        with self._lock:
+            self._data.setdefault(channel_id, {})[thread_ts] = {
+                "latest_reply": latest_reply,
+                "replies": replies
+            }
+            self._updates.add((channel_id, thread_ts))
+
+    def save(self):
+        with self._lock:
+            if self._updates:
+                self._database.write_state(
+                    THREAD_CACHE, self._data, sorted(self._updates))
+                self._updates = set()
 
 
 @use_context
-class _FileLdJsonWriter(Configurable):
+class _RecordWriter(Configurable):
 
     database = Service("database")
 
-    def open(self, database):
-        pass
+    store = None
+    flush_policy = FlushPolicy(size=1 << 20)
+
+    def partition(self):
+        return None
 
     @ContextProcessor
-    def fp(self, _, *, database):
-        with self.open(database) as fp:
-            yield fp
-            fp.write("\n")
-
-    def __call__(self, fp, context, entry, *, database):
-        context.setdefault("lineno", 0)
-        line = ("\n" if context.lineno else "") + json.dumps(entry)
-        fp.write(line)
-        fp.flush()
-        context.lineno += 1
+    def sink(self, _, *, database):
+        with database.open_writer(
+                self.store, self.partition(), self.flush_policy) as sink:
+            yield sink
+
+    def __call__(self, sink, context, entry, *, database):
+        sink.write(entry)
         return NOT_MODIFIED
 
 
 @use_context
-class JsonUserWriter(_FileLdJsonWriter):
+class JsonUserWriter(_RecordWriter):
+
+    store = USERS
+    flush_policy = FLUSH_ON_CLOSE
+
+
+@use_context
+class JsonChannelsWriter(_RecordWriter):
 
-    def open(self, database):
-        return database.open_users_file("w")
+    store = CHANNELS
+    flush_policy = FLUSH_ON_CLOSE
 
 
 @use_context
-class JsonChannelsWriter(_FileLdJsonWriter):
+class JsonRawThreadsWriter(_RecordWriter):
 
-    def open(self, database):
-        return database.open_channels_file("w")
+    date = Option(required=True, positional=True)
+    database = Service("database")
+
+    store = RAW_THREADS
+
+    def partition(self):
+        return self.date.isoformat()
 
 
 @use_context
-class JsonRawThreadsWriter(_FileLdJsonWriter):
+class JsonRawMessagesWriter(_RecordWriter):
 
     date = Option(required=True, positional=True)
     database = Service("database")
 
-    def open(self, database):
-        return database.open_raw_threads_file(self.date, mode="w")
+    store = RAW_MESSAGES
+
+    def partition(self):
+        return self.date.isoformat()
 
 
 @use_context
-class JsonEnrichedMessagesWriter(_FileLdJsonWriter):
+class _RecordRangeWriter(Configurable):
+    """
+    Write entries to one partition per day, by the date of each message
+
+    A partition is written for every day in the range, including days
+    without any messages.
+    """
+
+    start_date = Option(required=True, positional=True)
+    end_date = Option(required=True, positional=True)
+    database = Service("database")
 
-    def open(self, database):
-        return database.open_enriched_messages_file("w")
+    store = None
+    flush_policy = FlushPolicy(size=1 << 18)
 
+    @ContextProcessor
+    def sinks(self, _, *, database):
+        with ExitStack() as stack:
+            yield {
+                date: stack.enter_context(database.open_writer(
+                    self.store, date.isoformat(), self.flush_policy))
+                for date in date_range(self.start_date, self.end_date)
+            }
+
+    def __call__(self, sinks, context, entry, *, database):
+        sink = sinks.get(message_date(entry))
+        if sink is not None:
+            sink.write(entry)
+        return NOT_MODIFIED
 
-# @use_context
-# class JsonRawMessagesReader(Configurable):
 
-#     database = Service("database")
+@use_context
+class JsonRawMessagesRangeWriter(_RecordRangeWriter):
 
-#     def __call__(self, _, date, *, database):
-#         with database.open_raw_messages_file(date) as fp:
-#             for line in fp:
-#                 if line.strip():
-#                     yield json.loads(line)
+    store = RAW_MESSAGES
 
 
 @use_context
@@ -252,10 +610,7 @@ class JsonRawThreadsReader(Configurable):
     database = Service("database")
 
     def __call__(self, _, date, *, database):
-        with database.open_raw_threads_file(date) as fp:
-            for line in fp:
-                if line.strip():
-                    yield json.loads(line)
+        yield from database.read(RAW_THREADS, date.isoformat())
 
 
 @use_context
@@ -264,35 +619,24 @@ class JsonRawMessagesDateReader(Configurable):
     date = Option(required=True, positional=True)
     database = Service("database")
 
-
-    @ContextProcessor
-    def fp(self, _, *, database):
-        with database.open_raw_messages_file(self.date) as fp:
-            yield fp
-
-    def __call__(self, fp, _, *, database):
-        for line in fp:
-            if line.strip():
-                yield json.loads(line)
+    def __call__(self, _, *, database):
+        yield from database.read(RAW_MESSAGES, self.date.isoformat())
 
 
 @use_context
 class JsonEnrichedMessagesReader(Configurable):
+    """ Yield the enriched messages of each date from start_date to end_date """
 
+    start_date = Option(positional=True, required=True)
+    end_date = Option(positional=True, required=True)
     database = Service("database")
 
-    @ContextProcessor
-    def fp(self, _, *, database):
-        with database.open_enriched_messages_file() as fp:
-            yield fp
-
-    def __call__(self, fp, _, *, database):
-        for line in fp:
-            yield json.loads(line)
+    def __call__(self, _, *, database):
+        for date in date_range(self.start_date, self.end_date):
+            yield from database.read(ENRICHED_MESSAGES, date.isoformat())
 
 
 @use_context
-class JsonOrgMessagesWriter(_FileLdJsonWriter):
+class JsonOrgMessagesWriter(_RecordWriter):
 
-    def open(self, database):
-        return database.open_org_messages_file("w")
+    store = ORG_MESSAGES
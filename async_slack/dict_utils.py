@@ -1,14 +1,124 @@
-import dpath.util  # type: ignore
+from functools import lru_cache
+from typing import Dict, Any, Callable, Iterable, List
 
-from typing import Dict, Any
+
+def _compile_path(path: str) -> Callable[[Any], Any]:
+    r"""
+    Compile a path like "/profile/real_name" into a getter
+
+    Segments are separated by "/", and empty segments are ignored, so
+    the leading "/" is optional and "/" alone is the whole record.
+    Numeric segments index into lists, as well as naming dict keys.
+    Glob characters have no special meaning. Any missing key, index out
+    of range or non-container on the way gives None.
+    >>> _compile_path("/a/b")({"a": {"b": 1}})
+    1
+    >>> _compile_path("a//b/")({"a": {"b": 1}})
+    1
+    >>> _compile_path("/")({"a": 1})
+    {'a': 1}
+    >>> _compile_path("/a/b")({"a": {}}) is None
+    True
+    >>> _compile_path("/a/b")({"a": "text"}) is None
+    True
+    >>> _compile_path("/a/b")({"a": None}) is None
+    True
+    >>> _compile_path("/files/1/name")({"files": [{"name": "x"}, {"name": "y"}]})
+    'y'
+    >>> _compile_path("/files/2/name")({"files": [{"name": "x"}]}) is None
+    True
+    >>> _compile_path("/by_id/1")({"by_id": {"1": "one"}})
+    'one'
+    >>> _compile_path("/*")({"a": 1, "*": 2})
+    2
+    """
+    segments = tuple(
+        (segment, int(segment) if segment.isdigit() else None)
+        for segment in path.split("/") if segment
+    )
+    if not segments:
+        return lambda obj: obj
+
+    if len(segments) == 1:
+        [(key, index)] = segments
+
+        def get_one(obj):
+            if isinstance(obj, dict):
+                return obj.get(key)
+            if index is not None and isinstance(obj, list) and index < len(obj):
+                return obj[index]
+            return None
+        return get_one
+
+    def get_many(obj):
+        for key, index in segments:
+            if isinstance(obj, dict):
+                obj = obj.get(key)
+            elif index is not None and isinstance(obj, list) and index < len(obj):
+                obj = obj[index]
+            else:
+                return None
+        return obj
+    return get_many
+
+
+class Projection:
+    r"""
+    Extractor compiled once from a {output_key: path} mapping
+
+    Records are projected onto a new dict, with output keys in the order
+    of the mapping. When every path is a single key, records are
+    projected with a dict lookup per field.
+    >>> project = Projection({"id": "/id", "real_name": "/profile/real_name"})
+    >>> project({"id": "U1", "real_name": "top", "profile": {"real_name": "Ada"}})
+    {'id': 'U1', 'real_name': 'Ada'}
+    >>> project({"id": "U2"})
+    {'id': 'U2', 'real_name': None}
+    >>> project.many([{"id": "U1"}, {"id": "U2", "profile": {"real_name": "Bo"}}])
+    [{'id': 'U1', 'real_name': None}, {'id': 'U2', 'real_name': 'Bo'}]
+    >>> Projection({"ts": "/ts", "user": "user"})({"ts": "1.0", "blocks": []})
+    {'ts': '1.0', 'user': None}
+    """
+
+    def __init__(self, mapping: Dict[str, str]):
+        self._getters = [
+            (key, _compile_path(path)) for key, path in mapping.items()
+        ]
+        keys = [
+            (key, path.strip("/")) for key, path in mapping.items()
+        ]
+        if all(key and "/" not in key for _, key in keys):
+            self._keys = keys
+        else:
+            self._keys = None
+
+    def __call__(self, obj: Dict[str, Any]) -> Dict[str, Any]:
+        if self._keys is not None and isinstance(obj, dict):
+            get = obj.get
+            return {key: get(path) for key, path in self._keys}
+        return {key: getter(obj) for key, getter in self._getters}
+
+    def many(self, objs: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """ Project each of a batch of records """
+        if self._keys is not None:
+            keys = self._keys
+            return [
+                {key: obj.get(path) for key, path in keys}
+                if isinstance(obj, dict) else self(obj)
+                for obj in objs
+            ]
+        getters = self._getters
+        return [{key: getter(obj) for key, getter in getters} for obj in objs]
+
+
+@lru_cache(maxsize=128)
+def _compiled_path(path: str) -> Callable[[Any], Any]:
+    return _compile_path(path)
 
 
 def safe_get(obj: Dict[str, Any], path: str):
-    try:
-        return dpath.util.get(obj, path)
-    except KeyError:
-        return None
+    return _compiled_path(path)(obj)
 
 
 def map_dictionary(mapping: Dict[str, str], obj: Dict[str, Any]):
-    return {key: safe_get(obj, key) for key, path in mapping.items()}
+    return {key: safe_get(obj, path) for key, path in mapping.items()}
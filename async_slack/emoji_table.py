@@ -0,0 +1,124 @@
+import functools
+import hashlib
+import json
+
+from .orger.inorganic import link
+
+try:
+    from emoji.unicode_codes import EMOJI_ALIAS_UNICODE
+except ImportError:  # emoji >= 2
+    from emoji import EMOJI_DATA
+
+    EMOJI_ALIAS_UNICODE = {
+        alias: glyph
+        for glyph, data in EMOJI_DATA.items()
+        for alias in [data["en"], *data.get("alias", [])]
+    }
+
+
+# Slack names for emoji that the emoji package knows under another name
+SLACK_ALIASES = {
+    "simple_smile": "slightly_smiling_face",
+    "thumbsup_all": "thumbsup",
+    "slightly_frowning_face": "frowning_face",
+    "white_frowning_face": "frowning_face",
+    "man-shrugging": "man_shrugging",
+    "woman-shrugging": "woman_shrugging",
+    "man-facepalming": "man_facepalming",
+    "woman-facepalming": "woman_facepalming",
+    "male-technologist": "man_technologist",
+    "female-technologist": "woman_technologist",
+}
+
+# Fitzpatrick modifiers for Slack's skin tones 2 to 6
+SKIN_TONES = {tone: chr(0x1F3FB + tone - 2) for tone in range(2, 7)}
+
+SKIN_TONE_SUFFIX = "::skin-tone-"
+
+
+@functools.lru_cache(maxsize=1)
+def standard_emoji():
+    """ Return a mapping of emoji names, without colons, to glyphs """
+    table = {
+        alias.strip(":"): glyph
+        for alias, glyph in EMOJI_ALIAS_UNICODE.items()
+    }
+    for name, target in SLACK_ALIASES.items():
+        if target in table:
+            table.setdefault(name, table[target])
+    for name, glyph in list(table.items()):
+        table.setdefault(name.replace("_", "-"), glyph)
+    return table
+
+
+def load_custom_emoji(path):
+    """
+    Read custom emoji from a saved emoji.list response
+
+    Returns a mapping of names to image URLs, or to "alias:<name>" for
+    emoji that alias another.
+    """
+    with open(path) as fp:
+        response = json.load(fp)
+    return response.get("emoji", response)
+
+
+class EmojiTable:
+    """
+    Resolve Slack emoji names to glyphs without regular expressions
+
+    Names are looked up in the workspace's custom emoji, then in the
+    standard emoji. Custom emoji render as a link to their image, and
+    names that are not found render as `:name:`.
+    """
+
+    def __init__(self, custom_emoji=None):
+        self._standard = standard_emoji()
+        self._custom = dict(custom_emoji or {})
+        self._fingerprint = None
+
+    def fingerprint(self):
+        """ Return a digest of the standard and custom emoji names and glyphs """
+        if self._fingerprint is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for table in (self._standard, self._custom):
+                digest.update(
+                    json.dumps(table, sort_keys=True).encode("utf-8"))
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def render(self, name, skin_tone=None, unicode=None, _depth=0):
+        """
+        Render an emoji by name, with an optional skin tone from 2 to 6
+
+        `unicode` holds the hyphen-separated code points that Slack sends
+        with standard emoji in rich text, and is used when present. The
+        skin tone modifies the first emoji of a ZWJ sequence.
+        >>> table = EmojiTable()
+        >>> [hex(ord(c)) for c in table.render("wave::skin-tone-2:")]
+        ['0x1f44b', '0x1f3fb']
+        >>> [hex(ord(c)) for c in table.render("male-technologist::skin-tone-3:")]
+        ['0x1f468', '0x1f3fc', '0x200d', '0x1f4bb']
+        >>> [hex(ord(c)) for c in table.render("man-shrugging", skin_tone=6)]
+        ['0x1f937', '0x1f3ff', '0x200d', '0x2642', '0xfe0f']
+        """
+        if SKIN_TONE_SUFFIX in name:
+            name, _, tone = name.partition(SKIN_TONE_SUFFIX)
+            skin_tone = int(tone.strip(":"))
+        custom = self._custom.get(name)
+        if custom is not None:
+            if custom.startswith("alias:") and _depth < 8:
+                return self.render(
+                    custom[len("alias:"):], skin_tone, _depth=_depth + 1)
+            return link(url=custom, title=f":{name}:")
+        if unicode:
+            return "".join(chr(int(code, 16)) for code in unicode.split("-"))
+        glyph = self._standard.get(name)
+        if glyph is None:
+            return f":{name}:"
+        if skin_tone in SKIN_TONES:
+            base, joiner, rest = glyph.partition("\u200d")
+            glyph = (
+                base.replace("\ufe0f", "") + SKIN_TONES[skin_tone] + joiner + rest)
+        return glyph
+
@@ -1,7 +1,8 @@
 import datetime
+import logging
 
 import bonobo
-from bonobo.config import use, Configurable, Option
+from bonobo.config import use, Configurable, Option, Service
 
 from . import db
 from .date_utils import date_range
@@ -30,8 +31,7 @@ def add_user_to_message(message, users):
     return message
 
 
-@use("users")
-def add_user(message, users):
+def add_user_to_thread(message, users):
     updated_message = add_user_to_message(message, users)
     try:
         thread = updated_message["thread"]
@@ -40,11 +40,10 @@ def add_user(message, users):
         ]
     except KeyError:
         pass
-    yield updated_message
+    return updated_message
 
 
-@use("channels")
-def add_channel(message, channels):
+def add_channel_to_message(message, channels):
     message = message.copy()
     try:
         channel_id = message["channel"]
@@ -53,28 +52,70 @@ def add_channel(message, channels):
         pass
     else:
         message["channel_name"] = channel["name"]
-    yield message
+    return message
+
+
+def enrich_message(message, users, channels):
+    return add_channel_to_message(add_user_to_thread(message, users), channels)
+
+
+@use("users")
+def add_user(message, users):
+    yield add_user_to_thread(message, users)
+
+
+@use("channels")
+def add_channel(message, channels):
+    yield add_channel_to_message(message, channels)
+
+
+class PartitionEnricher(Configurable):
+    """
+    Enrich the raw threads for each input date into their own partition
+
+    Each partition is fingerprinted with its raw threads and with the
+    users and channels it was enriched with. Dates whose fingerprint is
+    unchanged since the last run, or which have no raw threads, are
+    skipped.
+    """
+    flush_policy = Option(default=db.FlushPolicy(size=1 << 20))
+    database = Service("database")
+    directory = Service("directory")
+    manifest = Service("enrichment_manifest")
+
+    def __call__(self, date, *, database, directory, manifest):  # pylint: disable=arguments-differ
+        partition = date.isoformat()
+        raw_fingerprint = database.fingerprint(db.RAW_THREADS, partition)
+        if raw_fingerprint is None:
+            return
+        fingerprint = f"{raw_fingerprint}:{directory.fingerprint()}"
+        if manifest.get(partition) == fingerprint:
+            logging.info("Enriched messages for %s are up to date", partition)
+            return
+        users, channels = directory.users, directory.channels
+        with database.open_writer(
+                db.ENRICHED_MESSAGES, partition, self.flush_policy) as sink:
+            for message in database.read(db.RAW_THREADS, partition):
+                sink.write(enrich_message(message, users, channels))
+        manifest.set(partition, fingerprint)
 
 
 def get_enriched_messages_graph(start_date, end_date, **options):
     graph = bonobo.Graph()
     graph.add_chain(
         DateRangeNode(start_date, end_date),
-        db.JsonRawThreadsReader(),
-        add_user,
-        add_channel,
-        db.JsonEnrichedMessagesWriter()
+        PartitionEnricher()
     )
     return graph
 
 
 def get_enriched_messages_services(base_services, **options):
-    database = base_services["database"]
-    users = db.Users(database)
-    channels = db.Channels(database)
+    directory = base_services["directory"]
     return {
         **base_services,
-        "users": users,
-        "channels": channels
+        "users": directory.users,
+        "channels": directory.channels,
+        "enrichment_manifest": db.Manifest(
+            base_services["database"], db.ENRICHED_MESSAGES_MANIFEST)
     }
-    
+
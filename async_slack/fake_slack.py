@@ -0,0 +1,320 @@
+"""
+Local stand-in for the Slack Web API, for end-to-end load tests
+
+Serves conversations.history, conversations.replies, conversations.list
+and users.list, with Slack's pagination, from a synthetic workspace or
+from a cassette of responses recorded from the real API. It can add
+latency and answer a share of calls with 429s. Point async-update-slack
+at it with --slack-api-url or slack_api_url in config.toml:
+
+    async-slack-fake-server --port 8765 --days 30
+    async-update-slack --slack-api-url http://localhost:8765/api
+
+Calls per method and rate limited calls are served at /_stats, and
+logged when the server stops.
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import datetime
+import functools
+import json
+import logging
+import random
+from pathlib import Path
+
+from aiohttp import web
+import aiohttp
+
+from .slack import SLACK_API_URL
+from .synthetic_workspace import SyntheticWorkspace, WORKSPACE_SIZES
+
+DEFAULT_PAGE_SIZE = 100
+
+
+def _encode_cursor(offset):
+    return base64.b64encode(f"offset:{offset}".encode()).decode()
+
+
+def _decode_cursor(cursor):
+    if not cursor:
+        return 0
+    return int(base64.b64decode(cursor).decode().split(":")[1])
+
+
+def _paginate(items, key, params):
+    """ Return a page of items, as Slack's cursor-paginated methods do """
+    limit = int(params.get("limit") or DEFAULT_PAGE_SIZE)
+    offset = _decode_cursor(params.get("cursor"))
+    page = items[offset:offset + limit]
+    next_offset = offset + limit
+    next_cursor = _encode_cursor(next_offset) if next_offset < len(items) else ""
+    return {
+        "ok": True,
+        key: page,
+        "response_metadata": {"next_cursor": next_cursor}
+    }
+
+
+class SyntheticBackend:
+    """ Answers API calls from a SyntheticWorkspace """
+
+    def __init__(self, workspace):
+        self._workspace = workspace
+        self._channel_ids = {
+            channel["id"] for channel in workspace.channels()}
+        self._history = functools.lru_cache(maxsize=4096)(workspace.history)
+        self._replies = functools.lru_cache(maxsize=4096)(workspace.replies)
+
+    def _dates_between(self, oldest, latest):
+        dates = self._workspace.dates
+        first = datetime.date.fromtimestamp(oldest) if oldest else dates[0]
+        last = datetime.date.fromtimestamp(latest) if latest else dates[-1]
+        return [date for date in dates if first <= date <= last]
+
+    def conversations_history(self, params):
+        channel_id = params.get("channel")
+        if channel_id not in self._channel_ids:
+            return {"ok": False, "error": "channel_not_found"}
+        oldest = float(params.get("oldest") or 0)
+        latest = float(params.get("latest") or 0)
+        messages = []
+        for date in reversed(self._dates_between(oldest, latest)):
+            messages.extend(
+                message for message in self._history(channel_id, date)
+                if float(message["ts"]) > oldest
+                and (not latest or float(message["ts"]) < latest)
+            )
+        # Pages can be walked with the cursor, or by moving latest back
+        page = _paginate(messages, "messages", params)
+        page["has_more"] = bool(page["response_metadata"]["next_cursor"])
+        return page
+
+    def conversations_replies(self, params):
+        channel_id = params.get("channel")
+        if channel_id not in self._channel_ids:
+            return {"ok": False, "error": "channel_not_found"}
+        thread_ts = params["ts"]
+        parent, *replies = self._replies(channel_id, thread_ts)
+        oldest = float(params.get("oldest") or 0)
+        page_size = max(1, int(params.get("limit") or DEFAULT_PAGE_SIZE) - 1)
+        replies = [
+            reply for reply in replies if float(reply["ts"]) > oldest]
+        # Slack puts the parent at the top of every page
+        return {
+            "ok": True,
+            "messages": [parent, *replies[:page_size]],
+            "has_more": len(replies) > page_size
+        }
+
+    def conversations_list(self, params):
+        return _paginate(self._workspace.channels(), "channels", params)
+
+    def users_list(self, params):
+        return _paginate(self._workspace.users(), "members", params)
+
+    def call(self, method, params):
+        handler = getattr(self, method.replace(".", "_"), None)
+        if handler is None:
+            return {"ok": False, "error": "unknown_method"}
+        return handler(params)
+
+
+def _cassette_key(method, params):
+    kept = {key: value for key, value in params.items() if key != "token"}
+    return json.dumps([method, sorted(kept.items())])
+
+
+class CassetteBackend:
+    """
+    Answers API calls from a cassette of recorded responses
+
+    A cassette is a JSON object mapping each call, a method and its
+    parameters without the token, to its response. Calls that are not
+    in the cassette get a 404 with a cassette_miss error, which clients
+    fail on rather than retry. With `upstream_url`, calls are forwarded
+    to the real API instead, and their responses are recorded, to be
+    saved with `save`.
+    """
+
+    def __init__(self, path, upstream_url=None):
+        self._path = Path(path)
+        self._upstream_url = upstream_url
+        self._responses = {}
+        if self._path.exists():
+            self._responses = json.loads(self._path.read_text())
+        self._session = None
+
+    async def forward(self, method, params, headers):
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        forwarded_headers = {}
+        if "Authorization" in headers:
+            forwarded_headers["Authorization"] = headers["Authorization"]
+        async with self._session.get(
+                f"{self._upstream_url}/{method}",
+                params=params,
+                headers=forwarded_headers) as response:
+            if response.status == 429:
+                return response.status, response.headers.get("Retry-After"), None
+            body = await response.json()
+        if body.get("ok"):
+            self._responses[_cassette_key(method, params)] = body
+        return 200, None, body
+
+    def call(self, method, params):
+        try:
+            return self._responses[_cassette_key(method, params)]
+        except KeyError:
+            raise web.HTTPNotFound(
+                text=json.dumps({"ok": False, "error": "cassette_miss"}),
+                content_type="application/json"
+            ) from None
+
+    @property
+    def recording(self):
+        return self._upstream_url is not None
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    def save(self):
+        if self.recording:
+            temporary_path = self._path.with_suffix(".tmp")
+            temporary_path.write_text(json.dumps(self._responses))
+            temporary_path.replace(self._path)
+
+
+class FakeSlackServer:
+    """
+    aiohttp application serving a backend as the Slack Web API
+
+    Each call waits `latency` seconds, give or take `jitter`, and a
+    `rate_limit_share` of calls are answered with a 429 and a
+    Retry-After of `retry_after` seconds. Both are drawn from a seeded
+    random generator, for reproducible runs.
+    """
+
+    def __init__(
+            self,
+            backend,
+            latency=0.0,
+            jitter=0.0,
+            rate_limit_share=0.0,
+            retry_after=1,
+            seed=0
+    ):
+        self._backend = backend
+        self._latency = latency
+        self._jitter = jitter
+        self._rate_limit_share = rate_limit_share
+        self._retry_after = retry_after
+        self._random = random.Random(seed)
+        self.calls = collections.Counter()
+        self.rate_limited = collections.Counter()
+
+    def application(self):
+        app = web.Application()
+        app.router.add_route("*", "/api/{method}", self._handle)
+        app.router.add_get("/_stats", self._stats)
+        app.on_cleanup.append(self._cleanup)
+        return app
+
+    def stats(self):
+        return {"calls": dict(self.calls), "rate_limited": dict(self.rate_limited)}
+
+    async def _stats(self, request):
+        return web.json_response(self.stats())
+
+    async def _cleanup(self, app):
+        logging.info("Fake Slack API calls: %s", self.stats())
+        if isinstance(self._backend, CassetteBackend):
+            await self._backend.close()
+            self._backend.save()
+
+    async def _handle(self, request):
+        method = request.match_info["method"]
+        params = dict(request.query)
+        if request.method == "POST":
+            params.update(await request.post())
+        self.calls[method] += 1
+
+        delay = self._latency + self._random.uniform(-self._jitter, self._jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self._random.random() < self._rate_limit_share:
+            self.rate_limited[method] += 1
+            return web.json_response(
+                {"ok": False, "error": "ratelimited"},
+                status=429,
+                headers={"Retry-After": str(self._retry_after)}
+            )
+
+        if isinstance(self._backend, CassetteBackend) and self._backend.recording:
+            status, retry_after, body = await self._backend.forward(
+                method, params, request.headers)
+            if status == 429:
+                self.rate_limited[method] += 1
+                return web.json_response(
+                    {"ok": False, "error": "ratelimited"},
+                    status=429,
+                    headers={"Retry-After": retry_after or "1"}
+                )
+            return web.json_response(body)
+        return web.json_response(self._backend.call(method, params))
+
+
+def make_parser():
+    parser = argparse.ArgumentParser("async-slack-fake-server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--size", choices=sorted(WORKSPACE_SIZES), default="small",
+        help="Size of the synthetic workspace")
+    parser.add_argument(
+        "--days", type=int, default=None,
+        help="Days of synthetic history, ending today")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--cassette", type=Path, default=None,
+        help="Serve recorded responses from this file, instead of synthetic data")
+    parser.add_argument(
+        "--record", action="store_true",
+        help="Forward calls to Slack and record them to the cassette")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument(
+        "--rate-limit-share", type=float, default=0.0,
+        help="Share of calls to answer with a 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    return parser
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    arguments = make_parser().parse_args()
+    if arguments.cassette is not None:
+        backend = CassetteBackend(
+            arguments.cassette,
+            SLACK_API_URL if arguments.record else None
+        )
+    else:
+        spec = WORKSPACE_SIZES[arguments.size]
+        days = arguments.days or spec.days
+        spec = spec._replace(
+            seed=arguments.seed,
+            days=days,
+            start_date=datetime.date.today() - datetime.timedelta(days=days - 1)
+        )
+        backend = SyntheticBackend(SyntheticWorkspace(spec))
+    server = FakeSlackServer(
+        backend,
+        latency=arguments.latency,
+        jitter=arguments.jitter,
+        rate_limit_share=arguments.rate_limit_share,
+        retry_after=arguments.retry_after,
+        seed=arguments.seed
+    )
+    web.run_app(server.application(), host=arguments.host, port=arguments.port)
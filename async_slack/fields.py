@@ -0,0 +1,35 @@
+"""
+The fields kept from each Slack API object when it is stored
+"""
+from .dict_utils import Projection
+
+USER_FIELDS = Projection({
+    "name": "/name",
+    "id": "/id",
+    "real_name": "/profile/real_name",
+})
+
+CHANNEL_FIELDS = Projection({
+    "name": "/name",
+    "id": "/id",
+    "is_member": "/is_member",
+    "is_im": "/is_im",
+    "is_mpim": "/is_mpim",
+    "is_private": "/is_private",
+    "user": "/user"
+})
+
+THREAD_MESSAGE_FIELDS = Projection({
+    "blocks": "/blocks",
+    "ts": "/ts",
+    "user": "/user",
+})
+
+CHANNEL_MESSAGE_FIELDS = Projection({
+    "blocks": "/blocks",
+    "ts": "/ts",
+    "thread_ts": "/thread_ts",
+    "user": "/user",
+    "reply_count": "/reply_count",
+    "latest_reply": "/latest_reply",
+})
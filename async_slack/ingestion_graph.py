@@ -0,0 +1,139 @@
+import datetime
+import logging
+
+import bonobo
+
+from . import db
+from .messages_fetcher import AsyncMessagesFetcher, MAX_PAGE_SIZE
+from .message_count_graph import get_channels, DailyMessageCountWriter
+from .raw_threads_graph import (
+    remove_invalid_messages, process_channel_message, ThreadHydrator
+)
+from .date_utils import date_range, contiguous_ranges
+from .day_executor import run_days
+from .instrumentation import run_graph
+
+
+def add_channel_id(channel_id, message):
+    yield {**message, "channel": channel_id}
+
+
+def split_channel_id(message):
+    yield message["channel"], message
+
+
+def get_fetch_graph(day):
+    graph = bonobo.Graph()
+    graph.add_chain(
+        get_channels,
+        AsyncMessagesFetcher(day, day + datetime.timedelta(days=1)),
+        add_channel_id,
+        db.JsonRawMessagesWriter(day)
+    )
+    return graph
+
+
+def get_fetch_range_graph(start_date, end_date):
+    graph = bonobo.Graph()
+    graph.add_chain(
+        get_channels,
+        AsyncMessagesFetcher(start_date, end_date, page_size=MAX_PAGE_SIZE),
+        add_channel_id,
+        db.JsonRawMessagesRangeWriter(start_date, end_date)
+    )
+    return graph
+
+
+def get_derive_graph(day):
+    """
+    Build the message count and raw threads for a day from its raw messages
+    """
+    graph = bonobo.Graph()
+    graph.add_chain(
+        db.JsonRawMessagesDateReader(day),
+        split_channel_id
+    )
+    graph.add_chain(
+        DailyMessageCountWriter(),
+        _input=split_channel_id
+    )
+    graph.add_chain(
+        remove_invalid_messages,
+        process_channel_message,
+        ThreadHydrator(),
+        db.JsonRawThreadsWriter(day),
+        _input=split_channel_id
+    )
+    return graph
+
+
+def get_ingestion_services(base_services):
+    database = base_services["database"]
+    return {
+        **base_services,
+        "channels": base_services["directory"].channels,
+        "message_count": db.MessageCount(database),
+        "thread_cache": db.ThreadCache(database)
+    }
+
+
+def update_ingestion(
+        start_date,
+        end_date,
+        backdate_nworking_days,
+        base_services,
+        max_concurrent_days=1,
+        backfill=False
+):
+    """
+    Fetch each channel-day of history once, then derive counts and threads
+
+    The history is written to raw-messages-<date>.json, from which the
+    message count and the raw threads for the day are built. In backfill
+    mode, each channel's history is scanned once per range of
+    consecutive incomplete days.
+    """
+    database = base_services["database"]
+    status_db = db.Status(database)
+    services = get_ingestion_services(base_services)
+    ndays_ago = base_services["working_days"].nworking_days_before(
+        datetime.date.today(), backdate_nworking_days)
+
+    def derive_day(date):
+        logging.info("Deriving counts and threads for %s", date.isoformat())
+        run_graph(get_derive_graph(date), services, "derive")
+
+    def ingest_day(date):
+        logging.info("Fetching raw messages for %s", date.isoformat())
+        run_graph(get_fetch_graph(date), services, "fetch")
+        derive_day(date)
+
+    def set_complete(date):
+        if date < datetime.date.today():
+            status_db.set_message_count_complete(date)
+        if date < ndays_ago:
+            status_db.set_raw_threads_complete(date)
+
+    dates = []
+    for date in date_range(start_date, end_date):
+        if not (status_db.is_message_count_complete(date) and
+                status_db.is_raw_threads_complete(date)):
+            dates.append(date)
+        else:
+            logging.info("Date %s is complete. Skipping.", date.isoformat())
+
+    if backfill:
+        for range_start, range_end in contiguous_ranges(dates):
+            logging.info(
+                "Fetching raw messages from %s to %s",
+                range_start.isoformat(),
+                range_end.isoformat()
+            )
+            graph = get_fetch_range_graph(range_start, range_end)
+            run_graph(graph, services, "fetch range")
+            range_dates = date_range(range_start, range_end)
+            for date in run_days(range_dates, derive_day, max_concurrent_days):
+                set_complete(date)
+    else:
+        for date in run_days(dates, ingest_day, max_concurrent_days):
+            set_complete(date)
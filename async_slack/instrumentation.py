@@ -0,0 +1,80 @@
+"""
+bonobo execution contexts that record node metrics
+
+Graphs run with `run_graph` record, for each node, the messages it read
+and sent, the time it spent working and the time it spent waiting for
+input, under the phase they were run in.
+"""
+import functools
+import time
+
+import bonobo
+from bonobo.execution.contexts.graph import GraphExecutionContext
+from bonobo.execution.contexts.node import NodeExecutionContext
+from bonobo.execution.strategies.executor import ThreadPoolExecutorStrategy
+from bonobo.util import get_name
+
+from . import metrics
+
+
+class InstrumentedNodeExecutionContext(NodeExecutionContext):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._busy_seconds = 0.0
+        self._queue_wait_seconds = 0.0
+
+    def _get(self):
+        start = time.perf_counter()
+        try:
+            return super()._get()
+        finally:
+            self._queue_wait_seconds += time.perf_counter() - start
+
+    def _timed(self, f):
+        start = time.perf_counter()
+        try:
+            return f()
+        finally:
+            self._busy_seconds += time.perf_counter() - start
+
+    def start(self):
+        self._timed(super().start)
+
+    def step(self):
+        self._timed(super().step)
+
+    def stop(self):
+        if self.stopped:
+            # bonobo stops each node again as the graph stops, and the
+            # counters are only recorded once
+            return super().stop()
+        try:
+            self._timed(super().stop)
+        finally:
+            self.parent.metrics.record_node(
+                self.parent.phase,
+                get_name(self.wrapped),
+                self.statistics["in"],
+                self.statistics["out"],
+                self.statistics["err"],
+                self._busy_seconds - self._queue_wait_seconds,
+                self._queue_wait_seconds
+            )
+
+
+class InstrumentedGraphExecutionContext(GraphExecutionContext):
+    NodeExecutionContextType = InstrumentedNodeExecutionContext
+
+    def __init__(self, graph, *args, phase, registry=metrics.registry, **kwargs):
+        # Set before the node contexts are created by the base class
+        self.phase = phase
+        self.metrics = registry
+        super().__init__(graph, *args, **kwargs)
+
+
+def run_graph(graph, services, phase, registry=metrics.registry):
+    """ Run a graph as bonobo.run does, recording its node metrics """
+    strategy = ThreadPoolExecutorStrategy(functools.partial(
+        InstrumentedGraphExecutionContext, phase=phase, registry=registry))
+    return bonobo.run(graph, services=services, strategy=strategy)
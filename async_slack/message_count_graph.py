@@ -1,23 +1,30 @@
 import datetime
 import logging
+from collections import Counter
 
 import bonobo
-from bonobo.config import use, Configurable, Option, Service, use_context
+from bonobo.config import (
+    use, Configurable, ContextProcessor, Option, Service, use_context)
+from bonobo.util import ValueHolder
 
 from . import db
-from .messages_fetcher import MessagesFetcher
+from .messages_fetcher import AsyncMessagesFetcher
 from .channel_grouper import ChannelGrouper
-from .date_utils import date_range, nworking_days_before
+from .date_utils import date_range, message_date
+from .day_executor import run_days
+from .instrumentation import run_graph
 
 
 class RecentlyActiveChannelSource(Configurable):
 
     message_count_database = Service("message_count")
+    working_days = Service("working_days")
     date = Option(required=True, positional=True)
 
-    def __call__(self, message_count_database):
+    def __call__(self, message_count_database, working_days):
         all_channels = set()
-        for day in date_range(nworking_days_before(self.date, 3), self.date):
+        start_date = working_days.nworking_days_before(self.date, 3)
+        for day in date_range(start_date, self.date):
             channels = message_count_database.get_channels_for_day(day)
             all_channels.update(channels)
         yield from all_channels
@@ -30,10 +37,9 @@ def get_channels(channels):
             yield channel["id"]
 
 
-def set_message_count(channel, messages):
-    number_messages = len(messages)
-    if number_messages:
-        yield (channel, len(messages))
+def set_message_count(channel, count):
+    if count:
+        yield (channel, count)
 
 
 def process_message(channel, message):
@@ -50,13 +56,31 @@ class MessageCountWriter(Configurable):
         message_count_database.set_day_channel(self.date, channel, count)
 
 
+@use_context
+class DailyMessageCountWriter(Configurable):
+    """ Count messages per day and per channel, writing the counts at the end """
+
+    message_count_database = Service("message_count")
+
+    @ContextProcessor
+    def counts(self, _, *, message_count_database):
+        counts = yield ValueHolder(Counter())
+        message_count_database.set_many(
+            (date, channel, count)
+            for (date, channel), count in counts.get().items()
+        )
+
+    def __call__(self, counts, _, channel, message, *, message_count_database):
+        counts.get()[(message_date(message), channel)] += 1
+
+
 def get_message_count_graph(day, quick):
     graph = bonobo.Graph()
     graph.add_chain(
         RecentlyActiveChannelSource(day) if quick else get_channels,
-        MessagesFetcher(day, day + datetime.timedelta(days=1)),
+        AsyncMessagesFetcher(day, day + datetime.timedelta(days=1)),
         process_message,
-        ChannelGrouper(),
+        ChannelGrouper(count_only=True),
         set_message_count,
         MessageCountWriter(day)
     )
@@ -65,7 +89,7 @@ def get_message_count_graph(day, quick):
 
 def get_message_count_services(base_services):
     database = base_services["database"]
-    channels = db.Channels(database)
+    channels = base_services["directory"].channels
     message_count = db.MessageCount(database)
     services = {
         **base_services,
@@ -80,20 +104,27 @@ def update_message_count_quick(date, base_services):
     logging.info(
         f"Fetching raw messages for date {date.isoformat()} in quick mode")
     graph = get_message_count_graph(date, True)
-    bonobo.run(graph, services=services)
+    run_graph(graph, services, "message count")
 
 
-def update_message_count(start_date, end_date, base_services):
+def update_message_count(
+        start_date, end_date, base_services, max_concurrent_days=1):
     database = base_services["database"]
     status_db = db.Status(database)
     services = get_message_count_services(base_services)
 
+    def run_day(date):
+        logging.info(f"Fetching raw messages for {date.isoformat()}")
+        graph = get_message_count_graph(date, False)
+        run_graph(graph, services, "message count")
+
+    dates = []
     for date in date_range(start_date, end_date):
         if not status_db.is_message_count_complete(date):
-            logging.info(f"Fetching raw messages for {date.isoformat()}")
-            graph = get_message_count_graph(date, False)
-            bonobo.run(graph, services=services)
-            if date < datetime.date.today():
-                status_db.set_message_count_complete(date)
+            dates.append(date)
         else:
             logging.info(f"Date {date.isoformat()} is complete. Skipping.")
+
+    for date in run_days(dates, run_day, max_concurrent_days):
+        if date < datetime.date.today():
+            status_db.set_message_count_complete(date)
@@ -1,34 +1,129 @@
+import asyncio
 import datetime
 
-from bonobo.config import Configurable, Option, Service
+from bonobo.config import Configurable, ContextProcessor, Option, Service
+from bonobo.util import ValueHolder
+
 from . import slack
 
 
+# Largest page of history that Slack will return in one call
+MAX_PAGE_SIZE = 999
+
+
 @slack.api_retry
-def get_history(client, channel_id, latest, oldest):
-    return client.conversations.history(
+@slack.rate_limited("conversations.history")
+def get_history(slack, channel_id, latest, oldest, limit=None):
+    return slack.client.conversations.history(
         channel_id,
         oldest=oldest,
         latest=latest,
+        limit=limit,
     ).body
 
 
+@slack.api_retry
+async def get_history_async(session, channel_id, latest, oldest, limit=None):
+    return await session.conversations_history(
+        channel_id,
+        oldest=oldest,
+        latest=latest,
+        limit=limit,
+    )
+
+
+def get_time_bounds(start_date, end_date):
+    midnight = datetime.time(0, 0)
+    oldest = str(datetime.datetime.combine(start_date, midnight).timestamp())
+    latest = str(datetime.datetime.combine(end_date, midnight).timestamp())
+    return oldest, latest
+
+
+async def fetch_history(session, channel_id, latest, oldest, limit=None):
+    response = await get_history_async(
+        session, channel_id, latest, oldest, limit)
+    messages = list(response["messages"])
+
+    while response["has_more"]:
+        next_latest = response["messages"][-1]["ts"]
+        response = await get_history_async(
+            session, channel_id, next_latest, oldest, limit)
+        messages.extend(response["messages"])
+    return messages
+
+
+async def fetch_histories(
+        slack, channel_ids, latest, oldest, concurrency, send, limit=None):
+    """
+    Fetch the history of each channel, calling send(channel_id, message)
+
+    Each channel's messages are sent as soon as its history is complete.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(session, channel_id):
+        async with semaphore:
+            messages = await fetch_history(
+                session, channel_id, latest, oldest, limit)
+        for message in messages:
+            send(channel_id, message)
+
+    async with slack.connect() as session:
+        await asyncio.gather(
+            *(fetch(session, channel_id) for channel_id in channel_ids)
+        )
+
+
 class MessagesFetcher(Configurable):
     start_date = Option(positional=True, required=True)
     end_date = Option(positional=True, required=True)
+    page_size = Option(int, required=False, default=None)
     slack = Service("slack")
 
     def __call__(self, channel_id, *, slack):  # pylint: disable=arguments-differ
-        midnight = datetime.time(0, 0)
-        oldest = str(datetime.datetime.combine(self.start_date, midnight).timestamp())
-        latest = str(datetime.datetime.combine(self.end_date, midnight).timestamp())
-        response = get_history(slack.client, channel_id, latest, oldest)
+        oldest, latest = get_time_bounds(self.start_date, self.end_date)
+        response = get_history(slack, channel_id, latest, oldest, self.page_size)
 
         for message in response["messages"]:
             yield (channel_id, message)
 
         while response["has_more"]:
             next_latest = response["messages"][-1]["ts"]
-            response = get_history(slack.client, channel_id, next_latest, oldest)
+            response = get_history(
+                slack, channel_id, next_latest, oldest, self.page_size)
             for message in response["messages"]:
                 yield (channel_id, message)
+
+
+class AsyncMessagesFetcher(Configurable):
+    """
+    Fetch the history of every input channel concurrently
+
+    Channel ids are collected until the input is exhausted, then all
+    histories are fetched over a single pooled session, with at most
+    `concurrency` channels in flight. Messages are sent on a channel at
+    a time, as each history completes. Requires an AsyncSlackClient as
+    the slack service.
+    """
+    start_date = Option(positional=True, required=True)
+    end_date = Option(positional=True, required=True)
+    concurrency = Option(int, default=20)
+    page_size = Option(int, required=False, default=None)
+    slack = Service("slack")
+
+    @ContextProcessor
+    def channel_ids(self, context, *, slack):
+        channel_ids = yield ValueHolder([])
+        oldest, latest = get_time_bounds(self.start_date, self.end_date)
+        asyncio.run(fetch_histories(
+            slack,
+            channel_ids.get(),
+            latest,
+            oldest,
+            self.concurrency,
+            context.send,
+            self.page_size
+        ))
+
+    def __call__(self, channel_ids, channel_id, *, slack):  # pylint: disable=arguments-differ
+        channel_ids.get().append(channel_id)
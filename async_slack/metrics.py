@@ -0,0 +1,200 @@
+"""
+Counters for an update run, and the reports written from them
+
+The module-level `registry` is shared by the graphs, the Slack client
+and the databases. At the end of a run, it is written as a JSON run
+report, and optionally as a Prometheus text-format file for the node
+exporter's textfile collector.
+"""
+import collections
+import datetime
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+PROMETHEUS_PREFIX = "async_slack"
+
+
+class Metrics:
+    """
+    Thread-safe counters of graph nodes, API calls and bytes written
+
+    Node counters are kept per phase and node name, API counters per
+    method, and per channel for methods called on a channel. Bytes are
+    kept per database file, and per store for the Prometheus output,
+    where a label per file would grow without bound.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.phases = collections.OrderedDict()
+            self.nodes = collections.defaultdict(
+                lambda: collections.defaultdict(collections.Counter))
+            self.api = collections.defaultdict(collections.Counter)
+            self.api_channels = collections.defaultdict(collections.Counter)
+            self.retries = collections.Counter()
+            self.file_bytes = collections.Counter()
+            self.store_bytes = collections.Counter()
+
+    def record_phase(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def record_node(self, phase, node, messages_in, messages_out, errors,
+                    seconds, queue_wait):
+        with self._lock:
+            counters = self.nodes[phase][node]
+            counters["runs"] += 1
+            counters["in"] += messages_in
+            counters["out"] += messages_out
+            counters["errors"] += errors
+            counters["seconds"] += seconds
+            counters["queue_wait_seconds"] += queue_wait
+
+    def record_api_call(self, method, seconds, outcome="ok", channel=None):
+        """ Count a call to `method`, whose outcome is ok, rate_limited or error """
+        with self._lock:
+            counters = self.api[method]
+            counters["calls"] += 1
+            counters[outcome] += 1
+            counters["seconds"] += seconds
+            if channel is not None:
+                counters = self.api_channels[(method, channel)]
+                counters["calls"] += 1
+                counters["seconds"] += seconds
+
+    def record_retry(self, function):
+        with self._lock:
+            self.retries[function] += 1
+
+    def record_bytes_written(self, store, file_name, nbytes):
+        with self._lock:
+            self.file_bytes[file_name] += nbytes
+            self.store_bytes[store] += nbytes
+
+    def report(self):
+        """ Return the counters as a JSON-serializable dict """
+        with self._lock:
+            finished = time.time()
+            by_channel = collections.defaultdict(dict)
+            for (method, channel), counters in self.api_channels.items():
+                by_channel[method][channel] = dict(counters)
+            return {
+                "started": _isoformat(self.started),
+                "finished": _isoformat(finished),
+                "seconds": finished - self.started,
+                "phases": dict(self.phases),
+                "nodes": {
+                    phase: {node: dict(counters) for node, counters in nodes.items()}
+                    for phase, nodes in self.nodes.items()
+                },
+                "api": {
+                    method: {**counters, "by_channel": by_channel.get(method, {})}
+                    for method, counters in self.api.items()
+                },
+                "retries": dict(self.retries),
+                "bytes_written": dict(self.file_bytes),
+            }
+
+    def prometheus_lines(self):
+        """ Yield the counters in the Prometheus text exposition format """
+        report = self.report()
+        yield from _gauge(
+            "last_run_timestamp_seconds", "End of the last update run",
+            [({}, self.started + report["seconds"])])
+        yield from _gauge(
+            "run_seconds", "Duration of the last update run",
+            [({}, report["seconds"])])
+        yield from _gauge(
+            "phase_seconds", "Time spent in each phase of the last run",
+            [({"phase": phase}, seconds)
+             for phase, seconds in report["phases"].items()])
+        node_samples = [
+            ({"phase": phase, "node": node}, counters)
+            for phase, nodes in report["nodes"].items()
+            for node, counters in nodes.items()
+        ]
+        for key, name, help_text in [
+                ("in", "node_messages_in", "Messages read by each graph node"),
+                ("out", "node_messages_out", "Messages sent by each graph node"),
+                ("errors", "node_errors", "Errors raised by each graph node"),
+                ("seconds", "node_seconds", "Time each graph node spent working"),
+                ("queue_wait_seconds", "node_queue_wait_seconds",
+                 "Time each graph node spent waiting for input")]:
+            yield from _gauge(name, help_text, [
+                (labels, counters.get(key, 0))
+                for labels, counters in node_samples
+            ])
+        for key, name, help_text in [
+                ("calls", "api_calls", "Slack API calls per method"),
+                ("rate_limited", "api_rate_limited", "Slack API calls answered with a 429"),
+                ("error", "api_errors", "Slack API calls that failed otherwise"),
+                ("seconds", "api_seconds", "Time spent in Slack API calls")]:
+            yield from _gauge(name, help_text, [
+                ({"method": method}, counters.get(key, 0))
+                for method, counters in report["api"].items()
+            ])
+        yield from _gauge(
+            "api_retries", "Retries of each Slack API function",
+            [({"function": function}, count)
+             for function, count in report["retries"].items()])
+        with self._lock:
+            store_bytes = dict(self.store_bytes)
+        yield from _gauge(
+            "bytes_written", "Bytes written to each database store",
+            [({"store": store}, nbytes) for store, nbytes in store_bytes.items()])
+
+    def write_report(self, path):
+        _write_atomically(Path(path), json.dumps(self.report(), indent=2) + "\n")
+
+    def write_prometheus(self, path):
+        """
+        Write a .prom file for the node exporter's textfile collector
+
+        The file is written next to its destination and renamed over it,
+        so that the collector never reads a partial file.
+        """
+        _write_atomically(Path(path), "".join(
+            line + "\n" for line in self.prometheus_lines()))
+
+
+def _isoformat(timestamp):
+    return datetime.datetime.fromtimestamp(
+        timestamp, datetime.timezone.utc).isoformat()
+
+
+def _escape_label(value):
+    return (
+        str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+
+
+def _gauge(name, help_text, samples):
+    if not samples:
+        return
+    name = f"{PROMETHEUS_PREFIX}_{name}"
+    yield f"# HELP {name} {help_text}"
+    yield f"# TYPE {name} gauge"
+    for labels, value in samples:
+        if labels:
+            label_text = ",".join(
+                f'{key}="{_escape_label(label)}"' for key, label in labels.items())
+            yield f"{name}{{{label_text}}} {value}"
+        else:
+            yield f"{name} {value}"
+
+
+def _write_atomically(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(path.name + ".tmp")
+    temporary_path.write_text(text)
+    os.replace(temporary_path, path)
+
+
+registry = Metrics()
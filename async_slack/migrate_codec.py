@@ -0,0 +1,69 @@
+import argparse
+import logging
+
+from . import db
+from .config import read_configuration
+from .serialization import get_codec
+
+
+RECORD_STORES = [
+    db.USERS,
+    db.CHANNELS,
+    db.RAW_MESSAGES,
+    db.RAW_THREADS,
+    db.ENRICHED_MESSAGES,
+    db.ORG_MESSAGES,
+]
+
+
+logging.basicConfig(level=logging.INFO)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser("async-slack-migrate-codec")
+    parser.add_argument("codec", choices=["json", "orjson", "msgpack"])
+    parser.add_argument(
+        "--store",
+        action="append",
+        choices=RECORD_STORES,
+        help="Store to convert. Repeat for several. Defaults to all stores."
+    )
+    parser.add_argument(
+        "--database-directory",
+        help="Defaults to the database directory in the configuration"
+    )
+    return parser
+
+
+def migrate_store(database, store, codec):
+    partitions = [None] + database.partitions(store)
+    for partition in partitions:
+        # Readers detect the codec of each file, so the old files can be
+        # read whatever they were written with. The old file stays open
+        # until the new one replaces it, so records are streamed across.
+        records = database.read(store, partition)
+        first = next(records, None)
+        if partition is None and first is None:
+            continue
+        logging.info(
+            "Converting %s %s to %s", store, partition or "", codec.name)
+        with database.open_writer(store, partition, codec=codec) as sink:
+            if first is not None:
+                sink.write(first)
+            for record in records:
+                sink.write(record)
+
+
+def main():
+    arguments = make_parser().parse_args()
+    database_directory = arguments.database_directory
+    if database_directory is None:
+        database_directory = read_configuration().database_directory
+    database = db.JsonFsDatabase(database_directory)
+    codec = get_codec(arguments.codec)
+    for store in arguments.store or RECORD_STORES:
+        migrate_store(database, store, codec)
+    logging.info(
+        "Set the codecs table in config.toml to match, "
+        "so that new files are written with %s.", codec.name
+    )
@@ -1,12 +1,21 @@
 from datetime import datetime, date
+import io
 import logging
 from pathlib import Path
 import re
 import os
 from collections import OrderedDict
-from typing import NamedTuple, Optional, Sequence, Dict, Mapping, Any, Tuple, TypeVar, Callable, Union, List
+from typing import NamedTuple, Optional, Sequence, Dict, Mapping, Any, Tuple, TypeVar, Callable, Union, List, Iterable, TextIO
 
 Dateish = Union[datetime, date]
+# A body is either a string, or an iterable of strings written one after the other
+Body = Union[str, Iterable[str]]
+
+_WHITESPACE_RE = re.compile(r'\s')
+_HEADING_RE = re.compile(r'[\]\[]')
+_TAG_RE = re.compile(r'[^@\w]')
+# The line boundaries recognised by str.splitlines
+_LINE_ENDINGS = frozenset('\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029')
 
 def link(*, url: str, title: str) -> str:
     """
@@ -72,13 +81,42 @@ def asorgoutline(
     >>> asorgoutline(heading='task', body='hello', scheduled=datetime.utcfromtimestamp(0))
     '* task\nSCHEDULED: <1970-01-01 Thu 00:00>\n hello'
     """
+    sink = io.StringIO()
+    write_outline(
+        sink,
+        heading=heading,
+        todo=todo,
+        tags=tags,
+        scheduled=scheduled,
+        properties=properties,
+        body=body,
+        level=level,
+    )
+    return sink.getvalue()
+
+
+def write_outline(
+        sink: TextIO,
+        heading: Optional[str] = None,
+        todo: Optional[str] = None,
+        tags: Sequence[str] = [],
+        scheduled: Optional[Dateish] = None,
+        properties: Optional[Mapping[str, str]]=None,
+        body: Optional[Body] = None,
+        level: int=1,
+) -> None:
+    r"""
+    Writes Org mode outline (apart from children) to sink, as asorgoutline renders it
+
+    The body may be an iterable of chunks, which are sanitised and written one at a time
+    >>> sink = io.StringIO()
+    >>> write_outline(sink, heading='channel', body=(f'message {i}\n' for i in range(2)))
+    >>> sink.getvalue()
+    '* channel\n message 0\n message 1\n'
+    """
     if heading is None:
         heading = ''
-    heading = re.sub(r'\s', ' ', heading)
-
-    # TODO not great that we always pad body I guess. maybe needs some sort of raw_body argument?
-    if body is not None:
-        body = _sanitize_body(body)
+    heading = _WHITESPACE_RE.sub(' ', heading)
 
     parts = []
 
@@ -96,30 +134,25 @@ def asorgoutline(
         tags_s = ':' + ':'.join(map(_sanitize_tag, tags)) + ':'
         parts.append(tags_s)
 
-    sch_lines = [] if scheduled is None else [
-        'SCHEDULED: ' + timestamp(scheduled, active=True)
-    ]
+    if level > 0 and len(parts) == 1:
+        # means it's only got level stars, so we need to make sure space is present (otherwise it's not an outline)
+        parts.append('')
+    sink.write(' '.join(parts)) # TODO just in case check that parts doesn't have newlines?
+
+    if scheduled is not None:
+        sink.write('\nSCHEDULED: ' + timestamp(scheduled, active=True))
 
-    props_lines: List[str] = []
     props = {} if properties is None else properties
     if len(props) > 0:
-        props_lines.append(':PROPERTIES:')
-        props_lines.extend(f':{prop}: {value}' for prop, value in props.items())
-        props_lines.append(':END:')
-
-    body_lines = [] if body is None else [body]
+        sink.write('\n:PROPERTIES:')
+        for prop, value in props.items():
+            sink.write(f'\n:{prop}: {value}')
+        sink.write('\n:END:')
 
-    if level > 0 and len(parts) == 1:
-        # means it's only got level stars, so we need to make sure space is present (otherwise it's not an outline)
-        parts.append('')
-    lines = [
-        ' '.join(parts), # TODO just in case check that parts doesn't have newlines?
-        *sch_lines,
-        *props_lines,
-        *body_lines,
-    ]
-    # TODO careful here, I guess actually need some tests for endlines
-    return '\n'.join(lines)
+    # TODO not great that we always pad body I guess. maybe needs some sort of raw_body argument?
+    if body is not None:
+        sink.write('\n')
+        _write_body(sink, body)
 
 
 T = TypeVar('T')
@@ -135,12 +168,36 @@ class OrgNode(NamedTuple):
     tags: Sequence[str] = ()
     scheduled: Optional[Dateish] = None
     properties: Optional[Mapping[str, str]] = None
-    # TODO make body lazy as well?
-    body: Optional[str] = None
+    body: Optional[Body] = None
     children: Sequence[Any] = () # mypy wouldn't allow recursive type here...
 
-    def _render_self(self) -> str:
-        return asorgoutline(
+    def write(self, sink: TextIO, level: int=1) -> None:
+        r"""
+        Writes the node and its children to sink, as render() returns them
+
+        A node can be written any number of times, so a body of chunks
+        must be a collection: one-shot iterators are rejected
+        >>> sink = io.StringIO()
+        >>> OrgNode('channel', children=[OrgNode('message', body='hi')]).write(sink)
+        >>> sink.getvalue()
+        '* channel\n** message\n hi'
+        >>> channel = OrgNode('channel', body=['first\n', 'second'])
+        >>> sink = io.StringIO()
+        >>> channel.write(sink, level=2)
+        >>> sink.getvalue() == channel.render(level=2) == '** channel\n first\n second'
+        True
+        >>> OrgNode('channel', body=(line for line in ['first'])).write(io.StringIO())
+        Traceback (most recent call last):
+        ...
+        TypeError: OrgNode body must be a string or a collection of strings, not a one-shot iterator
+        """
+        if self.body is not None and not isinstance(self.body, str) and iter(self.body) is self.body:
+            raise TypeError(
+                'OrgNode body must be a string or a collection of strings, not a one-shot iterator')
+        if level > 0:
+            sink.write('*' * level + ' ')
+        write_outline(
+            sink,
             heading=_from_lazy(self.heading),
             todo=self.todo,
             tags=self.tags,
@@ -149,14 +206,10 @@ class OrgNode(NamedTuple):
             body=self.body,
             level=0,
         )
-
-    def _render_hier(self) -> List[Tuple[int, str]]:
-        res = [(0, self._render_self())]
         for ch in self.children:
             # TODO make sure there is a space??
-            # TODO shit, would be nice to tabulate?.. not sure
-            res.extend((l + 1, x) for l, x in ch._render_hier())
-        return res
+            sink.write('\n')
+            ch.write(sink, level=level + 1)
 
     def render(self, level: int=1) -> str:
         r"""
@@ -169,9 +222,9 @@ class OrgNode(NamedTuple):
         >>> OrgNode('#+FILETAGS: sometag', children=[OrgNode('subitem')]).render(level=0)
         '#+FILETAGS: sometag\n* subitem'
         """
-        rh = self._render_hier()
-        rh = [(level + l, x) for l, x in rh]
-        return '\n'.join('*' * l + (' ' if l > 0 else '') + x for l, x in rh)
+        sink = io.StringIO()
+        self.write(sink, level=level)
+        return sink.getvalue()
 
 node = OrgNode
 
@@ -196,7 +249,7 @@ def _from_lazy(x: Lazy[T]) -> T:
 
 def _sanitize_heading(x: str) -> str:
     # TODO do something smarter? e.g. https://stackoverflow.com/questions/12737564/escaping-characters-in-emacs-org-mode
-    return re.sub(r'[\]\[]', '', x)
+    return _HEADING_RE.sub('', x)
 
 
 # TODO allow passing raw body?
@@ -207,9 +260,30 @@ def _sanitize_body(text: str) -> str:
     >>> _sanitize_body('Some thoughts:\r\n\r\n* convenience')
     ' Some thoughts:\n \n * convenience'
     """
+    sink = io.StringIO()
+    _write_body(sink, text)
+    return sink.getvalue()
+
+
+def _write_body(sink: TextIO, body: Body) -> None:
+    r"""
+    Writes body to sink, sanitised as a single string would be
+
+    Chunks need not end on a line boundary, but must not split a \r\n
+    >>> sink = io.StringIO()
+    >>> _write_body(sink, ['first', ' line\n', '\n* second line'])
+    >>> sink.getvalue() == _sanitize_body('first line\n\n* second line')
+    True
+    """
     # TODO hmm. maybe just tabulating with 1 space is enough?...
-    text = text.replace('\r\n', os.linesep)
-    return ''.join(' ' + l for l in text.splitlines(keepends=True))
+    chunks = [body] if isinstance(body, str) else body
+    at_line_start = True
+    for chunk in chunks:
+        for l in chunk.replace('\r\n', os.linesep).splitlines(keepends=True):
+            if at_line_start:
+                sink.write(' ')
+            sink.write(l)
+            at_line_start = l[-1] in _LINE_ENDINGS
 
 
 def _sanitize_tag(tag: str) -> str:
@@ -221,4 +295,4 @@ def _sanitize_tag(tag: str) -> str:
     # Tags are normal words containing letters, numbers, ‘_’, and ‘@’.
     # TODO not sure, perhaps we want strict mode for formatting?
     # TODO reuse orgparse regexes?
-    return re.sub(r'[^@\w]', '_', tag)
+    return _TAG_RE.sub('_', tag)
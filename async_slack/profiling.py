@@ -0,0 +1,235 @@
+"""
+Per-phase CPU and memory profiles of an update run
+
+With `cpu`, each phase is profiled with cProfile, in every thread the
+phase starts, and written as <n>-<phase>.pstats along with
+<n>-<phase>.collapsed, in the collapsed stack format read by
+flamegraph.pl, speedscope and inferno. With `memory`, the peak of the
+memory traced by tracemalloc during the phase is written to
+<n>-<phase>.tracemalloc.txt, with the allocation sites live at the
+time.
+
+Threads started before a phase are not profiled: bonobo and the day
+executor start their threads within each phase, so this covers the
+graphs.
+"""
+import cProfile
+import logging
+import pstats
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+# Since Python 3.12, cProfile profiles every thread, and only one
+# profiler can be enabled at a time.
+_PROFILES_ALL_THREADS = sys.version_info >= (3, 12)
+
+TRACEMALLOC_FRAMES = 16
+TRACEMALLOC_TOP_SITES = 25
+TRACEMALLOC_SAMPLE_INTERVAL = 0.2
+
+# Stacks with less than this fraction of the total time are dropped
+# from the collapsed stacks.
+MIN_STACK_FRACTION = 1e-4
+
+
+def _frame_label(function):
+    file_name, line, name = function
+    if file_name == "~":  # built-in
+        return name
+    return f"{name} ({file_name}:{line})"
+
+
+def collapsed_stacks(stats, min_fraction=MIN_STACK_FRACTION):
+    """
+    Yield (stack, microseconds) pairs estimated from pstats.Stats
+
+    pstats only keeps the time spent in each caller-callee pair, not
+    whole stacks, so each function's time is shared between its callers
+    in proportion to the time it spent called from each of them, as
+    flameprof and gprof2dot do. Recursion is cut at the first repeat.
+    Stacks with less than `min_fraction` of the total time are dropped,
+    along with the stacks they lead to.
+    """
+    callees = {}
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees.setdefault(caller, []).append((function, cumulative))
+    roots = [
+        function for function, (_, _, _, _, callers) in stats.stats.items()
+        if not callers
+    ]
+    min_seconds = min_fraction * sum(stats.stats[root][3] for root in roots)
+
+    def walk(function, seconds, stack, seen):
+        _, _, total, cumulative, _ = stats.stats[function]
+        stack = stack + (_frame_label(function),)
+        if cumulative > 0:
+            own = total * seconds / cumulative
+            if own >= min_seconds and int(own * 1e6) > 0:
+                yield stack, int(own * 1e6)
+        for callee, edge in callees.get(function, ()):
+            if callee in seen or cumulative <= 0:
+                continue
+            share = seconds * edge / cumulative
+            if share >= min_seconds:
+                yield from walk(callee, share, stack, seen | {callee})
+
+    for root in roots:
+        yield from walk(root, stats.stats[root][3], (), {root})
+
+
+def write_collapsed(stats, path):
+    totals = {}
+    for stack, microseconds in collapsed_stacks(stats):
+        key = ";".join(stack)
+        totals[key] = totals.get(key, 0) + microseconds
+    with open(path, "w", encoding="utf-8") as fp:
+        for stack, microseconds in sorted(totals.items()):
+            fp.write(f"{stack} {microseconds}\n")
+
+
+class _ThreadProfiles:
+    """ A cProfile profile in the current thread and each thread it starts """
+
+    def __init__(self):
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    def _start_thread(self, frame, event, arg):
+        # Called on the first profiling event of each new thread:
+        # enabling a profile replaces this hook for the thread.
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        if not _PROFILES_ALL_THREADS:
+            threading.setprofile(self._start_thread)
+        self._main = cProfile.Profile()
+        self._main.enable()
+
+    def stop(self):
+        self._main.disable()
+        if not _PROFILES_ALL_THREADS:
+            threading.setprofile(None)
+
+    def stats(self):
+        stats = pstats.Stats(self._main)
+        with self._lock:
+            profiles, self._profiles = self._profiles, []
+        for profile in profiles:
+            # Other threads' profiles cannot be disabled from here, but
+            # their threads have ended with the phase.
+            profile.snapshot_stats()
+            stats.add(profile)
+        return stats
+
+
+class _PeakSampler(threading.Thread):
+    """
+    Snapshot traced allocations whenever they pass their previous peak
+
+    tracemalloc reports the peak size, but not what was allocated at the
+    peak, so the snapshot taken closest to it is kept instead.
+    """
+
+    def __init__(self, interval):
+        super().__init__(name="tracemalloc-sampler", daemon=True)
+        self._interval = interval
+        self._stopped = threading.Event()
+        self.peak_size = 0
+        self.snapshot = None
+
+    def sample(self):
+        size, _ = tracemalloc.get_traced_memory()
+        if size > self.peak_size:
+            self.peak_size = size
+            self.snapshot = tracemalloc.take_snapshot()
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            self.sample()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.sample()
+
+
+class PhaseProfiler:
+    """
+    Profiles each phase of a run into `directory`, with cProfile if
+    `cpu` and tracemalloc if `memory`
+    """
+
+    def __init__(self, directory, cpu=False, memory=False):
+        self._directory = Path(directory)
+        self._cpu = cpu
+        self._memory = memory
+        self._nphases = 0
+
+    @property
+    def enabled(self):
+        return self._cpu or self._memory
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._nphases += 1
+        prefix = self._directory / f"{self._nphases:02d}-{name.replace(' ', '-')}"
+        if self._memory:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            sampler = _PeakSampler(TRACEMALLOC_SAMPLE_INTERVAL)
+            sampler.start()
+        if self._cpu:
+            profiles = _ThreadProfiles()
+            profiles.start()
+        try:
+            yield
+        finally:
+            # Both profiles are stopped before either is written, so that
+            # neither measures the writing of the other.
+            if self._cpu:
+                profiles.stop()
+            if self._memory:
+                sampler.stop()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            if self._cpu:
+                self._write_cpu_profile(profiles.stats(), prefix)
+            if self._memory:
+                self._write_memory_profile(name, peak, sampler, prefix)
+
+    def _write_cpu_profile(self, stats, prefix):
+        stats.dump_stats(f"{prefix}.pstats")
+        write_collapsed(stats, f"{prefix}.collapsed")
+        logging.info("Wrote CPU profile to %s.pstats", prefix)
+
+    def _write_memory_profile(self, name, peak, sampler, prefix):
+        path = f"{prefix}.tracemalloc.txt"
+        with open(path, "w", encoding="utf-8") as fp:
+            fp.write(f"Phase: {name}\n")
+            fp.write(f"Peak traced memory: {peak / (1 << 20):.1f} MiB\n")
+            if sampler.snapshot is not None:
+                fp.write(
+                    f"Top allocation sites at "
+                    f"{sampler.peak_size / (1 << 20):.1f} MiB, "
+                    f"the largest sample:\n\n"
+                )
+                statistics = sampler.snapshot.statistics("traceback")
+                for statistic in statistics[:TRACEMALLOC_TOP_SITES]:
+                    fp.write(
+                        f"{statistic.size / 1024:.1f} KiB "
+                        f"in {statistic.count} blocks\n"
+                    )
+                    for line in statistic.traceback.format(limit=8):
+                        fp.write(line + "\n")
+                    fp.write("\n")
+        logging.info("Wrote memory profile to %s", path)
@@ -1,14 +1,21 @@
+import asyncio
 import datetime
 import logging
+import time
+from collections import defaultdict
 
 import bonobo  # type: ignore
-from bonobo.config import Configurable, Option, Service, use  # type: ignore
+from bonobo.config import (  # type: ignore
+    Configurable, ContextProcessor, Option, Service, use_context)
 
 from . import db
 from . import slack
-from .messages_fetcher import MessagesFetcher
-from .dict_utils import map_dictionary
-from .date_utils import date_range, nworking_days_before
+from .slack import catch_channel_not_found
+from .messages_fetcher import AsyncMessagesFetcher
+from .fields import THREAD_MESSAGE_FIELDS, CHANNEL_MESSAGE_FIELDS
+from .date_utils import date_range
+from .day_executor import run_days
+from .instrumentation import run_graph
 
 
 class ChannelsSource(Configurable):
@@ -21,9 +28,10 @@ class ChannelsSource(Configurable):
 
 
 @slack.api_retry
-def get_replies(client, channel_id, thread_ts, oldest):
-    with slack.catch_channel_not_found():
-        client.conversations.replies(
+@slack.rate_limited("conversations.replies")
+def get_replies(slack, channel_id, thread_ts, oldest):
+    with catch_channel_not_found():
+        return slack.client.conversations.replies(
             channel_id,
             thread_ts,
             oldest=oldest
@@ -31,7 +39,9 @@ def get_replies(client, channel_id, thread_ts, oldest):
 
 
 def fetch_thread_for_message(channel_id, thread_ts, slack):
-    response = get_replies(slack.client, channel_id, thread_ts, thread_ts)
+    response = get_replies(slack, channel_id, thread_ts, thread_ts)
+    if response is None:
+        return
 
     for message in response["messages"]:
         if message["ts"] != thread_ts:  # don't return the original message
@@ -39,18 +49,67 @@ def fetch_thread_for_message(channel_id, thread_ts, slack):
 
     while response["has_more"]:
         next_oldest = response["messages"][-1]["ts"]
-        response = get_replies(slack.client, channel_id, thread_ts, next_oldest)
+        response = get_replies(slack, channel_id, thread_ts, next_oldest)
         for message in response["messages"]:
             yield message
 
 
+@slack.api_retry
+async def get_replies_async(session, channel_id, thread_ts, oldest):
+    with catch_channel_not_found():
+        return await session.conversations_replies(
+            channel_id,
+            thread_ts,
+            oldest=oldest
+        )
+
+
+async def fetch_thread_async(session, channel_id, thread_ts):
+    response = await get_replies_async(session, channel_id, thread_ts, thread_ts)
+    if response is None:
+        return []
+
+    # Slack returns the parent at the top of every page: don't keep it
+    replies = [
+        message for message in response["messages"]
+        if message["ts"] != thread_ts
+    ]
+    while response["has_more"]:
+        next_oldest = response["messages"][-1]["ts"]
+        response = await get_replies_async(
+            session, channel_id, thread_ts, next_oldest)
+        replies.extend(
+            message for message in response["messages"]
+            if message["ts"] != thread_ts
+        )
+    return replies
+
+
+async def fetch_threads(slack, parents, concurrency):
+    """
+    Fetch replies for each (channel_id, thread_ts) in parents
+
+    Returns a list of (replies, latency in seconds), in the order of
+    parents.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(session, channel_id, thread_ts):
+        async with semaphore:
+            t_start = time.monotonic()
+            replies = await fetch_thread_async(session, channel_id, thread_ts)
+            latency = time.monotonic() - t_start
+        return replies, latency
+
+    async with slack.connect() as session:
+        return await asyncio.gather(
+            *(fetch(session, channel_id, thread_ts)
+              for channel_id, thread_ts in parents)
+        )
+
+
 def process_message_in_thread(message):
-    to_keep = {
-        "blocks": "/blocks",
-        "ts": "/ts",
-        "user": "/user",
-    }
-    return map_dictionary(to_keep, message)
+    return THREAD_MESSAGE_FIELDS(message)
 
 
 def remove_invalid_messages(channel_id, message):
@@ -60,37 +119,107 @@ def remove_invalid_messages(channel_id, message):
 
 def process_channel_message(channel_id, message):
     if message.get("subtype") != "bot_message":
-        to_keep = {
-            "blocks": "/blocks",
-            "ts": "/ts",
-            "thread_ts": "/thread_ts",
-            "user": "/user",
-        }
-        new_message = map_dictionary(to_keep, message)
+        new_message = CHANNEL_MESSAGE_FIELDS(message)
         new_message["channel"] = channel_id
         yield channel_id, new_message
 
 
-@use("slack")
-def add_thread_to_message(channel_id, message, slack):
+def is_thread_parent(message):
     thread_ts = message.get("thread_ts")
-    message_ts = message["ts"]
-    if thread_ts is not None and thread_ts == message_ts:
-        thread = fetch_thread_for_message(channel_id, thread_ts, slack)
-        message["thread"] = list(
-            process_message_in_thread(message) for message in thread
+    return thread_ts is not None and thread_ts == message["ts"]
+
+
+class _HydrationState:
+
+    def __init__(self):
+        self.pending = []
+        self.latencies = defaultdict(list)
+
+
+@use_context
+class ThreadHydrator(Configurable):
+    """
+    Add the replies to each thread parent, fetching many threads at once
+
+    Messages are buffered in batches of `batch_size`. Threads whose
+    `latest_reply` is no newer than the cached copy are read from the
+    thread cache; the others are fetched concurrently, with at most
+    `concurrency` in flight. The batch is then sent on in its original
+    order. The time spent fetching each channel's threads is logged at
+    the end.
+    """
+
+    concurrency = Option(int, default=10)
+    batch_size = Option(int, default=200)
+    slack = Service("slack")
+    thread_cache = Service("thread_cache")
+
+    @ContextProcessor
+    def state(self, context, *, slack, thread_cache):
+        state = yield _HydrationState()
+        self._flush(context, state, slack, thread_cache)
+        thread_cache.save()
+        self._log_latencies(state.latencies)
+
+    def _flush(self, context, state, slack, thread_cache):
+        threads = {}
+        parents = []
+        for channel_id, message in state.pending:
+            if is_thread_parent(message):
+                key = (channel_id, message["ts"])
+                cached_thread = thread_cache.get(
+                    channel_id, message["ts"], message.get("latest_reply"))
+                if cached_thread is None:
+                    parents.append(key)
+                else:
+                    threads[key] = cached_thread
+
+        if parents:
+            results = asyncio.run(fetch_threads(slack, parents, self.concurrency))
+            for (channel_id, thread_ts), (replies, latency) in zip(parents, results):
+                threads[(channel_id, thread_ts)] = THREAD_MESSAGE_FIELDS.many(
+                    replies)
+                state.latencies[channel_id].append(latency)
+
+        for channel_id, message in state.pending:
+            if is_thread_parent(message):
+                thread = threads[(channel_id, message["ts"])]
+                thread_cache.set(
+                    channel_id, message["ts"], message.get("latest_reply"), thread)
+                message["thread"] = thread
+            context.send(message)
+        state.pending = []
+
+    def _log_latencies(self, latencies):
+        by_total_time = sorted(
+            latencies.items(),
+            key=lambda item: sum(item[1]),
+            reverse=True
         )
-    yield message
+        for channel_id, channel_latencies in by_total_time:
+            logging.info(
+                "Fetched %d threads in %s in %.3fs (slowest %.3fs)",
+                len(channel_latencies),
+                channel_id,
+                sum(channel_latencies),
+                max(channel_latencies)
+            )
+
+    def __call__(  # pylint: disable=arguments-differ
+            self, state, context, channel_id, message, *, slack, thread_cache):
+        state.pending.append((channel_id, message))
+        if len(state.pending) >= self.batch_size:
+            self._flush(context, state, slack, thread_cache)
 
 
 def get_raw_threads_graph(day):
     graph = bonobo.Graph()
     graph.add_chain(
         ChannelsSource(day),
-        MessagesFetcher(day, day + datetime.timedelta(days=1)),
+        AsyncMessagesFetcher(day, day + datetime.timedelta(days=1)),
         remove_invalid_messages,
         process_channel_message,
-        add_thread_to_message,
+        ThreadHydrator(),
         db.JsonRawThreadsWriter(day)
     )
     return graph
@@ -99,38 +228,57 @@ def get_raw_threads_graph(day):
 def get_raw_threads_services(base_services):
     database = base_services["database"]
     message_count = db.MessageCount(database)
-    return {**base_services, "message_count": message_count}
+    thread_cache = db.ThreadCache(database)
+    return {
+        **base_services,
+        "message_count": message_count,
+        "thread_cache": thread_cache
+    }
 
 
 def update_raw_threads_quick(
         start_date,
         end_date,
-        base_services
+        base_services,
+        max_concurrent_days=1
 ):
     services = get_raw_threads_services(base_services)
-    for date in date_range(start_date, end_date):
+
+    def run_day(date):
         logging.info("Fetching raw threads for %s", date.isoformat())
         graph = get_raw_threads_graph(date)
-        bonobo.run(graph, services=services)
+        run_graph(graph, services, "raw threads")
+
+    dates = date_range(start_date, end_date)
+    for _ in run_days(dates, run_day, max_concurrent_days):
+        pass
 
 
 def update_raw_threads(
         start_date,
         end_date,
         backdate_nworking_days,
-        base_services
+        base_services,
+        max_concurrent_days=1
 ):
     database = base_services["database"]
     status_db = db.Status(database)
     services = get_raw_threads_services(base_services)
-    ndays_ago = nworking_days_before(
+    ndays_ago = base_services["working_days"].nworking_days_before(
         datetime.date.today(), backdate_nworking_days)
+
+    def run_day(date):
+        logging.info("Fetching raw threads for %s", date.isoformat())
+        graph = get_raw_threads_graph(date)
+        run_graph(graph, services, "raw threads")
+
+    dates = []
     for date in date_range(start_date, end_date):
         if not status_db.is_raw_threads_complete(date):
-            logging.info("Fetching raw threads for %s", date.isoformat())
-            graph = get_raw_threads_graph(date)
-            bonobo.run(graph, services=services)
-            if date < ndays_ago:
-                status_db.set_raw_threads_complete(date)
+            dates.append(date)
         else:
             logging.info("Date %s is complete. Skipping.", date.isoformat())
+
+    for date in run_days(dates, run_day, max_concurrent_days):
+        if date < ndays_ago:
+            status_db.set_raw_threads_complete(date)
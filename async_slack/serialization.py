@@ -0,0 +1,98 @@
+import json
+import struct
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack  # type: ignore
+except ImportError:
+    msgpack = None
+
+
+# Msgpack files start with this header, followed by records each
+# prefixed with their length, so readers recognise them on sight. JSON
+# lines files carry no header: whichever JSON encoder wrote them, they
+# are read with the fastest JSON decoder available.
+MSGPACK_MAGIC = b"ASMSGPK1"
+
+_LENGTH = struct.Struct(">I")
+
+
+class JsonCodec:
+
+    name = "json"
+    header = b""
+
+    def encode(self, entry):
+        return (json.dumps(entry) + "\n").encode("utf-8")
+
+    def decode_stream(self, fp):
+        for line in fp:
+            if line.strip():
+                yield json.loads(line)
+
+
+class OrjsonCodec(JsonCodec):
+
+    name = "orjson"
+
+    def encode(self, entry):
+        return orjson.dumps(entry) + b"\n"
+
+    def decode_stream(self, fp):
+        for line in fp:
+            if line.strip():
+                yield orjson.loads(line)
+
+
+class MsgpackCodec:
+
+    name = "msgpack"
+    header = MSGPACK_MAGIC
+
+    def encode(self, entry):
+        payload = msgpack.packb(entry, use_bin_type=True)
+        return _LENGTH.pack(len(payload)) + payload
+
+    def decode_stream(self, fp):
+        while True:
+            prefix = fp.read(_LENGTH.size)
+            if len(prefix) < _LENGTH.size:
+                return
+            (length,) = _LENGTH.unpack(prefix)
+            yield msgpack.unpackb(fp.read(length), raw=False)
+
+
+_CODECS = {
+    "json": (JsonCodec, None),
+    "orjson": (OrjsonCodec, "orjson"),
+    "msgpack": (MsgpackCodec, "msgpack"),
+}
+
+
+def get_codec(name):
+    try:
+        codec_class, required_module = _CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown codec {name!r}") from None
+    if required_module is not None and globals()[required_module] is None:
+        raise ImportError(
+            f"The {name} codec requires the {required_module} package")
+    return codec_class()
+
+
+def _json_decoder():
+    return OrjsonCodec() if orjson is not None else JsonCodec()
+
+
+def decode_stream(fp):
+    """ Yield the records in a binary file object, whatever its codec """
+    header = fp.read(len(MSGPACK_MAGIC))
+    if header == MSGPACK_MAGIC:
+        yield from get_codec("msgpack").decode_stream(fp)
+    else:
+        fp.seek(0)
+        yield from _json_decoder().decode_stream(fp)
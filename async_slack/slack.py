@@ -1,42 +1,378 @@
 import os
 from functools import lru_cache, wraps
+import asyncio
 import logging
 import subprocess
+import threading
+import time
 from contextlib import contextmanager
 
+import aiohttp
+import requests
+import slacker
 from slacker import Slacker
-from tenacity import stop_after_attempt, wait_exponential, retry, after_log
+from tenacity import (
+    stop_after_attempt, wait_exponential, retry, retry_if_exception, after_log)
+from tenacity.wait import wait_base
+
+from . import metrics
+
+SLACK_API_URL = "https://slack.com/api"
+
+# Requests per minute allowed in each Slack rate limit tier
+TIER_LIMITS = {1: 1, 2: 20, 3: 50, 4: 100}
+
+METHOD_TIERS = {
+    "conversations.history": 3,
+    "conversations.replies": 3,
+    "conversations.list": 2,
+    "users.list": 2,
+}
+
+DEFAULT_TIER = 2
+
+
+class RateLimitedError(Exception):
+
+    def __init__(self, method, retry_after):
+        super().__init__(method, retry_after)
+        self.method = method
+        self.retry_after = retry_after
+
+
+class _TokenBucket:
+
+    def __init__(self, requests_per_minute):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1.0, requests_per_minute / 10.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def reserve(self, now):
+        """
+        Take a token and return how long to wait before using it
+
+        Tokens can go negative: each caller queues behind the
+        reservations made before it.
+        """
+        self._refill(now)
+        self.tokens -= 1
+        wait = max(0.0, -self.tokens / self.rate)
+        return max(wait, self.paused_until - now)
+
+    def pause(self, now, duration):
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+        self.paused_until = max(self.paused_until, now + duration)
+
+    def remaining(self, now):
+        self._refill(now)
+        return max(0, int(self.tokens))
+
+
+class RateLimitScheduler:
+    """
+    Token bucket per Slack API method, sized to the method's tier
+
+    Callers acquire a token before each request, so requests are spaced
+    to stay under `headroom` times the tier limit. A 429 pauses the
+    method's bucket for as long as Slack's Retry-After header asks.
+    """
+
+    def __init__(self, headroom=0.9, method_tiers=None):
+        self._headroom = headroom
+        self._method_tiers = {**METHOD_TIERS, **(method_tiers or {})}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, method):
+        try:
+            bucket = self._buckets[method]
+        except KeyError:
+            tier = self._method_tiers.get(method, DEFAULT_TIER)
+            bucket = _TokenBucket(TIER_LIMITS[tier] * self._headroom)
+            self._buckets[method] = bucket
+        return bucket
+
+    def _reserve(self, method):
+        with self._lock:
+            return self._bucket(method).reserve(time.monotonic())
+
+    def acquire(self, method):
+        wait = self._reserve(method)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, method):
+        wait = self._reserve(method)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, method, retry_after):
+        logging.getLogger("slack-api").info(
+            "Rate limited on %s. Pausing for %ss.", method, retry_after)
+        with self._lock:
+            self._bucket(method).pause(time.monotonic(), retry_after)
+
+    def remaining(self):
+        """ Return the number of requests each method can make right now """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                method: bucket.remaining(now)
+                for method, bucket in self._buckets.items()
+            }
+
+
+def _parse_retry_after(headers):
+    try:
+        return float(headers["Retry-After"])
+    except (KeyError, TypeError, ValueError):
+        return 60.0
+
+
+class _BaseUrlSession(requests.Session):
+    """ Session that sends Slack API requests to another base URL """
+
+    def __init__(self, base_url):
+        super().__init__()
+        self._base_url = base_url.rstrip("/")
+
+    def request(self, method, url, *args, **kwargs):  # pylint: disable=arguments-differ
+        if url.startswith(SLACK_API_URL):
+            url = self._base_url + url[len(SLACK_API_URL):]
+        return super().request(method, url, *args, **kwargs)
 
 
 class SlackClient:
+    """
+    Slack API client, sending requests to `base_url` if given, rather
+    than to the Slack API
+    """
 
-    def __init__(self, token):
-        self._client = Slacker(token)
+    def __init__(self, token, base_url=None):
+        session = _BaseUrlSession(base_url) if base_url is not None else None
+        self._client = Slacker(token, session=session)
+        self._scheduler = RateLimitScheduler()
+        self._base_url = (base_url or SLACK_API_URL).rstrip("/")
 
 
     @classmethod
-    def from_environment(cls):
+    def from_environment(cls, **kwargs):
         token = os.environ["SLACK_TOKEN"]
-        return cls(token)
+        return cls(token, **kwargs)
 
 
     @classmethod
-    def from_command(cls, cmd):
+    def from_command(cls, cmd, **kwargs):
         process = subprocess.run(cmd, capture_output=True, check=True, text=True)
         token = process.stdout.strip()
-        return cls(token)
+        return cls(token, **kwargs)
         
 
     @property
     def client(self):
         return self._client
 
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+
+class AsyncSlackClient(SlackClient):
+    """
+    SlackClient that can also open asyncio sessions against the API
+
+    The synchronous slacker client remains available through `client`,
+    so this can stand in for a SlackClient anywhere.
+    """
+
+    def __init__(self, token, base_url=None, max_connections=20):
+        super().__init__(token, base_url)
+        self._token = token
+        self._max_connections = max_connections
+
+    def connect(self):
+        return AsyncSlackSession(
+            self._token, self._max_connections, self.scheduler, self._base_url)
+
+
+class AsyncSlackSession:
+    """
+    Pooled connections to the Slack API, bound to one event loop
+
+    Use as an async context manager:
+
+        async with slack.connect() as session:
+            response = await session.conversations_history(channel_id)
+    """
+
+    def __init__(
+            self, token, max_connections, scheduler, base_url=SLACK_API_URL):
+        self._token = token
+        self._max_connections = max_connections
+        self._scheduler = scheduler
+        self._base_url = base_url
+        self._session = None
+
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self._max_connections)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers={"Authorization": f"Bearer {self._token}"}
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+        self._session = None
+
+    async def _call(self, method, **params):
+        params = {
+            key: value for key, value in params.items() if value is not None
+        }
+        url = f"{self._base_url}/{method}"
+        await self._scheduler.acquire_async(method)
+        with _recorded_call(method, params.get("channel")):
+            async with self._session.get(url, params=params) as response:
+                if response.status == 429:
+                    retry_after = _parse_retry_after(response.headers)
+                    self._scheduler.pause(method, retry_after)
+                    raise RateLimitedError(method, retry_after)
+                response.raise_for_status()
+                body = await response.json()
+            if not body["ok"]:
+                raise slacker.Error(body["error"])
+        return body
+
+    async def conversations_history(
+            self, channel, oldest=None, latest=None, limit=None, cursor=None):
+        return await self._call(
+            "conversations.history",
+            channel=channel,
+            oldest=oldest,
+            latest=latest,
+            limit=limit,
+            cursor=cursor
+        )
+
+    async def conversations_replies(
+            self, channel, ts, oldest=None, limit=None, cursor=None):
+        return await self._call(
+            "conversations.replies",
+            channel=channel,
+            ts=ts,
+            oldest=oldest,
+            limit=limit,
+            cursor=cursor
+        )
+
+    async def conversations_list(self, types=None, limit=None, cursor=None):
+        return await self._call(
+            "conversations.list", types=types, limit=limit, cursor=cursor)
+
+    async def users_list(self, limit=None, cursor=None):
+        return await self._call("users.list", limit=limit, cursor=cursor)
+
+
+class _wait_for_rate_limit(wait_base):
+    """
+    Retry rate limited calls straight away, other failures with backoff
+
+    The scheduler already holds back rate limited methods for as long
+    as Slack asked, so waiting here as well would only add delay.
+    """
+
+    def __init__(self, fallback):
+        self._fallback = fallback
+
+    def __call__(self, retry_state):
+        if isinstance(retry_state.outcome.exception(), RateLimitedError):
+            return 0
+        return self._fallback(retry_state)
+
+
+@contextmanager
+def _recorded_call(method, channel=None):
+    """ Record the duration and outcome of a call to `method` in the metrics """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    except RateLimitedError:
+        outcome = "rate_limited"
+        raise
+    except slacker.Error as e:
+        # A missing channel is an answer, not a failed call
+        if e.args and e.args[0] == "channel_not_found":
+            outcome = "ok"
+        raise
+    finally:
+        metrics.registry.record_api_call(
+            method, time.perf_counter() - start, outcome, channel)
+
+
+def rate_limited(method):
+    """
+    Schedule calls to a function wrapping the Slack API `method`
+
+    The decorated function must take a SlackClient as first argument.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(slack, *args, **kwargs):
+            slack.scheduler.acquire(method)
+            with _recorded_call(method):
+                try:
+                    return f(slack, *args, **kwargs)
+                except requests.HTTPError as e:
+                    if e.response is not None and e.response.status_code == 429:
+                        retry_after = _parse_retry_after(e.response.headers)
+                        slack.scheduler.pause(method, retry_after)
+                        raise RateLimitedError(method, retry_after) from e
+                    raise
+        return wrapper
+    return decorator
+
+
+def _count_retry(retry_state):
+    metrics.registry.record_retry(retry_state.fn.__name__)
+
+
+def _is_retryable(exception):
+    """
+    Return whether a failed call might succeed if made again
+
+    HTTP client errors, other than rate limits, which are raised as
+    RateLimitedError, fail the same way however often they are retried.
+    """
+    status = None
+    if isinstance(exception, aiohttp.ClientResponseError):
+        status = exception.status
+    elif isinstance(exception, requests.HTTPError) and exception.response is not None:
+        status = exception.response.status_code
+    return status is None or not 400 <= status < 500
+
 
 api_retry = retry(
-    wait=wait_exponential(multiplier=1, min=60, max=1800),
+    retry=retry_if_exception(_is_retryable),
+    wait=_wait_for_rate_limit(
+        wait_exponential(multiplier=1, min=60, max=1800)),
     reraise=True,
     stop=stop_after_attempt(10),
-    after=after_log(logging.getLogger("slack-api"), log_level=logging.INFO)
+    after=after_log(logging.getLogger("slack-api"), log_level=logging.INFO),
+    before_sleep=_count_retry
 )
 
 
@@ -0,0 +1,279 @@
+import datetime
+import hashlib
+import json
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from . import metrics
+
+DATABASE_FILE_NAME = "async-slack.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    store TEXT NOT NULL,
+    partition TEXT NOT NULL,
+    generation TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    channel TEXT,
+    ts TEXT,
+    thread_ts TEXT,
+    date TEXT,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_partition
+    ON records (store, partition, generation, seq);
+CREATE INDEX IF NOT EXISTS records_channel_ts ON records (channel, ts);
+CREATE INDEX IF NOT EXISTS records_date ON records (date);
+CREATE INDEX IF NOT EXISTS records_thread_ts ON records (thread_ts);
+
+CREATE TABLE IF NOT EXISTS generations (
+    store TEXT NOT NULL,
+    partition TEXT NOT NULL,
+    generation TEXT NOT NULL,
+    digest TEXT,
+    PRIMARY KEY (store, partition)
+);
+
+CREATE TABLE IF NOT EXISTS state (
+    name TEXT NOT NULL,
+    outer_key TEXT NOT NULL,
+    inner_key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (name, outer_key, inner_key)
+);
+CREATE INDEX IF NOT EXISTS state_outer_key ON state (outer_key);
+"""
+
+
+def _index_columns(entry, partition):
+    channel = entry.get("channel")
+    if isinstance(channel, dict):
+        channel = channel.get("id")
+    ts = entry.get("ts")
+    if ts is not None:
+        date = datetime.date.fromtimestamp(float(ts)).isoformat()
+    else:
+        date = partition or None
+    return channel, ts, entry.get("thread_ts"), date
+
+
+def _metrics_file_name(store, partition=None):
+    """ Name a store's rows in the metrics, as if they were a file """
+    if partition:
+        return f"{DATABASE_FILE_NAME}:{store}/{partition}"
+    return f"{DATABASE_FILE_NAME}:{store}"
+
+
+class _SqliteSink:
+    """
+    Write records under a new generation, made current on commit
+
+    Rows are inserted in batches, each in its own short transaction, so
+    concurrent writers to other partitions are not locked out. Readers
+    keep seeing the previous generation until `commit` swaps it in,
+    along with a digest of the records written.
+    """
+
+    def __init__(self, connection, store, partition, batch_size):
+        self._connection = connection
+        self._store = store
+        self._partition = partition
+        self._batch_size = batch_size
+        self._generation = uuid.uuid4().hex
+        self._rows = []
+        self._seq = 0
+        self._digest = hashlib.blake2b(digest_size=16)
+        self.bytes_written = 0
+
+    def write(self, entry):
+        channel, ts, thread_ts, date = _index_columns(entry, self._partition)
+        body = json.dumps(entry)
+        self._rows.append((
+            self._store, self._partition, self._generation, self._seq,
+            channel, ts, thread_ts, date, body
+        ))
+        encoded = body.encode("utf-8")
+        self._digest.update(encoded + b"\n")
+        self.bytes_written += len(encoded)
+        self._seq += 1
+        if len(self._rows) >= self._batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    self._rows
+                )
+            self._rows = []
+
+    def commit(self):
+        self._flush()
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?)",
+                (self._store, self._partition, self._generation,
+                 self._digest.hexdigest())
+            )
+            self._connection.execute(
+                "DELETE FROM records "
+                "WHERE store = ? AND partition = ? AND generation != ?",
+                (self._store, self._partition, self._generation)
+            )
+
+    def abort(self):
+        self._rows = []
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM records WHERE generation = ?",
+                (self._generation,)
+            )
+
+
+class SqliteDatabase:
+    """
+    Database in a single SQLite file, with the interface of JsonFsDatabase
+
+    Records are stored as JSON bodies, indexed by channel and ts, by
+    date and by thread_ts. The database runs in WAL mode, so that
+    readers do not block the writers of other partitions.
+    """
+
+    def __init__(self, root, batch_size=1000):
+        root = Path(root)
+        root.mkdir(parents=True, exist_ok=True)
+        self._path = root / DATABASE_FILE_NAME
+        self._batch_size = batch_size
+        self._local = threading.local()
+        self._states = {}
+        self._state_locks = {}
+        self._state_locks_lock = threading.Lock()
+        connection = self._connection()
+        connection.executescript(SCHEMA)
+        columns = [
+            row[1] for row in connection.execute("PRAGMA table_info(generations)")]
+        if "digest" not in columns:
+            # Databases written before generations had a digest
+            connection.execute("ALTER TABLE generations ADD COLUMN digest TEXT")
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            str(self._path), timeout=60, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _connection(self):
+        """ Return a connection for use by the current thread """
+        try:
+            connection = self._local.connection
+        except AttributeError:
+            connection = self._connect()
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def open_writer(self, store, partition=None, flush_policy=None):
+        """
+        Replace the records in a store, yielding a sink to write them to
+
+        Rows are inserted in batches of `flush_policy.records`, if set,
+        or of the database's batch size otherwise.
+        """
+        # Each writer gets its own connection, so that its batches never
+        # share a transaction with other work on the same thread.
+        connection = self._connect()
+        try:
+            batch_size = self._batch_size
+            if flush_policy is not None and flush_policy.records is not None:
+                batch_size = flush_policy.records
+            sink = _SqliteSink(connection, store, partition or "", batch_size)
+            try:
+                yield sink
+            except BaseException:
+                sink.abort()
+                raise
+            sink.commit()
+            metrics.registry.record_bytes_written(
+                store, _metrics_file_name(store, partition), sink.bytes_written)
+        finally:
+            connection.close()
+
+    def partitions(self, store):
+        """ Return the sorted partitions of a store that exist """
+        cursor = self._connection().execute(
+            "SELECT partition FROM generations "
+            "WHERE store = ? AND partition != '' ORDER BY partition",
+            (store,)
+        )
+        return [partition for (partition,) in cursor]
+
+    def fingerprint(self, store, partition=None):
+        """ Return a digest of a store's content, or None if it does not exist """
+        # Generations written before digests only have their own id
+        row = self._connection().execute(
+            "SELECT coalesce(digest, generation) FROM generations "
+            "WHERE store = ? AND partition = ?",
+            (store, partition or "")
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def read(self, store, partition=None):
+        """ Yield the records in a store, or nothing if it does not exist """
+        cursor = self._connection().execute(
+            "SELECT body FROM records "
+            "JOIN generations USING (store, partition, generation) "
+            "WHERE store = ? AND partition = ? "
+            "ORDER BY seq",
+            (store, partition or "")
+        )
+        for (body,) in cursor:
+            yield json.loads(body)
+
+    def read_state(self, name):
+        """
+        Return the state document `name`
+
+        Every reader of the same state shares the returned dictionary,
+        and must hold `state_lock(name)` while changing it.
+        """
+        with self.state_lock(name):
+            try:
+                return self._states[name]
+            except KeyError:
+                pass
+            data = {}
+            cursor = self._connection().execute(
+                "SELECT outer_key, inner_key, value FROM state WHERE name = ?",
+                (name,)
+            )
+            for outer_key, inner_key, value in cursor:
+                data.setdefault(outer_key, {})[inner_key] = json.loads(value)
+            self._states[name] = data
+            return data
+
+    def state_lock(self, name):
+        """ Return the lock guarding changes to the state document `name` """
+        with self._state_locks_lock:
+            return self._state_locks.setdefault(name, threading.RLock())
+
+    def write_state(self, name, data, updates):
+        """
+        Persist the state `data`, of which the (outer, inner) keys in
+        `updates` have changed
+        """
+        rows = [
+            (name, outer_key, inner_key, json.dumps(data[outer_key][inner_key]))
+            for outer_key, inner_key in updates
+        ]
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?)", rows)
+        metrics.registry.record_bytes_written(
+            name, _metrics_file_name(name),
+            sum(len(row[3].encode("utf-8")) for row in rows))
@@ -0,0 +1,218 @@
+"""
+Deterministic synthetic Slack workspaces, for benchmarks and offline runs
+
+A workspace is fully determined by its WorkspaceSpec: the history of a
+channel on a day, or the replies to a thread, are generated from the
+seed on demand, so that any part of a large workspace can be produced
+without generating the rest.
+"""
+import datetime
+import random
+from typing import NamedTuple
+
+from .date_utils import date_range
+from .fields import (
+    CHANNEL_FIELDS, CHANNEL_MESSAGE_FIELDS, THREAD_MESSAGE_FIELDS, USER_FIELDS
+)
+
+_WORDS = (
+    "deploy review merge release build ticket incident customer query "
+    "latency cache shard index retry rollback migration schema dashboard "
+    "alert metric budget roadmap sprint standup lunch coffee"
+).split()
+
+_EMOJI = ["thumbsup", "tada", "eyes", "white_check_mark", "rocket", "fire"]
+
+
+class WorkspaceSpec(NamedTuple):
+    users: int = 50
+    channels: int = 20
+    days: int = 7
+    messages_per_day: int = 20
+    # Share of messages that start a thread, and mean replies per thread
+    thread_share: float = 0.2
+    thread_fanout: int = 4
+    # Mean number of elements in each message's block
+    block_complexity: int = 4
+    seed: int = 0
+    start_date: datetime.date = datetime.date(2020, 1, 6)
+
+
+WORKSPACE_SIZES = {
+    "small": WorkspaceSpec(users=50, channels=20, days=7, messages_per_day=20),
+    "medium": WorkspaceSpec(
+        users=500, channels=100, days=30, messages_per_day=30),
+    "large": WorkspaceSpec(
+        users=2000, channels=300, days=90, messages_per_day=40),
+}
+
+
+class SyntheticWorkspace:
+    """
+    Users, channels and history of a synthetic workspace, shaped as the
+    Slack API returns them
+    """
+
+    def __init__(self, spec=WorkspaceSpec()):
+        self.spec = spec
+        self._user_ids = [f"U{index:08d}" for index in range(spec.users)]
+        self._channel_ids = [f"C{index:08d}" for index in range(spec.channels)]
+
+    def _random(self, *key):
+        return random.Random(":".join(map(str, (self.spec.seed, *key))))
+
+    @property
+    def end_date(self):
+        """ The day after the last day of history """
+        return self.spec.start_date + datetime.timedelta(days=self.spec.days)
+
+    @property
+    def dates(self):
+        return list(date_range(self.spec.start_date, self.end_date))
+
+    def users(self):
+        users = []
+        for index, user_id in enumerate(self._user_ids):
+            real_name = f"User {index}"
+            users.append({
+                "id": user_id,
+                "name": f"user{index}",
+                "real_name": real_name,
+                "deleted": False,
+                "profile": {"real_name": real_name, "display_name": f"u{index}"}
+            })
+        return users
+
+    def channels(self):
+        return [
+            {
+                "id": channel_id,
+                "name": f"channel-{index}",
+                "is_channel": True,
+                "is_member": True,
+                "is_im": False,
+                "is_mpim": False,
+                "is_private": index % 5 == 0,
+                "created": 1500000000 + index,
+            }
+            for index, channel_id in enumerate(self._channel_ids)
+        ]
+
+    def _block(self, rng):
+        elements = []
+        for _ in range(rng.randint(1, 2 * self.spec.block_complexity - 1)):
+            kind = rng.random()
+            if kind < 0.55:
+                words = rng.choices(_WORDS, k=rng.randint(2, 12))
+                elements.append({"type": "text", "text": " ".join(words) + " "})
+            elif kind < 0.7:
+                elements.append(
+                    {"type": "user", "user_id": rng.choice(self._user_ids)})
+            elif kind < 0.78:
+                elements.append({
+                    "type": "channel",
+                    "channel_id": rng.choice(self._channel_ids)
+                })
+            elif kind < 0.9:
+                elements.append({"type": "emoji", "name": rng.choice(_EMOJI)})
+            else:
+                elements.append({
+                    "type": "link",
+                    "url": f"https://example.com/{rng.choice(_WORDS)}",
+                    "text": rng.choice(_WORDS)
+                })
+        section = {"type": "rich_text_section", "elements": elements}
+        if rng.random() < 0.1:
+            section = {"type": "rich_text_list", "elements": [section]}
+        return {
+            "type": "rich_text",
+            "block_id": f"b{rng.getrandbits(32):08x}",
+            "elements": [section]
+        }
+
+    def _message(self, channel_id, ts):
+        rng = self._random(channel_id, ts, "message")
+        block = self._block(rng)
+        return {
+            "type": "message",
+            "user": rng.choice(self._user_ids),
+            "text": "",
+            "ts": ts,
+            "blocks": [block],
+        }
+
+    def history(self, channel_id, date):
+        """ Return a channel's messages on a date, newest first """
+        rng = self._random(channel_id, date.isoformat())
+        midnight = datetime.datetime.combine(date, datetime.time(0, 0))
+        day_start = midnight.timestamp()
+        offsets = sorted(
+            rng.randrange(0, 86400 * 1000)
+            for _ in range(self.spec.messages_per_day)
+        )
+        messages = []
+        for index, offset in enumerate(offsets):
+            ts = f"{day_start + offset / 1000:.3f}{index:03d}"
+            if rng.random() < self.spec.thread_share:
+                message = self.replies(channel_id, ts)[0]
+            else:
+                message = self._message(channel_id, ts)
+            messages.append(message)
+        return messages[::-1]
+
+    def replies(self, channel_id, thread_ts):
+        """ Return the parent of a thread followed by its replies, oldest first """
+        rng = self._random(channel_id, thread_ts, "thread")
+        parent_time = float(thread_ts)
+        parent = self._message(channel_id, thread_ts)
+        replies = []
+        for index in range(rng.randint(1, 2 * self.spec.thread_fanout - 1)):
+            ts = f"{parent_time + 60 * (index + 1):.3f}{index:03d}"
+            reply = self._message(channel_id, ts)
+            reply["thread_ts"] = thread_ts
+            replies.append(reply)
+        parent.update({
+            "thread_ts": thread_ts,
+            "reply_count": len(replies),
+            "latest_reply": replies[-1]["ts"],
+        })
+        return [parent, *replies]
+
+    def raw_threads(self, date):
+        """ Yield a date's messages as the raw threads graph stores them """
+        for channel_id in self._channel_ids:
+            for message in self.history(channel_id, date):
+                record = CHANNEL_MESSAGE_FIELDS(message)
+                record["channel"] = channel_id
+                if message.get("thread_ts") == message["ts"]:
+                    replies = self.replies(channel_id, message["ts"])[1:]
+                    record["thread"] = THREAD_MESSAGE_FIELDS.many(replies)
+                yield record
+
+    def message_count(self):
+        """ Return the number of messages and replies in the workspace """
+        count = 0
+        for date in self.dates:
+            for record in self.raw_threads(date):
+                count += 1 + len(record.get("thread", ()))
+        return count
+
+    def populate(self, database):
+        """
+        Write the users, channels and raw threads of the workspace to a
+        database
+        """
+        # db needs bonobo, which generating a workspace does not
+        from . import db
+        with database.open_writer(db.USERS) as sink:
+            for user in self.users():
+                sink.write(USER_FIELDS(user))
+        with database.open_writer(db.CHANNELS) as sink:
+            for channel in self.channels():
+                record = CHANNEL_FIELDS(channel)
+                record["derived_name"] = record["name"]
+                sink.write(record)
+        for date in self.dates:
+            with database.open_writer(db.RAW_THREADS, date.isoformat()) as sink:
+                for record in self.raw_threads(date):
+                    sink.write(record)
@@ -0,0 +1,91 @@
+import datetime
+import threading
+import time
+
+from .orger.inorganic import asorgdate
+
+# UTC offsets are looked up once per hour. Hours in which the offset
+# changes are looked up per timestamp instead.
+_OFFSET_BLOCK_SECONDS = 60 * 60
+_MAX_CACHED_OFFSETS = 1 << 16
+
+_EPOCH = datetime.date(1970, 1, 1)
+
+
+def get_timezone(name):
+    """ Return the tzinfo for an IANA timezone name, or None for local time """
+    if name is None:
+        return None
+    try:
+        from zoneinfo import ZoneInfo
+    except ImportError:  # Python < 3.9
+        from dateutil.tz import gettz
+        timezone = gettz(name)
+        if timezone is None:
+            raise ValueError(f"Unknown timezone {name!r}")
+        return timezone
+    return ZoneInfo(name)
+
+
+class TimestampFormatter:
+    """
+    Format Slack timestamps as inactive org-mode timestamps
+
+    Timestamps are formatted in `timezone`, or in local time if None, to
+    the same text as inorganic.timestamp. The date part is cached per
+    day and the time part per minute, and the UTC offset per hour, so
+    that formatting is mostly dictionary lookups.
+    """
+
+    def __init__(self, timezone=None):
+        self._timezone = timezone
+        self._offsets = {}
+        self._dates = {}
+        self._times = [
+            f"{hour:02d}:{minute:02d}"
+            for hour in range(24) for minute in range(60)
+        ]
+        self._lock = threading.Lock()
+
+    def fingerprint(self):
+        """ Return a string identifying the timezone timestamps are formatted in """
+        if self._timezone is None:
+            return "local:" + "/".join(time.tzname)
+        return str(self._timezone)
+
+    def _exact_offset(self, seconds):
+        moment = datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+        return int(moment.astimezone(self._timezone).utcoffset().total_seconds())
+
+    def _offset(self, seconds):
+        block = seconds // _OFFSET_BLOCK_SECONDS
+        try:
+            offset = self._offsets[block]
+        except KeyError:
+            block_start = block * _OFFSET_BLOCK_SECONDS
+            offset = self._exact_offset(block_start)
+            if offset != self._exact_offset(
+                    block_start + _OFFSET_BLOCK_SECONDS - 1):
+                offset = None
+            with self._lock:
+                if len(self._offsets) >= _MAX_CACHED_OFFSETS:
+                    self._offsets.clear()
+                self._offsets[block] = offset
+        if offset is None:
+            return self._exact_offset(seconds)
+        return offset
+
+    def _date(self, day):
+        try:
+            return self._dates[day]
+        except KeyError:
+            formatted = asorgdate(_EPOCH + datetime.timedelta(days=day))
+            self._dates[day] = formatted
+            return formatted
+
+    def format(self, ts):
+        """ Format a Slack ts, as a string or a number of seconds """
+        seconds = int(float(ts))
+        local_seconds = seconds + self._offset(seconds)
+        day, second_of_day = divmod(local_seconds, 86400)
+        return f"[{self._date(day)} {self._times[second_of_day // 60]}]"
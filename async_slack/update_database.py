@@ -2,14 +2,14 @@ import argparse
 import logging
 import datetime
 from contextlib import contextmanager
+from pathlib import Path
 import time
 
-import bonobo
-
 from .users_graph import get_users_graph, get_users_services
 from .channels_graph import get_channels_graph, get_channels_services
-from .message_count_graph import update_message_count, update_message_count_quick
-from .raw_threads_graph import update_raw_threads, update_raw_threads_quick
+from .message_count_graph import update_message_count_quick
+from .raw_threads_graph import update_raw_threads_quick
+from .ingestion_graph import update_ingestion
 from .enriched_messages_graph import (
     get_enriched_messages_graph, get_enriched_messages_services
 )
@@ -19,24 +19,78 @@ from .convert_to_org_graph import (
 )
 
 from . import db
+from . import metrics
 from . import slack
+from . import sqlite_db
 from .config import read_configuration
-from .date_utils import nworking_days_before
+from .date_utils import WorkingDays
+from .instrumentation import run_graph
+from .profiling import PhaseProfiler
 
 
 logging.basicConfig(level=logging.INFO)
 
 
+def get_database(configuration):
+    if configuration.database_backend == "sqlite":
+        return sqlite_db.SqliteDatabase(configuration.database_directory)
+    elif configuration.database_backend == "json":
+        return db.JsonFsDatabase(
+            configuration.database_directory, configuration.codecs)
+    else:
+        raise ValueError(
+            f"Unknown database backend {configuration.database_backend!r}")
+
+
 def get_services(configuration):
+    database = get_database(configuration)
     return {
-        "database": db.JsonFsDatabase(configuration.database_directory),
-        "slack": slack.SlackClient.from_command(configuration.token_command)
+        "database": database,
+        "directory": db.Directory(database),
+        "working_days": WorkingDays(
+            configuration.working_days_region,
+            configuration.database_directory
+        ),
+        "slack": slack.AsyncSlackClient.from_command(
+            configuration.token_command,
+            base_url=configuration.slack_api_url
+        )
     }
 
 
 def make_parser():
     parser = argparse.ArgumentParser("async-update-slack")
     parser.add_argument("--quick", action="store_true")
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="Scan each channel's history once per range of missing days"
+    )
+    parser.add_argument(
+        "--slack-api-url",
+        help="Send Slack API calls to this URL, e.g. an async-slack-fake-server"
+    )
+    parser.add_argument(
+        "--run-report", type=Path,
+        help="Write the JSON run report here, rather than to the database directory"
+    )
+    parser.add_argument(
+        "--prometheus-textfile", type=Path,
+        help="Also write the run's metrics to this .prom file"
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="Profile each phase with cProfile, to .pstats and .collapsed files"
+    )
+    parser.add_argument(
+        "--tracemalloc", action="store_true",
+        help="Report the peak memory of each phase and its allocation sites"
+    )
+    parser.add_argument(
+        "--profile-directory", type=Path,
+        help="Write profiles here, rather than to profiles/<time> "
+             "in the database directory"
+    )
     return parser
 
 
@@ -45,6 +99,7 @@ def log_timed(name):
     t_start = time.time()
     yield
     duration = time.time() - t_start
+    metrics.registry.record_phase(name, duration)
     duration_readable = str(int(duration * 1000) / 1000.0) + "s"
     logging.info("Time to run %s: %s", name, duration_readable)
 
@@ -53,58 +108,143 @@ def main():
     configuration = read_configuration()
     parser = make_parser()
     arguments = parser.parse_args()
+    for override in ("slack_api_url", "run_report", "prometheus_textfile"):
+        if getattr(arguments, override) is not None:
+            configuration = configuration._replace(
+                **{override: getattr(arguments, override)})
     logging.info(
         "Running with configuration %s and arguments %s.",
         configuration, arguments
     )
-    base_services = get_services(configuration)
+    profile_directory = arguments.profile_directory or (
+        configuration.database_directory / "profiles" /
+        datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+    )
+    profiler = PhaseProfiler(
+        profile_directory, cpu=arguments.profile, memory=arguments.tracemalloc)
+    metrics.registry.reset()
+    try:
+        update(configuration, arguments, profiler)
+    finally:
+        write_reports(configuration)
+
+
+def write_reports(configuration):
+    """
+    Write the run report and Prometheus file, if configured
+
+    Failures are logged rather than raised, so that they never hide the
+    outcome of the run, which this is called after whether or not it
+    failed.
+    """
+    reports = [
+        (configuration.run_report, metrics.registry.write_report),
+        (configuration.prometheus_textfile, metrics.registry.write_prometheus),
+    ]
+    for path, write in reports:
+        if path is None:
+            continue
+        try:
+            write(path)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("Could not write %s", path)
+        else:
+            logging.info("Wrote %s", path)
+
+
+def run_users(configuration, arguments, base_services):
     logging.info("Getting users")
-    with log_timed("users graph"):
-        bonobo.run(
-            get_users_graph(),
-            services=get_users_services(base_services)
-        )
+    run_graph(get_users_graph(), get_users_services(base_services), "users")
+    base_services["directory"].reload()
+
+
+def run_channels(configuration, arguments, base_services):
     logging.info("Getting channels")
-    with log_timed("channels graph"):
-        bonobo.run(
-            get_channels_graph(),
-            services=get_channels_services(base_services)
-        )
+    run_graph(
+        get_channels_graph(), get_channels_services(base_services), "channels")
+    base_services["directory"].reload()
+
+
+def run_message_count(configuration, arguments, base_services):
     logging.info("Getting message count")
-    with log_timed("message count graph"):
-        if arguments.quick:
-            update_message_count_quick(datetime.date.today(), base_services)
-        else:
-            update_message_count(
-                configuration.start_date,
-                configuration.end_date,
-                base_services
-            )
+    update_message_count_quick(datetime.date.today(), base_services)
+
+
+def run_raw_threads(configuration, arguments, base_services):
     logging.info("Getting raw threads.")
-    with log_timed("raw threads graph"):
-        if arguments.quick:
-            update_raw_threads_quick(
-                nworking_days_before(datetime.date.today(), 1),
-                configuration.end_date,
-                base_services
-            )
-        else:
-            update_raw_threads(
-                configuration.start_date,
-                configuration.end_date,
-                configuration.threads_lookback_working_days,
-                base_services
-            )
+    update_raw_threads_quick(
+        base_services["working_days"].nworking_days_before(
+            datetime.date.today(), 1),
+        configuration.end_date,
+        base_services,
+        configuration.max_concurrent_days
+    )
+
+
+def run_ingestion(configuration, arguments, base_services):
+    logging.info("Getting message count and raw threads.")
+    update_ingestion(
+        configuration.start_date,
+        configuration.end_date,
+        configuration.threads_lookback_working_days,
+        base_services,
+        configuration.max_concurrent_days,
+        arguments.backfill
+    )
+
+
+def run_enrichment(configuration, arguments, base_services):
     logging.info("Enriching messages with user and channel information")
-    bonobo.run(
+    run_graph(
         get_enriched_messages_graph(
             configuration.start_date,
             configuration.end_date
         ),
-        services=get_enriched_messages_services(base_services)
+        get_enriched_messages_services(base_services),
+        "enriched messages"
     )
+
+
+def run_org_conversion(configuration, arguments, base_services):
     logging.info("Converting to org-mode")
-    bonobo.run(
-        get_convert_to_org_graph(),
-        services=get_convert_to_org_services(base_services)
+    run_graph(
+        get_convert_to_org_graph(
+            configuration.start_date,
+            configuration.end_date,
+            configuration.org_partitioning
+        ),
+        get_convert_to_org_services(
+            base_services,
+            configuration.custom_emoji_file,
+            configuration.timezone
+        ),
+        "org"
+    )
+
+
+def get_phases(arguments):
+    """ Return the (name, function) phases of an update, in order """
+    phases = [("users", run_users), ("channels", run_channels)]
+    if arguments.quick:
+        phases += [
+            ("message count", run_message_count),
+            ("raw threads", run_raw_threads),
+        ]
+    else:
+        phases.append(("ingestion", run_ingestion))
+    phases += [
+        ("enrichment", run_enrichment),
+        ("org conversion", run_org_conversion),
+    ]
+    return phases
+
+
+def update(configuration, arguments, profiler):
+    base_services = get_services(configuration)
+    for name, run_phase in get_phases(arguments):
+        with profiler.phase(name), log_timed(name):
+            run_phase(configuration, arguments, base_services)
+    logging.info(
+        "Remaining Slack rate budget by method: %s",
+        base_services["slack"].scheduler.remaining()
     )
@@ -2,23 +2,25 @@ import bonobo
 from bonobo.config import use
 
 from . import db
-from .dict_utils import map_dictionary
+from . import slack
+from .fields import USER_FIELDS
+
+
+@slack.api_retry
+@slack.rate_limited("users.list")
+def list_users(slack):
+    return slack.client.users.list()
 
 
 @use("slack")
 def get_users(slack):
-    response = slack.client.users.list().body
+    response = list_users(slack).body
     for member in response["members"]:
         yield member
 
 
 def process_user(user):
-    to_keep = {
-        "name": "/name", 
-        "id": "/id", 
-        "real_name": "/profile/real_name",
-    }
-    yield map_dictionary(to_keep, user)
+    yield USER_FIELDS(user)
 
 
 def get_users_graph(**options):
@@ -0,0 +1,192 @@
+"""
+Per-message cost of rendering Slack blocks to org-mode text
+
+Renders a synthetic batch of messages, in which a share of blocks
+repeat their elements, with the original renderer (dispatch table
+rebuilt on every element, emoji through emojize), the current renderer,
+and the current renderer with its block cache. As in Slack, every block
+has a block_id of its own.
+
+    python benchmarks/block_renderer.py [--messages N] [--repeat-share F]
+"""
+import argparse
+import random
+import time
+
+from emoji import emojize
+
+from async_slack.convert_to_org_graph import BlockRenderer
+from async_slack.orger.inorganic import link
+
+
+class _Directory:
+
+    def __init__(self, entries):
+        self._entries = entries
+
+    def for_id(self, id_):
+        return self._entries[id_]
+
+
+class LegacyBlockRenderer:
+    """ The renderer before the dispatch table, copied as it was """
+
+    def __init__(self, users, channels):
+        self._users = users
+        self._channels = channels
+
+    def render(self, block):
+        try:
+            elements = block['elements']
+        except KeyError:
+            elements = []
+        return "\n".join(self._element(element) for element in elements)
+
+    def _rich_text_section(self, element):
+        return "".join(self._element(element) for element in element['elements'])
+
+    def _text(self, element):
+        return element['text']
+
+    def _rich_text_list(self, element):
+        rendered_elements = [self._element(element) for element in element['elements']]
+        list_elements = [f"- {element}" for element in rendered_elements]
+        return "\n".join(list_elements)
+
+    def _link(self, element):
+        try:
+            text = element['text']
+        except KeyError:
+            text = element['url']
+        return link(url=element['url'], title=text)
+
+    def _broadcast(self, element):
+        return f"@{element['range']}"
+
+    def _user(self, element):
+        user_id = element['user_id']
+        try:
+            user_name = self._users.for_id(user_id)['name']
+        except KeyError:
+            user_name = user_id
+        return f"@{user_name}"
+
+    def _channel(self, element):
+        channel_id = element['channel_id']
+        try:
+            channel_name = self._channels.for_id(channel_id)["derived_name"]
+        except KeyError:
+            channel_name = channel_id
+        return f"#{channel_name}"
+
+    def _debug(self, element):
+        return str(element)
+
+    def _emoji(self, element):
+        name = element['name']
+        return emojize(f":{name}:")
+
+    def _empty(self, element):
+        return ""
+
+    def _element(self, element):
+        element_type = element['type']
+        return {
+            'text': self._text,
+            'rich_text_section': self._rich_text_section,
+            'rich_text_list': self._rich_text_list,
+            'link': self._link,
+            'broadcast': self._broadcast,
+            'user': self._user,
+            'usergroup': self._debug,
+            'channel': self._channel,
+            'emoji': self._emoji,
+            'rich_text_preformatted': self._rich_text_section,
+            'rich_text_quote': self._rich_text_section,
+            'button': self._empty,
+            'mrkdwn': self._empty
+        }[element_type](element)
+
+
+def make_block(rng, user_ids, channel_ids):
+    elements = []
+    for _ in range(rng.randint(1, 6)):
+        kind = rng.random()
+        if kind < 0.5:
+            elements.append({"type": "text", "text": f"word {rng.random()}"})
+        elif kind < 0.65:
+            elements.append({"type": "user", "user_id": rng.choice(user_ids)})
+        elif kind < 0.75:
+            elements.append(
+                {"type": "channel", "channel_id": rng.choice(channel_ids)})
+        elif kind < 0.85:
+            elements.append({"type": "emoji", "name": "thumbsup"})
+        else:
+            elements.append({
+                "type": "link",
+                "url": "https://example.com",
+                "text": "example"
+            })
+    section = {"type": "rich_text_section", "elements": elements}
+    if rng.random() < 0.2:
+        section = {"type": "rich_text_list", "elements": [section, section]}
+    return {"type": "rich_text", "elements": [section]}
+
+
+def with_block_id(rng, block):
+    """ Copy a block with a block_id of its own, as Slack gives it """
+    return {**block, "block_id": f"{rng.getrandbits(32):08x}"}
+
+
+def make_messages(nmessages, repeat_share, seed=0):
+    rng = random.Random(seed)
+    user_ids = [f"U{index:05d}" for index in range(50)]
+    channel_ids = [f"C{index:05d}" for index in range(20)]
+    boilerplate = [
+        make_block(rng, user_ids, channel_ids) for _ in range(20)
+    ]
+    messages = []
+    for _ in range(nmessages):
+        if rng.random() < repeat_share:
+            block = rng.choice(boilerplate)
+        else:
+            block = make_block(rng, user_ids, channel_ids)
+        messages.append([with_block_id(rng, block)])
+    users = _Directory({
+        user_id: {"name": user_id.lower()} for user_id in user_ids})
+    channels = _Directory({
+        channel_id: {"derived_name": channel_id.lower()}
+        for channel_id in channel_ids
+    })
+    return messages, users, channels
+
+
+def time_renderer(renderer, messages):
+    start = time.perf_counter()
+    for blocks in messages:
+        for block in blocks:
+            renderer.render(block)
+    return (time.perf_counter() - start) / len(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--repeat-share", type=float, default=0.3)
+    arguments = parser.parse_args()
+
+    messages, users, channels = make_messages(
+        arguments.messages, arguments.repeat_share)
+    renderers = [
+        ("legacy", LegacyBlockRenderer(users, channels)),
+        ("dispatch table", BlockRenderer(users, channels)),
+        ("dispatch table + cache",
+         BlockRenderer(users, channels, cache_size=4096)),
+    ]
+    for name, renderer in renderers:
+        per_message = time_renderer(renderer, messages)
+        print(f"{name:<24} {per_message * 1e6:8.2f} us/message")
+
+
+if __name__ == "__main__":
+    main()
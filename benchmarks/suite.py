@@ -0,0 +1,266 @@
+"""
+Offline benchmarks of each stage, on a synthetic workspace
+
+Each stage runs in a fresh process against a workspace generated with a
+fixed seed, and reports its throughput in messages per second and the
+peak RSS of its process. Results are compared against a baseline saved
+with --save-baseline, and the run fails with --check if any stage is
+slower than the baseline by more than the tolerance.
+
+    python benchmarks/suite.py [--size small|medium|large] [--stage NAME]
+        [--baseline PATH] [--save-baseline] [--check] [--tolerance 0.2]
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from async_slack.synthetic_workspace import SyntheticWorkspace, WORKSPACE_SIZES
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+SIZES = WORKSPACE_SIZES
+
+
+def _peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _base_services(database):
+    from async_slack import db
+    return {"database": database, "directory": db.Directory(database)}
+
+
+def _populated(workspace, directory, backend="json"):
+    if backend == "sqlite":
+        from async_slack.sqlite_db import SqliteDatabase
+        database = SqliteDatabase(directory)
+    else:
+        from async_slack.db import JsonFsDatabase
+        database = JsonFsDatabase(directory)
+    workspace.populate(database)
+    return database
+
+
+def _channel_messages(workspace):
+    return [
+        message
+        for date in workspace.dates
+        for channel in workspace.channels()
+        for message in workspace.history(channel["id"], date)
+    ]
+
+
+def bench_map_dictionary(workspace, directory):
+    from async_slack.dict_utils import map_dictionary
+    messages = _channel_messages(workspace)
+    mapping = {
+        "blocks": "/blocks", "ts": "/ts", "thread_ts": "/thread_ts",
+        "user": "/user", "reply_count": "/reply_count",
+        "latest_reply": "/latest_reply",
+    }
+
+    def run():
+        for message in messages:
+            map_dictionary(mapping, message)
+        return len(messages)
+    return run
+
+
+def bench_projection(workspace, directory):
+    from async_slack.fields import CHANNEL_MESSAGE_FIELDS
+    messages = _channel_messages(workspace)
+
+    def run():
+        CHANNEL_MESSAGE_FIELDS.many(messages)
+        return len(messages)
+    return run
+
+
+def bench_block_renderer(workspace, directory):
+    from async_slack.convert_to_org_graph import BlockRenderer
+    from async_slack.db import Directory
+    database = _populated(workspace, directory)
+    directory_service = Directory(database)
+    messages = [
+        message
+        for date in workspace.dates
+        for record in workspace.raw_threads(date)
+        for message in [record, *record.get("thread", ())]
+    ]
+    renderer = BlockRenderer(directory_service.users, directory_service.channels)
+
+    def run():
+        for message in messages:
+            for block in message["blocks"]:
+                renderer.render(block)
+        return len(messages)
+    return run
+
+
+def _bench_database(backend):
+    def bench(workspace, directory):
+        from async_slack import db
+        database = _populated(workspace, directory, backend)
+        partitions = {
+            date.isoformat(): list(workspace.raw_threads(date))
+            for date in workspace.dates
+        }
+        nmessages = sum(len(records) for records in partitions.values())
+
+        def run():
+            for partition, records in partitions.items():
+                with database.open_writer(db.RAW_THREADS, partition) as sink:
+                    for record in records:
+                        sink.write(record)
+            for partition in database.partitions(db.RAW_THREADS):
+                for _ in database.read(db.RAW_THREADS, partition):
+                    pass
+            return 2 * nmessages
+        return run
+    return bench
+
+
+def bench_enriched_messages_graph(workspace, directory):
+    import bonobo
+    from async_slack.enriched_messages_graph import (
+        get_enriched_messages_graph, get_enriched_messages_services
+    )
+    database = _populated(workspace, directory)
+    nmessages = workspace.message_count()
+
+    def run():
+        bonobo.run(
+            get_enriched_messages_graph(workspace.spec.start_date, workspace.end_date),
+            services=get_enriched_messages_services(_base_services(database))
+        )
+        return nmessages
+    return run
+
+
+def bench_convert_to_org_graph(workspace, directory):
+    import bonobo
+    from async_slack.enriched_messages_graph import (
+        get_enriched_messages_graph, get_enriched_messages_services
+    )
+    from async_slack.convert_to_org_graph import (
+        get_convert_to_org_graph, get_convert_to_org_services
+    )
+    database = _populated(workspace, directory)
+    nmessages = workspace.message_count()
+    bonobo.run(
+        get_enriched_messages_graph(workspace.spec.start_date, workspace.end_date),
+        services=get_enriched_messages_services(_base_services(database))
+    )
+
+    def run():
+        bonobo.run(
+            get_convert_to_org_graph(workspace.spec.start_date, workspace.end_date),
+            services=get_convert_to_org_services(_base_services(database))
+        )
+        return nmessages
+    return run
+
+
+STAGES = {
+    "map_dictionary": bench_map_dictionary,
+    "projection": bench_projection,
+    "block_renderer": bench_block_renderer,
+    "db_json": _bench_database("json"),
+    "db_sqlite": _bench_database("sqlite"),
+    "enriched_messages_graph": bench_enriched_messages_graph,
+    "convert_to_org_graph": bench_convert_to_org_graph,
+}
+
+
+def run_stage(name, spec):
+    """ Set up and time a stage, in the current process """
+    workspace = SyntheticWorkspace(spec)
+    with tempfile.TemporaryDirectory() as directory:
+        run = STAGES[name](workspace, directory)
+        start = time.perf_counter()
+        nmessages = run()
+        duration = time.perf_counter() - start
+    return {
+        "messages": nmessages,
+        "seconds": duration,
+        "messages_per_second": nmessages / duration,
+        "peak_rss_bytes": _peak_rss_bytes(),
+    }
+
+
+def run_isolated(name, spec):
+    """ Run a stage in a fresh process, so that its peak RSS is its own """
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(run_stage, (name, spec))
+
+
+def compare(results, baseline, tolerance):
+    """ Print results next to the baseline, returning the regressed stages """
+    regressions = []
+    print(f"{'stage':<26}{'msgs/s':>12}{'baseline':>12}{'change':>9}{'peak RSS':>11}")
+    for name, result in results.items():
+        rate = result["messages_per_second"]
+        line = f"{name:<26}{rate:>12.0f}"
+        base = baseline.get(name)
+        if base is not None:
+            change = rate / base["messages_per_second"] - 1
+            line += f"{base['messages_per_second']:>12.0f}{change:>+9.0%}"
+            if change < -tolerance:
+                regressions.append(name)
+        else:
+            line += f"{'-':>12}{'-':>9}"
+        line += f"{result['peak_rss_bytes'] / (1 << 20):>8.0f} MiB"
+        print(line)
+    return regressions
+
+
+def make_parser():
+    parser = argparse.ArgumentParser("async-slack-benchmarks")
+    parser.add_argument("--size", choices=sorted(SIZES), default="small")
+    parser.add_argument(
+        "--stage", action="append", choices=sorted(STAGES),
+        help="Stage to run; may be repeated. Defaults to every stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    return parser
+
+
+def main():
+    arguments = make_parser().parse_args()
+    spec = SIZES[arguments.size]._replace(seed=arguments.seed)
+    results = {}
+    for name in arguments.stage or STAGES:
+        try:
+            results[name] = run_isolated(name, spec)
+        except ImportError as error:
+            print(f"Skipping {name}: {error}", file=sys.stderr)
+
+    baselines = {}
+    if arguments.baseline.exists():
+        baselines = json.loads(arguments.baseline.read_text())
+    key = f"{arguments.size}:{arguments.seed}"
+    regressions = compare(
+        results, baselines.get(key, {}).get("stages", {}), arguments.tolerance)
+
+    if arguments.save_baseline:
+        baselines[key] = {"python": platform.python_version(), "stages": results}
+        arguments.baseline.write_text(json.dumps(baselines, indent=2) + "\n")
+    if arguments.check and regressions:
+        print(f"Regressed: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
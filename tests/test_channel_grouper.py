@@ -0,0 +1,56 @@
+import bonobo
+
+from async_slack.channel_grouper import ChannelGrouper, channel_key
+
+MESSAGES = [
+    {"channel": f"C{index % 3}", "ts": f"{index}.0"} for index in range(30)
+]
+
+
+def extract():
+    yield from MESSAGES
+
+
+def group(grouper):
+    groups = []
+
+    def collect(key, value):
+        groups.append((key, value))
+
+    graph = bonobo.Graph()
+    graph.add_chain(extract, grouper, collect)
+    bonobo.run(graph)
+    return groups
+
+
+def expected_groups():
+    groups = {}
+    for message in MESSAGES:
+        groups.setdefault(message["channel"], []).append(message)
+    return groups
+
+
+def test_groups_in_memory():
+    assert dict(group(ChannelGrouper(key=channel_key))) == expected_groups()
+
+
+def test_groups_by_channel_by_default():
+    assert dict(group(ChannelGrouper())) == expected_groups()
+
+
+def test_groups_by_key():
+    groups = group(ChannelGrouper(key=lambda message: message["ts"][0]))
+    assert [key for key, _ in groups] == [str(digit) for digit in range(10)]
+
+
+def test_groups_spilled_to_disk_keep_their_order(tmp_path):
+    groups = group(ChannelGrouper(
+        key=channel_key, memory_budget=200, spill_directory=str(tmp_path)))
+    assert [key for key, _ in groups] == ["C0", "C1", "C2"]
+    assert dict(groups) == expected_groups()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_count_only():
+    counts = group(ChannelGrouper(key=channel_key, count_only=True))
+    assert dict(counts) == {"C0": 10, "C1": 10, "C2": 10}
@@ -0,0 +1,93 @@
+import json
+
+import bonobo
+
+from async_slack import db
+from async_slack.convert_to_org_graph import (
+    CHANNEL, BlockRenderer, content_hash, get_convert_to_org_graph,
+    get_convert_to_org_services
+)
+from async_slack.emoji_table import EmojiTable
+from async_slack.enriched_messages_graph import (
+    get_enriched_messages_graph, get_enriched_messages_services
+)
+from async_slack.synthetic_workspace import SyntheticWorkspace, WorkspaceSpec
+from async_slack.timestamp_formatter import TimestampFormatter, get_timezone
+
+SPEC = WorkspaceSpec(users=5, channels=2, days=2, messages_per_day=4)
+
+
+def test_content_hash_depends_on_every_fingerprint():
+    messages = [{"ts": "1.0", "text": "hello"}]
+    hashes = {
+        content_hash(messages, "directory", "emoji", "UTC"),
+        content_hash(messages, "directory", "emoji", "Europe/Paris"),
+        content_hash(messages, "directory", "other emoji", "UTC"),
+        content_hash(messages, "other directory", "emoji", "UTC"),
+        content_hash([], "directory", "emoji", "UTC"),
+    }
+    assert len(hashes) == 5
+
+
+def test_fingerprints_follow_configuration():
+    assert (TimestampFormatter(get_timezone("UTC")).fingerprint()
+            != TimestampFormatter(get_timezone("Europe/Paris")).fingerprint())
+    assert EmojiTable().fingerprint() == EmojiTable().fingerprint()
+    assert (EmojiTable().fingerprint()
+            != EmojiTable({"party": "https://example.com/party.png"}).fingerprint())
+
+
+def convert(database, workspace, **options):
+    base_services = {"database": database, "directory": db.Directory(database)}
+    bonobo.run(
+        get_enriched_messages_graph(workspace.spec.start_date, workspace.end_date),
+        services=get_enriched_messages_services(base_services)
+    )
+    bonobo.run(
+        get_convert_to_org_graph(
+            workspace.spec.start_date, workspace.end_date, CHANNEL),
+        services=get_convert_to_org_services(base_services, **options)
+    )
+
+
+def test_groups_are_rendered_again_when_configuration_changes(tmp_path):
+    workspace = SyntheticWorkspace(SPEC)
+    database = db.JsonFsDatabase(tmp_path / "database")
+    workspace.populate(database)
+    convert(database, workspace, timezone="UTC")
+    group = database.partitions(db.ORG_MESSAGES)[0]
+    path = tmp_path / "database" / f"org-messages-{group}.json"
+
+    path.unlink()
+    convert(database, workspace, timezone="UTC")
+    assert not path.exists()
+
+    convert(database, workspace, timezone="Asia/Tokyo")
+    assert path.exists()
+
+    path.unlink()
+    emoji_file = tmp_path / "emoji.json"
+    emoji_file.write_text(json.dumps({"emoji": {"party": "https://example.com/p.png"}}))
+    convert(database, workspace, timezone="Asia/Tokyo", custom_emoji_file=emoji_file)
+    assert path.exists()
+
+
+class CountingRenderer(BlockRenderer):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rendered = 0
+
+    def _render(self, block):
+        self.rendered += 1
+        return super()._render(block)
+
+
+def test_block_cache_ignores_block_ids():
+    elements = [{"type": "rich_text_section", "elements": [
+        {"type": "text", "text": "hello "}, {"type": "emoji", "name": "wave"}]}]
+    renderer = CountingRenderer(None, None, cache_size=2)
+    first = renderer.render({"type": "rich_text", "block_id": "a", "elements": elements})
+    second = renderer.render({"type": "rich_text", "block_id": "b", "elements": elements})
+    assert first == second == "hello 👋"
+    assert renderer.rendered == 1
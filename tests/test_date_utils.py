@@ -0,0 +1,118 @@
+import datetime
+import json
+import subprocess
+import sys
+
+from async_slack.date_utils import (
+    WorkingDays, _workalendar_version, contiguous_ranges, date_range
+)
+
+REGION = "europe.UnitedKingdom"
+
+
+def write_cache(directory, first_year, last_year, ordinals, **overrides):
+    cached = {
+        "region": REGION,
+        "workalendar": _workalendar_version(),
+        "first_year": first_year,
+        "last_year": last_year,
+        "ordinals": [date.toordinal() for date in ordinals],
+        **overrides
+    }
+    with open(directory / f"working-days-{REGION}.json", "w") as fp:
+        json.dump(cached, fp)
+
+
+def test_skips_weekends_and_holidays():
+    working_days = WorkingDays(REGION)
+    # Friday 3 January 2020, over the weekend
+    assert working_days.nworking_days_before(datetime.date(2020, 1, 6), 1) \
+        == datetime.date(2020, 1, 3)
+    # Over Christmas Day and Boxing Day
+    assert working_days.nworking_days_before(datetime.date(2019, 12, 27), 1) \
+        == datetime.date(2019, 12, 24)
+    assert working_days.nworking_days_before(datetime.date(2020, 1, 2), 0) \
+        == datetime.date(2020, 1, 2)
+
+
+def test_cached_years_are_reused(tmp_path):
+    # Only one working day, which workalendar would never give
+    write_cache(tmp_path, 2010, 2011, [datetime.date(2010, 6, 1)])
+    working_days = WorkingDays(REGION, cache_directory=tmp_path)
+    assert working_days.nworking_days_before(datetime.date(2011, 6, 1), 1) \
+        == datetime.date(2010, 6, 1)
+
+
+def test_cache_from_another_workalendar_is_rebuilt(tmp_path):
+    write_cache(
+        tmp_path, 2010, 2011, [datetime.date(2010, 6, 1)], workalendar="0.0")
+    working_days = WorkingDays(REGION, cache_directory=tmp_path)
+    assert working_days.nworking_days_before(datetime.date(2011, 6, 1), 1) \
+        == datetime.date(2011, 5, 31)
+
+
+def test_cache_from_another_region_is_rebuilt(tmp_path):
+    write_cache(
+        tmp_path, 2010, 2011, [datetime.date(2010, 6, 1)], region="europe.France")
+    working_days = WorkingDays(REGION, cache_directory=tmp_path)
+    assert working_days.nworking_days_before(datetime.date(2011, 6, 1), 1) \
+        == datetime.date(2011, 5, 31)
+
+
+def test_current_and_next_year_are_refreshed(tmp_path):
+    today = datetime.date.today()
+    write_cache(tmp_path, today.year - 1, today.year + 1, [
+        datetime.date(today.year - 1, 6, 1),
+        datetime.date(today.year, 1, 1),
+        datetime.date(today.year + 1, 1, 1),
+    ])
+    working_days = WorkingDays(REGION, cache_directory=tmp_path)
+    working_days.nworking_days_before(today, 1)
+
+    with open(tmp_path / f"working-days-{REGION}.json") as fp:
+        cached = json.load(fp)
+    years = [datetime.date.fromordinal(ordinal).year for ordinal in cached["ordinals"]]
+    # The previous year is kept from the cache, the others are rebuilt
+    assert years.count(today.year - 1) == 1
+    assert years.count(today.year) > 200
+    assert years.count(today.year + 1) > 200
+    assert datetime.date(today.year, 1, 1).toordinal() not in cached["ordinals"]
+
+
+def test_refreshed_years_are_kept_for_the_day(tmp_path):
+    today = datetime.date.today()
+    # Only one working day this year, which workalendar would never give
+    write_cache(
+        tmp_path, today.year - 1, today.year + 1, [datetime.date(today.year, 1, 1)],
+        refreshed_on=today.toordinal())
+    working_days = WorkingDays(REGION, cache_directory=tmp_path)
+    assert working_days.nworking_days_before(datetime.date(today.year + 1, 1, 1), 1) \
+        == datetime.date(today.year, 1, 1)
+
+
+def test_refresh_is_cached(tmp_path):
+    today = datetime.date.today()
+    WorkingDays(REGION, cache_directory=tmp_path).nworking_days_before(today, 1)
+
+    script = (
+        "import datetime, sys\n"
+        "from async_slack.date_utils import WorkingDays\n"
+        f"working_days = WorkingDays({REGION!r}, cache_directory={str(tmp_path)!r})\n"
+        "working_days.nworking_days_before(datetime.date.today(), 1)\n"
+        "assert 'workalendar' not in sys.modules, 'workalendar was imported'\n"
+    )
+    subprocess.run([sys.executable, "-c", script], check=True)
+
+
+def test_contiguous_ranges():
+    dates = [
+        datetime.date(2020, 1, 1), datetime.date(2020, 1, 2),
+        datetime.date(2020, 1, 4),
+        *date_range(datetime.date(2020, 2, 1), datetime.date(2020, 2, 6)),
+    ]
+    assert contiguous_ranges(dates, max_days=3) == [
+        (datetime.date(2020, 1, 1), datetime.date(2020, 1, 3)),
+        (datetime.date(2020, 1, 4), datetime.date(2020, 1, 5)),
+        (datetime.date(2020, 2, 1), datetime.date(2020, 2, 4)),
+        (datetime.date(2020, 2, 4), datetime.date(2020, 2, 6)),
+    ]
@@ -0,0 +1,66 @@
+import datetime
+import threading
+
+import pytest
+
+from async_slack.date_utils import date_range
+from async_slack.day_executor import run_days
+
+START = datetime.date(2020, 1, 1)
+DATES = list(date_range(START, START + datetime.timedelta(days=6)))
+
+
+def test_yields_every_date():
+    completed = list(run_days(DATES, lambda date: None, 3))
+    assert sorted(completed) == DATES
+
+
+def test_runs_at_most_max_concurrent_days():
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+    barrier = threading.Barrier(2)
+
+    def run_day(date):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        barrier.wait(timeout=5)
+        with lock:
+            running[0] -= 1
+
+    assert sorted(run_days(DATES, run_day, 2)) == DATES
+    assert peak[0] == 2
+
+
+def test_failure_stops_starting_days():
+    started = []
+
+    def run_day(date):
+        started.append(date)
+        if date == DATES[2]:
+            raise ValueError(date)
+
+    completed = []
+    with pytest.raises(ValueError):
+        for date in run_days(DATES, run_day, 1):
+            completed.append(date)
+    assert started == DATES[:3]
+    assert completed == DATES[:2]
+
+
+def test_days_running_when_one_fails_are_still_yielded():
+    failing_started = threading.Event()
+
+    def run_day(date):
+        if date == DATES[0]:
+            failing_started.set()
+            raise ValueError(date)
+        # Still running when the first day fails
+        failing_started.wait(timeout=5)
+
+    completed = []
+    with pytest.raises(ValueError):
+        for date in run_days(DATES, run_day, 2):
+            completed.append(date)
+    assert completed == [DATES[1]]
@@ -0,0 +1,123 @@
+import datetime
+import sys
+import threading
+
+import pytest
+
+from async_slack import db
+from async_slack.serialization import get_codec
+
+
+def test_state_survives_reopening(tmp_path):
+    database = db.JsonFsDatabase(tmp_path)
+    status = db.Status(database)
+    status.set_message_count_complete(datetime.date(2020, 1, 1))
+
+    status = db.Status(db.JsonFsDatabase(tmp_path))
+    assert status.is_message_count_complete(datetime.date(2020, 1, 1))
+    assert not status.is_raw_threads_complete(datetime.date(2020, 1, 1))
+
+
+def test_torn_journal_write_is_dropped(tmp_path):
+    database = db.JsonFsDatabase(tmp_path)
+    db.MessageCount(database).set_day_channel(datetime.date(2020, 1, 1), "C1", 3)
+    with open(tmp_path / "message-count.journal", "a") as fp:
+        fp.write('["2020-01-02", "C1", ')
+
+    message_count = db.MessageCount(db.JsonFsDatabase(tmp_path))
+    assert message_count.get_channels_for_day(datetime.date(2020, 1, 1)) == ["C1"]
+    assert message_count.get_channels_for_day(datetime.date(2020, 1, 2)) == []
+
+
+def test_concurrent_writers_and_compaction(tmp_path):
+    database = db.JsonFsDatabase(tmp_path)
+    nthreads, ndays = 8, 1500
+    errors = []
+
+    def write(thread):
+        try:
+            # Separate instances over the same state, as separate graphs use
+            message_count = db.MessageCount(database)
+            for day in range(ndays):
+                date = datetime.date(2000, 1, 1) + datetime.timedelta(days=day)
+                message_count.set_day_channel(date, f"C{thread}", day)
+        except Exception as e:  # pylint: disable=broad-except
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=write, args=(thread,)) for thread in range(nthreads)]
+    # Switch threads often, so that writers run during compactions
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert errors == []
+    # More updates than a journal holds, so it has been compacted
+    assert (tmp_path / "message-count.json").exists()
+
+    reopened = db.JsonFsDatabase(tmp_path).read_state(db.MESSAGE_COUNT)
+    assert len(reopened) == ndays
+    assert all(len(channels) == nthreads for channels in reopened.values())
+
+
+def test_state_lock_is_shared(tmp_path):
+    database = db.JsonFsDatabase(tmp_path)
+    assert db.Status(database)._lock is db.Status(database)._lock
+
+
+@pytest.mark.parametrize("store, manifest_name", [
+    (db.ENRICHED_MESSAGES, db.ENRICHED_MESSAGES_MANIFEST),
+    (db.ORG_MESSAGES, db.ORG_MESSAGES_MANIFEST),
+])
+def test_compacted_manifest_is_not_a_partition(tmp_path, store, manifest_name):
+    database = db.JsonFsDatabase(tmp_path)
+    with database.open_writer(store, "2020-01-01") as sink:
+        sink.write({"ts": "1.0"})
+    manifest = db.Manifest(database, manifest_name)
+    # Enough updates to fold the journal into a snapshot
+    for index in range(1001):
+        manifest.set(f"2019-{index}", str(index))
+    assert any(path.suffix == ".json" and "manifest" in path.name
+               for path in tmp_path.iterdir())
+
+    assert database.partitions(store) == ["2020-01-01"]
+    reopened = db.Manifest(db.JsonFsDatabase(tmp_path), manifest_name)
+    assert reopened.get("2019-1000") == "1000"
+
+
+def test_enriched_messages_reader_is_bounded_to_dates(tmp_path):
+    database = db.JsonFsDatabase(tmp_path)
+    for day in range(1, 5):
+        with database.open_writer(db.ENRICHED_MESSAGES, f"2020-01-0{day}") as sink:
+            sink.write({"day": day})
+    reader = db.JsonEnrichedMessagesReader(
+        datetime.date(2020, 1, 2), datetime.date(2020, 1, 4))
+    assert list(reader(None, database=database)) == [{"day": 2}, {"day": 3}]
+
+
+class RecordingFile:
+
+    def __init__(self, events):
+        self._events = events
+
+    def write(self, data):
+        self._events.append("flush")
+
+    def flush(self):
+        pass
+
+
+def test_records_are_flushed_in_batches():
+    events = []
+    sink = db._FileSink(
+        RecordingFile(events), get_codec("json"), db.FlushPolicy(records=3))
+    for index in range(7):
+        events.append(index)
+        sink.write({"ts": f"{index}.0"})
+    sink.flush()
+    assert events == [0, 1, 2, "flush", 3, 4, 5, "flush", 6, "flush"]
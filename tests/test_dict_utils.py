@@ -0,0 +1,59 @@
+import pytest
+
+from async_slack.dict_utils import Projection, map_dictionary
+
+MAPPING = {
+    "id": "/id",
+    "real_name": "/profile/real_name",
+    "first_file": "/files/0/name",
+    "second_file": "/files/1/name",
+}
+
+RECORDS = [
+    # Every path present
+    {"id": "U1", "profile": {"real_name": "Ada"},
+     "files": [{"name": "a.txt"}, {"name": "b.txt"}]},
+    # Missing intermediate keys
+    {"id": "U2"},
+    {"id": "U3", "profile": {}},
+    # Lists too short, or not lists
+    {"id": "U4", "files": [{"name": "a.txt"}]},
+    {"id": "U5", "files": {"name": "a.txt"}},
+    {"id": "U6", "files": "a.txt"},
+    # None values, at the end of a path or on the way
+    {"id": None, "profile": {"real_name": None}, "files": [None, {"name": None}]},
+    {"id": "U8", "profile": None, "files": None},
+]
+
+
+@pytest.mark.parametrize("record", RECORDS)
+def test_projection_matches_map_dictionary(record):
+    assert Projection(MAPPING)(record) == map_dictionary(MAPPING, record)
+
+
+@pytest.mark.parametrize("mapping", [MAPPING, {"id": "/id", "name": "name"}])
+def test_many_matches_one_at_a_time(mapping):
+    project = Projection(mapping)
+    assert project.many(RECORDS) == [project(record) for record in RECORDS]
+    assert project.many(RECORDS) == [
+        map_dictionary(mapping, record) for record in RECORDS]
+
+
+def test_path_semantics():
+    project = Projection(MAPPING)
+    assert project(RECORDS[0]) == {
+        "id": "U1", "real_name": "Ada",
+        "first_file": "a.txt", "second_file": "b.txt",
+    }
+    for record in RECORDS[1:]:
+        projected = project(record)
+        assert list(projected) == list(MAPPING)
+        assert projected["second_file"] is None
+    assert project(RECORDS[3])["first_file"] == "a.txt"
+    assert project(RECORDS[4])["first_file"] is None
+
+
+def test_single_key_paths_are_not_globs():
+    project = Projection({"any": "/*", "user": "user"})
+    assert project({"*": 1, "user": "U1", "other": 2}) == {"any": 1, "user": "U1"}
+    assert project({"other": 2}) == {"any": None, "user": None}
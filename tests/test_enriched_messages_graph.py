@@ -0,0 +1,53 @@
+import bonobo
+
+from async_slack import db
+from async_slack.enriched_messages_graph import (
+    get_enriched_messages_graph, get_enriched_messages_services
+)
+from async_slack.synthetic_workspace import SyntheticWorkspace, WorkspaceSpec
+
+SPEC = WorkspaceSpec(users=5, channels=3, days=3, messages_per_day=4)
+
+
+def enrich(database, workspace):
+    base_services = {"database": database, "directory": db.Directory(database)}
+    bonobo.run(
+        get_enriched_messages_graph(workspace.spec.start_date, workspace.end_date),
+        services=get_enriched_messages_services(base_services)
+    )
+
+
+def test_enriches_each_date(tmp_path):
+    workspace = SyntheticWorkspace(SPEC)
+    database = db.JsonFsDatabase(tmp_path)
+    workspace.populate(database)
+    enrich(database, workspace)
+
+    partitions = [date.isoformat() for date in workspace.dates]
+    assert database.partitions(db.ENRICHED_MESSAGES) == partitions
+    message = next(database.read(db.ENRICHED_MESSAGES, partitions[0]))
+    assert message["channel_name"].startswith("channel-")
+    assert message["user_full_name"].startswith("User ")
+
+
+def test_unchanged_dates_are_skipped(tmp_path):
+    workspace = SyntheticWorkspace(SPEC)
+    database = db.JsonFsDatabase(tmp_path)
+    workspace.populate(database)
+    enrich(database, workspace)
+    first, second, third = [date.isoformat() for date in workspace.dates]
+    before = {
+        partition: database.fingerprint(db.ENRICHED_MESSAGES, partition)
+        for partition in (first, second, third)
+    }
+
+    with database.open_writer(db.RAW_THREADS, second) as sink:
+        sink.write(next(database.read(db.RAW_THREADS, first)))
+    # The inputs of the first date are unchanged, so its deleted
+    # partition is not rebuilt
+    (tmp_path / f"enriched-messages-{first}.json").unlink()
+    enrich(database, workspace)
+
+    assert database.fingerprint(db.ENRICHED_MESSAGES, first) is None
+    assert database.fingerprint(db.ENRICHED_MESSAGES, second) != before[second]
+    assert database.fingerprint(db.ENRICHED_MESSAGES, third) == before[third]
@@ -0,0 +1,113 @@
+import asyncio
+import contextlib
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from async_slack.fake_slack import CassetteBackend, FakeSlackServer, SyntheticBackend
+from async_slack.messages_fetcher import (
+    fetch_history, get_history_async, get_time_bounds
+)
+from async_slack.slack import AsyncSlackSession, RateLimitedError, RateLimitScheduler
+from async_slack.synthetic_workspace import SyntheticWorkspace, WorkspaceSpec
+
+WORKSPACE = SyntheticWorkspace(
+    WorkspaceSpec(users=7, channels=2, days=3, messages_per_day=8))
+CHANNEL_ID = WORKSPACE.channels()[0]["id"]
+
+
+@contextlib.asynccontextmanager
+async def serve(server):
+    runner = web.AppRunner(server.application())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    # Tier limits are per minute, far too slow for a test
+    scheduler = RateLimitScheduler(headroom=100)
+    try:
+        async with AsyncSlackSession(
+                "xoxp-test", 4, scheduler, f"http://127.0.0.1:{port}/api") as session:
+            yield session
+    finally:
+        await runner.cleanup()
+
+
+def run(server, call):
+    async def main():
+        async with serve(server) as session:
+            return await call(session)
+    return asyncio.run(main())
+
+
+def test_history_is_paginated():
+    server = FakeSlackServer(SyntheticBackend(WORKSPACE))
+    oldest, latest = get_time_bounds(WORKSPACE.spec.start_date, WORKSPACE.end_date)
+
+    messages = run(server, lambda session: fetch_history(
+        session, CHANNEL_ID, latest, oldest, limit=3))
+
+    expected = [
+        message for date in WORKSPACE.dates
+        for message in WORKSPACE.history(CHANNEL_ID, date)
+    ]
+    assert sorted(message["ts"] for message in messages) \
+        == sorted(message["ts"] for message in expected)
+    assert server.calls["conversations.history"] == -(-len(expected) // 3)
+
+
+def test_users_are_paginated_with_cursors():
+    server = FakeSlackServer(SyntheticBackend(WORKSPACE))
+
+    async def list_users(session):
+        users, cursor = [], None
+        while True:
+            response = await session.users_list(limit=3, cursor=cursor)
+            users.extend(response["members"])
+            cursor = response["response_metadata"]["next_cursor"]
+            if not cursor:
+                return users
+
+    users = run(server, list_users)
+    assert [user["id"] for user in users] == [user["id"] for user in WORKSPACE.users()]
+    assert server.calls["users.list"] == 3
+
+
+def test_rate_limit_pauses_the_method():
+    server = FakeSlackServer(
+        SyntheticBackend(WORKSPACE), rate_limit_share=1.0, retry_after=7)
+
+    async def call(session):
+        with pytest.raises(RateLimitedError) as excinfo:
+            await session.users_list()
+        return excinfo.value, session.scheduler.remaining()
+
+    error, remaining = run(server, call)
+    assert (error.method, error.retry_after) == ("users.list", 7)
+    assert remaining["users.list"] == 0
+
+
+def test_rate_limited_calls_are_retried_after_retry_after():
+    # With this seed, only the first call is answered with a 429
+    server = FakeSlackServer(
+        SyntheticBackend(WORKSPACE), rate_limit_share=0.5, retry_after=1, seed=9)
+
+    response = run(server, lambda session: get_history_async(
+        session, CHANNEL_ID, None, None))
+
+    assert response["ok"]
+    assert server.rate_limited["conversations.history"] == 1
+    assert server.calls["conversations.history"] == 2
+
+
+def test_cassette_miss_fails_without_retrying(tmp_path):
+    server = FakeSlackServer(CassetteBackend(tmp_path / "cassette.json"))
+
+    async def call(session):
+        with pytest.raises(aiohttp.ClientResponseError) as excinfo:
+            await get_history_async(session, CHANNEL_ID, None, None)
+        return excinfo.value
+
+    assert run(server, call).status == 404
+    assert server.calls["conversations.history"] == 1
@@ -0,0 +1,100 @@
+import asyncio
+import contextlib
+import threading
+
+import pytest
+from aiohttp import web
+
+from async_slack import db
+from async_slack.date_utils import WorkingDays
+from async_slack.fake_slack import FakeSlackServer, SyntheticBackend
+from async_slack.ingestion_graph import update_ingestion
+from async_slack.message_count_graph import update_message_count
+from async_slack.raw_threads_graph import update_raw_threads
+from async_slack.slack import AsyncSlackClient, RateLimitScheduler
+from async_slack.synthetic_workspace import SyntheticWorkspace, WorkspaceSpec
+
+WORKSPACE = SyntheticWorkspace(
+    WorkspaceSpec(users=6, channels=3, days=4, messages_per_day=6))
+
+
+@contextlib.contextmanager
+def serve(server):
+    """ Serve the fake Slack API from a thread, yielding its URL """
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(server.application())
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{port}/api"
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.run_until_complete(runner.cleanup())
+        loop.close()
+
+
+@pytest.fixture(scope="module")
+def slack_url():
+    with serve(FakeSlackServer(SyntheticBackend(WORKSPACE))) as url:
+        yield url
+
+
+def base_services(directory, slack_url):
+    database = db.JsonFsDatabase(directory)
+    WORKSPACE.populate(database)
+    client = AsyncSlackClient("xoxp-test", base_url=slack_url)
+    # Tier limits are per minute, far too slow for a test
+    client._scheduler = RateLimitScheduler(headroom=100)
+    return {
+        "database": database,
+        "directory": db.Directory(database),
+        "working_days": WorkingDays(),
+        "slack": client,
+    }
+
+
+def ingested(database):
+    message_count = db.MessageCount(database)
+    counts = {
+        date: sorted(message_count.get_channels_for_day(date))
+        for date in WORKSPACE.dates
+    }
+    raw_threads = {
+        date: sorted(
+            database.read(db.RAW_THREADS, date.isoformat()),
+            key=lambda record: (record["channel"], record["ts"]))
+        for date in WORKSPACE.dates
+    }
+    return counts, raw_threads
+
+
+@pytest.fixture(scope="module")
+def separate_graphs(tmp_path_factory, slack_url):
+    services = base_services(tmp_path_factory.mktemp("separate"), slack_url)
+    update_message_count(WORKSPACE.spec.start_date, WORKSPACE.end_date, services)
+    update_raw_threads(WORKSPACE.spec.start_date, WORKSPACE.end_date, 0, services)
+    return ingested(services["database"])
+
+
+@pytest.mark.parametrize("backfill", [False, True])
+def test_ingestion_matches_separate_graphs(
+        tmp_path, slack_url, separate_graphs, backfill):
+    services = base_services(tmp_path, slack_url)
+    update_ingestion(
+        WORKSPACE.spec.start_date, WORKSPACE.end_date, 0, services,
+        backfill=backfill)
+
+    counts, raw_threads = ingested(services["database"])
+    assert counts == separate_graphs[0]
+    assert raw_threads == separate_graphs[1]
+    records = [record for records in raw_threads.values() for record in records]
+    assert len(records) \
+        == sum(1 for date in WORKSPACE.dates for _ in WORKSPACE.raw_threads(date))
+    assert any(record.get("thread") for record in records)
+    status = db.Status(services["database"])
+    assert all(status.is_message_count_complete(date) for date in WORKSPACE.dates)
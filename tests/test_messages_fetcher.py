@@ -0,0 +1,69 @@
+import contextlib
+import datetime
+
+import bonobo
+
+from async_slack.messages_fetcher import AsyncMessagesFetcher
+
+DAY = datetime.date(2020, 1, 6)
+HISTORIES = {
+    "C1": [{"ts": f"{index}.0"} for index in range(5, 0, -1)],
+    "C2": [{"ts": "7.0"}],
+}
+
+
+class FakeSession:
+    """ Serve each history newest first, two messages per page """
+
+    def __init__(self, calls):
+        self._calls = calls
+
+    async def conversations_history(self, channel_id, oldest, latest, limit):
+        self._calls.append((channel_id, latest, limit))
+        messages = [
+            message for message in HISTORIES[channel_id]
+            if latest is None or float(message["ts"]) < float(latest)
+        ]
+        return {"ok": True, "messages": messages[:2], "has_more": len(messages) > 2}
+
+
+class FakeSlack:
+
+    def __init__(self):
+        self.calls = []
+
+    @contextlib.asynccontextmanager
+    async def connect(self):
+        yield FakeSession(self.calls)
+
+
+def fetch(fetcher, slack):
+    fetched = []
+
+    def extract():
+        yield from HISTORIES
+
+    graph = bonobo.Graph()
+    graph.add_chain(extract, fetcher, lambda *args: fetched.append(args))
+    bonobo.run(graph, services={"slack": slack})
+    return fetched
+
+
+def test_fetches_every_page_of_every_channel():
+    slack = FakeSlack()
+    fetched = fetch(AsyncMessagesFetcher(DAY, DAY + datetime.timedelta(days=1)), slack)
+
+    expected = [
+        (channel_id, message["ts"])
+        for channel_id, messages in HISTORIES.items() for message in messages
+    ]
+    assert sorted((channel_id, message["ts"]) for channel_id, message in fetched) \
+        == sorted(expected)
+    assert [call for call in slack.calls if call[0] == "C1"][1:] == [
+        ("C1", "4.0", None), ("C1", "2.0", None)]
+
+
+def test_page_size_is_passed_as_limit():
+    slack = FakeSlack()
+    fetch(AsyncMessagesFetcher(DAY, DAY, page_size=999), slack)
+    assert {limit for _, _, limit in slack.calls} == {999}
@@ -0,0 +1,116 @@
+import datetime
+import json
+import logging
+
+import bonobo
+
+from async_slack import db, sqlite_db
+from async_slack.config import Configuration
+from async_slack.instrumentation import run_graph
+from async_slack.metrics import Metrics
+from async_slack.update_database import write_reports
+
+
+def test_run_graph_records_node_counts():
+    registry = Metrics()
+
+    def extract():
+        yield from range(10)
+
+    def evens(number):
+        if number % 2 == 0:
+            yield number
+
+    def fail_on_four(number):
+        if number == 4:
+            raise ValueError(number)
+        yield number
+
+    graph = bonobo.Graph()
+    graph.add_chain(extract, evens)
+    graph.add_chain(fail_on_four, _input=extract)
+    run_graph(graph, {}, "test phase", registry=registry)
+
+    nodes = registry.report()["nodes"]["test phase"]
+    assert nodes["extract"]["out"] == 10
+    assert (nodes["evens"]["in"], nodes["evens"]["out"]) == (10, 5)
+    assert nodes["fail_on_four"]["errors"] == 1
+    assert all(counters["runs"] == 1 for counters in nodes.values())
+
+
+def test_prometheus_lines():
+    registry = Metrics()
+    registry.record_phase("users", 1.5)
+    registry.record_api_call("users.list", 0.25)
+    registry.record_api_call("users.list", 0.5, outcome="rate_limited")
+    registry.record_api_call("conversations.history", 0.1, channel="C1")
+    registry.record_retry("get_users")
+    registry.record_bytes_written(db.USERS, "users.json", 100)
+    registry.record_bytes_written(db.RAW_THREADS, "raw-threads-2020-01-01.json", 10)
+    registry.record_bytes_written(db.RAW_THREADS, "raw-threads-2020-01-02.json", 20)
+
+    lines = list(registry.prometheus_lines())
+    assert 'async_slack_phase_seconds{phase="users"} 1.5' in lines
+    assert 'async_slack_api_calls{method="users.list"} 2' in lines
+    assert 'async_slack_api_rate_limited{method="users.list"} 1' in lines
+    assert 'async_slack_api_retries{function="get_users"} 1' in lines
+    assert 'async_slack_bytes_written{store="raw_threads"} 30' in lines
+    assert "# TYPE async_slack_run_seconds gauge" in lines
+
+    report = registry.report()
+    assert report["api"]["conversations.history"]["by_channel"]["C1"]["calls"] == 1
+    assert report["bytes_written"]["raw-threads-2020-01-02.json"] == 20
+
+
+def test_label_values_are_escaped():
+    registry = Metrics()
+    registry.record_phase('a "quoted"\nphase', 1.5)
+    assert r'async_slack_phase_seconds{phase="a \"quoted\"\nphase"} 1.5' \
+        in list(registry.prometheus_lines())
+
+
+def test_databases_record_encoded_bytes(tmp_path, monkeypatch):
+    registry = Metrics()
+    monkeypatch.setattr(db.metrics, "registry", registry)
+    entry = {"ts": "1.0", "text": "café ☕"}
+    encoded = json.dumps(entry).encode("utf-8")
+
+    with db.JsonFsDatabase(tmp_path / "json").open_writer(db.USERS) as sink:
+        sink.write(entry)
+    with sqlite_db.SqliteDatabase(tmp_path / "sqlite").open_writer(db.USERS) as sink:
+        sink.write(entry)
+
+    assert registry.store_bytes[db.USERS] == 2 * len(encoded) + 1
+
+
+def configuration(tmp_path, **kwargs):
+    return Configuration(
+        database_directory=tmp_path,
+        start_date=datetime.date(2020, 1, 1),
+        end_date=datetime.date(2020, 1, 2),
+        threads_lookback_working_days=3,
+        token_command=[],
+        **kwargs
+    )
+
+
+def test_write_reports(tmp_path):
+    write_reports(configuration(
+        tmp_path,
+        run_report=tmp_path / "run-report.json",
+        prometheus_textfile=tmp_path / "textfile" / "async_slack.prom"
+    ))
+    assert "phases" in json.loads((tmp_path / "run-report.json").read_text())
+    assert (tmp_path / "textfile" / "async_slack.prom").read_text().startswith("# HELP")
+
+
+def test_write_reports_logs_failures(tmp_path, caplog):
+    (tmp_path / "run-report.json").mkdir()
+    with caplog.at_level(logging.ERROR):
+        write_reports(configuration(
+            tmp_path,
+            run_report=tmp_path / "run-report.json",
+            prometheus_textfile=tmp_path / "async_slack.prom"
+        ))
+    assert "Could not write" in caplog.text
+    assert (tmp_path / "async_slack.prom").exists()
@@ -0,0 +1,59 @@
+from async_slack import db
+from async_slack.migrate_codec import migrate_store
+from async_slack.serialization import MSGPACK_MAGIC, get_codec
+
+RECORDS = [{"ts": f"{index}.0", "text": f"message {index}"} for index in range(50)]
+
+
+def write(database, store, partition, records):
+    with database.open_writer(store, partition) as sink:
+        for record in records:
+            sink.write(record)
+
+
+def test_records_survive_migration(tmp_path):
+    database = db.JsonFsDatabase(tmp_path)
+    write(database, db.USERS, None, RECORDS)
+    write(database, db.RAW_THREADS, "2020-01-01", RECORDS)
+    write(database, db.RAW_THREADS, "2020-01-02", [])
+
+    for store in (db.USERS, db.RAW_THREADS):
+        migrate_store(database, store, get_codec("msgpack"))
+
+    assert (tmp_path / "users.json").read_bytes().startswith(MSGPACK_MAGIC)
+    assert list(database.read(db.USERS)) == RECORDS
+    assert list(database.read(db.RAW_THREADS, "2020-01-01")) == RECORDS
+    assert list(database.read(db.RAW_THREADS, "2020-01-02")) == []
+    assert database.partitions(db.RAW_THREADS) == ["2020-01-01", "2020-01-02"]
+
+
+def test_missing_unpartitioned_store_is_not_created(tmp_path):
+    database = db.JsonFsDatabase(tmp_path)
+    migrate_store(database, db.CHANNELS, get_codec("orjson"))
+    assert database.fingerprint(db.CHANNELS) is None
+
+
+def test_records_are_streamed(tmp_path, monkeypatch):
+    events = []
+
+    class RecordingDatabase(db.JsonFsDatabase):
+        def read(self, store, partition=None):
+            for record in super().read(store, partition):
+                events.append("read")
+                yield record
+
+    database = RecordingDatabase(tmp_path)
+    write(database, db.ENRICHED_MESSAGES, "2020-01-01", RECORDS)
+    original_write = db._FileSink.write
+
+    def recording_write(sink, record):
+        events.append("write")
+        original_write(sink, record)
+
+    monkeypatch.setattr(db._FileSink, "write", recording_write)
+    migrate_store(database, db.ENRICHED_MESSAGES, get_codec("orjson"))
+    monkeypatch.undo()
+
+    # Each record is written before the next is read
+    assert events[:4] == ["read", "write", "read", "write"]
+    assert list(database.read(db.ENRICHED_MESSAGES, "2020-01-01")) == RECORDS
@@ -0,0 +1,80 @@
+import cProfile
+import pstats
+import re
+import threading
+
+from async_slack import profiling
+from async_slack.profiling import PhaseProfiler, collapsed_stacks
+
+
+def busy(iterations):
+    total = 0
+    for index in range(iterations):
+        total += index * index
+    return total
+
+
+def work():
+    busy(200000)
+    busy(10)
+
+
+def test_collapsed_stacks_share_time_between_callers():
+    profile = cProfile.Profile()
+    profile.runcall(work)
+    stats = pstats.Stats(profile)
+
+    stacks = dict(collapsed_stacks(stats, min_fraction=0))
+    total = sum(stats.stats[function][3] for function in stats.stats
+                if not stats.stats[function][4])
+    assert abs(sum(stacks.values()) - total * 1e6) <= len(stacks)
+    assert any(stack[-1].startswith("busy ") for stack in stacks)
+
+
+def test_collapsed_stacks_drop_a_fraction_of_the_total():
+    profile = cProfile.Profile()
+    profile.runcall(work)
+    stats = pstats.Stats(profile)
+
+    every_stack = dict(collapsed_stacks(stats, min_fraction=0))
+    kept = dict(collapsed_stacks(stats, min_fraction=0.05))
+    total = sum(every_stack.values())
+    assert 0 < len(kept) < len(every_stack)
+    assert all(microseconds >= 0.05 * total for microseconds in kept.values())
+
+
+def test_phase_profiles_threads_started_within_it(tmp_path):
+    profiler = PhaseProfiler(tmp_path, cpu=True)
+    with profiler.phase("raw threads"):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+
+    assert (tmp_path / "01-raw-threads.pstats").exists()
+    collapsed = (tmp_path / "01-raw-threads.collapsed").read_text()
+    assert re.search(r";busy \(.*test_profiling.py:\d+\) \d+$", collapsed, re.MULTILINE)
+
+
+def test_memory_peak_excludes_writing_the_cpu_profile(tmp_path, monkeypatch):
+    def write_collapsed(stats, path):
+        # Allocates far more than the phase itself
+        garbage = bytearray(64 << 20)
+        open(path, "w").close()
+        del garbage
+
+    monkeypatch.setattr(profiling, "write_collapsed", write_collapsed)
+    profiler = PhaseProfiler(tmp_path, cpu=True, memory=True)
+    with profiler.phase("enrichment"):
+        data = bytearray(4 << 20)
+        del data
+
+    report = (tmp_path / "01-enrichment.tracemalloc.txt").read_text()
+    peak = float(re.search(r"Peak traced memory: ([\d.]+) MiB", report).group(1))
+    assert 4 <= peak < 32
+
+
+def test_disabled_profiler_writes_nothing(tmp_path):
+    profiler = PhaseProfiler(tmp_path / "profiles")
+    with profiler.phase("users"):
+        pass
+    assert not (tmp_path / "profiles").exists()
@@ -0,0 +1,114 @@
+import asyncio
+import contextlib
+
+import bonobo
+
+from async_slack import db
+from async_slack.raw_threads_graph import ThreadHydrator
+
+CHANNEL_ID = "C1"
+
+
+def make_message(ts, thread_ts=None, latest_reply=None):
+    record = {"ts": ts, "user": "U1", "blocks": []}
+    if thread_ts is not None:
+        record["thread_ts"] = thread_ts
+    if latest_reply is not None:
+        record["latest_reply"] = latest_reply
+    return record
+
+
+def parent(ts, latest_reply="100.0"):
+    return make_message(ts, ts, latest_reply)
+
+
+class FakeSession:
+    """ Answer later threads sooner, so that replies arrive out of order """
+
+    def __init__(self, slack, fetched):
+        self._slack = slack
+        self._fetched = fetched
+
+    async def conversations_replies(self, channel_id, thread_ts, oldest):
+        self._fetched.append(thread_ts)
+        await asyncio.sleep(0.01 / float(thread_ts))
+        reply = {"ts": f"{thread_ts}1", "user": self._slack.reply_user, "blocks": []}
+        return {"messages": [make_message(thread_ts), reply], "has_more": False}
+
+
+class FakeSlack:
+
+    def __init__(self, reply_user="U2"):
+        self.reply_user = reply_user
+        # The threads fetched on each connection, so once per batch
+        self.connections = []
+
+    @contextlib.asynccontextmanager
+    async def connect(self):
+        fetched = []
+        self.connections.append(fetched)
+        yield FakeSession(self, fetched)
+
+
+def hydrate(messages, slack, thread_cache, **options):
+    hydrated = []
+
+    def extract():
+        for message in messages:
+            yield CHANNEL_ID, message
+
+    graph = bonobo.Graph()
+    graph.add_chain(extract, ThreadHydrator(**options), hydrated.append)
+    bonobo.run(graph, services={"slack": slack, "thread_cache": thread_cache})
+    return hydrated
+
+
+def test_batches_keep_their_order_and_only_parents_get_threads(tmp_path):
+    messages = [
+        parent("1.0"), parent("2.0"), make_message("3.0"),
+        parent("4.0"), parent("5.0"), make_message("6.0", thread_ts="5.0"),
+        parent("7.0"),
+    ]
+    slack = FakeSlack()
+    thread_cache = db.ThreadCache(db.JsonFsDatabase(tmp_path))
+
+    hydrated = hydrate(messages, slack, thread_cache, batch_size=3)
+
+    assert [message["ts"] for message in hydrated] \
+        == ["1.0", "2.0", "3.0", "4.0", "5.0", "6.0", "7.0"]
+    for message in hydrated:
+        if message["ts"] in ("3.0", "6.0"):
+            assert "thread" not in message
+        else:
+            assert [reply["ts"] for reply in message["thread"]] == [message["ts"] + "1"]
+    # One flush per full batch, and the rest when the graph ends
+    assert [sorted(fetched) for fetched in slack.connections] \
+        == [["1.0", "2.0"], ["4.0", "5.0"], ["7.0"]]
+
+
+def test_cached_threads_are_reused_until_a_newer_reply(tmp_path):
+    hydrate([parent("1.0"), parent("2.0")],
+            FakeSlack(reply_user="U2"), db.ThreadCache(db.JsonFsDatabase(tmp_path)))
+
+    # A new cache over the same database, as on the next run
+    slack = FakeSlack(reply_user="U3")
+    hydrated = hydrate(
+        [parent("1.0"), parent("2.0", latest_reply="200.0")],
+        slack, db.ThreadCache(db.JsonFsDatabase(tmp_path)))
+
+    assert slack.connections == [["2.0"]]
+    assert [message["thread"][0]["user"] for message in hydrated] == ["U2", "U3"]
+
+
+def test_thread_cache_round_trip(tmp_path):
+    thread_cache = db.ThreadCache(db.JsonFsDatabase(tmp_path))
+    replies = [{"ts": "1.1", "user": "U2", "blocks": []}]
+    thread_cache.set(CHANNEL_ID, "1.0", "1.1", replies)
+    thread_cache.set(CHANNEL_ID, "2.0", None, replies)
+    thread_cache.save()
+
+    thread_cache = db.ThreadCache(db.JsonFsDatabase(tmp_path))
+    assert thread_cache.get(CHANNEL_ID, "1.0", "1.1") == replies
+    assert thread_cache.get(CHANNEL_ID, "1.0", "1.2") is None
+    assert thread_cache.get(CHANNEL_ID, "1.0", None) is None
+    assert thread_cache.get(CHANNEL_ID, "2.0", "1.1") is None
@@ -0,0 +1,72 @@
+import datetime
+import sqlite3
+
+from async_slack import db
+from async_slack.sqlite_db import DATABASE_FILE_NAME, SqliteDatabase
+
+USERS = [{"id": "U1", "name": "ada"}, {"id": "U2", "name": "grace"}]
+
+
+def write(database, store, records, partition=None):
+    with database.open_writer(store, partition) as sink:
+        for record in records:
+            sink.write(record)
+
+
+def test_fingerprint_follows_content(tmp_path):
+    database = SqliteDatabase(tmp_path)
+    assert database.fingerprint(db.USERS) is None
+
+    write(database, db.USERS, USERS)
+    fingerprint = database.fingerprint(db.USERS)
+    write(database, db.USERS, USERS)
+    assert database.fingerprint(db.USERS) == fingerprint
+
+    write(database, db.USERS, USERS[:1])
+    assert database.fingerprint(db.USERS) != fingerprint
+
+
+def test_directory_fingerprint_survives_rewrites(tmp_path):
+    database = SqliteDatabase(tmp_path)
+    write(database, db.USERS, USERS)
+    write(database, db.CHANNELS, [{"id": "C1", "name": "general"}])
+    fingerprint = db.Directory(database).fingerprint()
+
+    write(database, db.USERS, USERS)
+    write(database, db.CHANNELS, [{"id": "C1", "name": "general"}])
+    assert db.Directory(database).fingerprint() == fingerprint
+
+
+def test_generations_without_a_digest(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / DATABASE_FILE_NAME))
+    connection.executescript("""
+        CREATE TABLE generations (
+            store TEXT NOT NULL,
+            partition TEXT NOT NULL,
+            generation TEXT NOT NULL,
+            PRIMARY KEY (store, partition)
+        );
+        INSERT INTO generations VALUES ('users', '', 'abc');
+    """)
+    connection.close()
+
+    database = SqliteDatabase(tmp_path)
+    assert database.fingerprint(db.USERS) == "abc"
+    write(database, db.USERS, USERS)
+    assert database.fingerprint(db.USERS) != "abc"
+
+
+def test_state_is_shared_between_readers(tmp_path):
+    database = SqliteDatabase(tmp_path)
+    date = datetime.date(2020, 1, 1)
+    first, second = db.Status(database), db.Status(database)
+    assert first._lock is second._lock
+
+    first.set_message_count_complete(date)
+    second.set_raw_threads_complete(date)
+    assert second.is_message_count_complete(date)
+    assert first.is_raw_threads_complete(date)
+
+    reopened = db.Status(SqliteDatabase(tmp_path))
+    assert reopened.is_message_count_complete(date)
+    assert reopened.is_raw_threads_complete(date)
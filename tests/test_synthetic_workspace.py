@@ -0,0 +1,24 @@
+import subprocess
+import sys
+
+from async_slack.synthetic_workspace import SyntheticWorkspace, WorkspaceSpec
+
+SPEC = WorkspaceSpec(users=5, channels=2, days=2, messages_per_day=4)
+
+
+def test_workspace_is_deterministic():
+    first, second = SyntheticWorkspace(SPEC), SyntheticWorkspace(SPEC)
+    date = first.dates[0]
+    assert list(first.raw_threads(date)) == list(second.raw_threads(date))
+    assert first.message_count() == second.message_count()
+
+
+def test_generating_needs_no_graph_dependencies():
+    script = (
+        "import sys\n"
+        "for name in ('bonobo', 'aiohttp', 'slacker'):\n"
+        "    sys.modules[name] = None\n"
+        "from async_slack.synthetic_workspace import SyntheticWorkspace, WorkspaceSpec\n"
+        "SyntheticWorkspace(WorkspaceSpec(days=1)).message_count()\n"
+    )
+    subprocess.run([sys.executable, "-c", script], check=True)